@@ -8,6 +8,35 @@ from apikit.convenience import raise_from_response
 from apikit.convenience import get_logger
 from apikit.convenience import APIFlask
 from apikit.convenience import BackendError
+from apikit.convenience import ResponseStream
+from apikit.convenience import handle_backend_error
+from apikit.auth import Authenticator
+from apikit.auth import auth_required
+from apikit.profiler import SamplingProfiler
+from apikit.profiler import add_profiler_route
+from apikit.slowrequest import SlowRequestDetector
+from apikit.server import PreforkServer
+from apikit.records import iter_json_records
+from apikit.pagination import paginate
+from apikit.cache import MemoryCache
+from apikit.cache import SharedCache
+from apikit.tcpsyslog import TCPSysLogHandler
+from apikit.logrotate import RotatingCompressingFileHandler
+from apikit.tracing import Tracer
+from apikit.tracing import JSONLinesExporter
+from apikit.warmup import DNSCache
+from apikit.health import HealthMonitor
+from apikit.fastpath import FastPathDispatcher
+from apikit.health import add_health_routes
+from apikit.warmup import Warmup
 __all__ = ['set_flask_metadata', 'add_metadata_route', 'retry_request',
            'raise_from_response', 'raise_ise', 'get_logger',
-           'APIFlask', 'BackendError']
+           'APIFlask', 'BackendError', 'SamplingProfiler',
+           'add_profiler_route', 'SlowRequestDetector', 'PreforkServer',
+           'ResponseStream', 'iter_json_records',
+           'paginate', 'MemoryCache', 'SharedCache',
+           'TCPSysLogHandler', 'RotatingCompressingFileHandler',
+           'Tracer', 'JSONLinesExporter', 'Authenticator',
+           'auth_required', 'DNSCache', 'Warmup', 'HealthMonitor',
+           'add_health_routes', 'handle_backend_error',
+           'FastPathDispatcher']
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+"""Enforcement of an app's configured authentication, with caching"""
+import functools
+import hashlib
+import hmac
+import os
+from flask import Response, current_app, request
+from requests.utils import quote
+from werkzeug.security import check_password_hash
+from apikit.cache import MemoryCache
+from apikit.convenience import BackendError, raise_from_response
+from apikit.warmup import upstream_session
+
+# Cached verdicts, one byte each so that the cache's size bound counts
+#  entries.
+_GOOD = b"\x01"
+_BAD = b"\x00"
+
+
+class Authenticator(object):
+    """
+    Enforces the `AUTH` type recorded by :func:`apikit.set_flask_metadata`
+    for views decorated with :func:`apikit.auth_required`.
+
+    * `none`: every request is allowed.
+    * `basic`: HTTP Basic credentials must match `username` and either
+      `password` or `password_hash` (a :mod:`werkzeug.security` hash) in
+      the auth `data`.
+    * `bitly-proxy`: the GitHub token passed on by the proxy in
+      `X-Forwarded-Access-Token` (or as the password of HTTP Basic
+      credentials) must belong, according to the GitHub API at
+      `data["api"]` if set, to an active member of `data["organization"]`
+      or to one of the logins listed in `data["users"]`.  At least one of
+      the two must be configured: merely holding a GitHub token proves
+      nothing.
+
+    Each verdict is cached, under a salted hash of the credential so that
+    no secret is held in memory, for `ttl` seconds if the credential was
+    good and `negative_ttl` seconds if not, so that repeated requests cost
+    a dictionary lookup rather than an upstream call or a password hash.
+    At most `max_entries` verdicts are kept.  Verification errors (such as
+    GitHub being unreachable, or refusing with `403` because its rate
+    limit is exhausted) are raised, not cached.
+
+    Parameters
+    ----------
+    app: :class:`apikit.APIFlask` or `None`
+        Application to attach to.  If `None`, call `init_app` later.
+
+    ttl: `float`, optional
+        Seconds to trust a verified credential.  Defaults to `300`.
+
+    negative_ttl: `float`, optional
+        Seconds to remember a rejected credential.  Defaults to `30`.
+
+    max_entries: `int`, optional
+        Most verdicts to cache.  Defaults to `10000`.
+
+    verify: callable or `None`, optional
+        Replaces the built-in check: called as `verify(auth_type, data,
+        credential)`, where `credential` is a `(username, password)` tuple
+        for `basic` and a token for `bitly-proxy`, and returns whether the
+        credential is good.
+
+    Raises
+    ------
+    ValueError
+        If the app's auth type is `bitly-proxy`, no `verify` is given, and
+        its auth data has neither `organization` nor `users`.
+    """
+
+    def __init__(self, app=None, ttl=300, negative_ttl=30,
+                 max_entries=10000, verify=None):
+        """Create a new authenticator."""
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.verify = verify
+        self._cache = MemoryCache(ttl=ttl, max_bytes=max_entries)
+        self._salt = os.urandom(16)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Attach the authenticator to `app`."""
+        auth = app.config.get("AUTH") or {}
+        data = auth.get("data") or {}
+        if (auth.get("type") == "bitly-proxy" and self.verify is None and
+                not data.get("organization") and not data.get("users")):
+            raise ValueError("bitly-proxy auth requires 'organization' or "
+                             "'users' in its data")
+        app.config["AUTHENTICATOR"] = self
+
+    def _key(self, atype, credential):
+        """Cache key for a credential."""
+        if isinstance(credential, tuple):
+            credential = "\0".join(credential)
+        return hmac.new(self._salt, (atype + "\0" + credential).encode(
+            "utf-8"), hashlib.sha256).hexdigest()
+
+    def credential(self):
+        """The current request's credential for the app's auth type, or
+        `None` if it supplied none.
+        """
+        atype = current_app.config["AUTH"]["type"]
+        creds = request.authorization
+        if atype == "basic":
+            if creds is None:
+                return None
+            return (str(creds.username or ""), str(creds.password or ""))
+        token = request.headers.get("X-Forwarded-Access-Token")
+        if not token and creds is not None:
+            token = creds.password
+        return str(token) if token else None
+
+    def check(self):
+        """Is the current request authenticated?"""
+        auth = current_app.config["AUTH"]
+        atype = auth["type"]
+        if atype == "none":
+            return True
+        credential = self.credential()
+        if credential is None:
+            return False
+        key = self._key(atype, credential)
+        verdict = self._cache.get(key)
+        if verdict is not None:
+            return verdict == _GOOD
+        data = auth.get("data") or {}
+        if self.verify is not None:
+            good = bool(self.verify(atype, data, credential))
+        elif atype == "basic":
+            good = _verify_basic(data, credential)
+        else:
+            good = _verify_github(data, credential)
+        if good:
+            self._cache.set(key, _GOOD, self.ttl)
+        else:
+            self._cache.set(key, _BAD, self.negative_ttl)
+        return good
+
+    def invalidate(self, credential=None):
+        """Forget the cached verdict for `credential` (a `(username,
+        password)` tuple or a token), or for every credential if `None`.
+        """
+        if credential is None:
+            self._cache.clear()
+            return
+        for atype in ("basic", "bitly-proxy"):
+            self._cache.delete(self._key(atype, credential))
+
+    def challenge(self):
+        """Response refusing an unauthenticated request."""
+        return Response("Authentication required\n", 401,
+                        {"WWW-Authenticate": 'Basic realm="apikit"'})
+
+
+def authenticator(app):
+    """Return `app`'s :class:`apikit.auth.Authenticator`, attaching one
+    with default settings if there is none yet.
+    """
+    found = app.config.get("AUTHENTICATOR")
+    if found is None:
+        found = Authenticator(app)
+    return found
+
+
+def auth_required(view):
+    """Decorator for Flask views which must be authenticated according to
+    the app's `AUTH` configuration; see :class:`apikit.auth.Authenticator`.
+    Unauthenticated requests get a `401` response.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        """Check credentials, then call the view."""
+        auth = authenticator(current_app)
+        if not auth.check():
+            return auth.challenge()
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def _verify_basic(data, credential):
+    """Check a username and password against the auth data."""
+    username, password = credential
+    if not data.get("username"):
+        return False
+    user_ok = hmac.compare_digest(username.encode("utf-8"),
+                                  str(data["username"]).encode("utf-8"))
+    if data.get("password_hash"):
+        pass_ok = check_password_hash(data["password_hash"], password)
+    else:
+        pass_ok = hmac.compare_digest(
+            password.encode("utf-8"),
+            str(data.get("password", "")).encode("utf-8"))
+    return user_ok and pass_ok
+
+
+def _verify_github(data, token):
+    """Check that a GitHub token belongs to an allowed user or an active
+    member of the allowed organization.
+    """
+    org = data.get("organization")
+    users = [str(user).lower() for user in data.get("users") or ()]
+    if not org and not users:
+        return False
+    api = data.get("api", "https://api.github.com").rstrip("/")
+    headers = {"Authorization": "token " + token,
+               "Accept": "application/vnd.github.v3+json"}
+    session = upstream_session()
+    if users:
+        resp = session.get(api + "/user", headers=headers, timeout=10)
+        if resp.status_code == 401:
+            return False
+        _raise_github_error(resp)
+        if str(resp.json().get("login", "")).lower() in users:
+            return True
+    if not org:
+        return False
+    # One call, however many organizations the user belongs to.
+    resp = session.get(api + "/user/memberships/orgs/" + quote(org, safe=""),
+                       headers=headers, timeout=10)
+    if resp.status_code in (401, 404):
+        return False
+    _raise_github_error(resp)
+    return resp.json().get("state") == "active"
+
+
+def _raise_github_error(resp):
+    """Raise a BackendError if a GitHub API call failed other than by
+    rejecting the token, such as by exhausting the rate limit.
+    """
+    if (resp.status_code == 403 and
+            resp.headers.get("X-RateLimit-Remaining") == "0"):
+        raise BackendError(status_code=503, reason="Service Unavailable",
+                           content="GitHub API rate limit exceeded")
+    raise_from_response(resp)
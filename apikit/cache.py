@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+"""Response caches for upstream requests"""
+import collections
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+class MemoryCache(object):
+    """
+    An in-process cache of `bytes` values, with a time-to-live for each
+    entry and least-recently-used eviction once `max_bytes` is exceeded.
+
+    Each process has its own copy, so under a multi-process server every
+    worker warms its own cache; see :class:`apikit.cache.SharedCache`.
+
+    Parameters
+    ----------
+    ttl: `float`, optional
+        Default lifetime of an entry in seconds.  Defaults to `300`.
+    max_bytes: `int`, optional
+        Total size of values to retain.  Defaults to 64 MiB.
+    """
+
+    def __init__(self, ttl=300, max_bytes=67108864):
+        """Create an empty cache."""
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the value for `key`, or `None` if absent or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.time():
+                self._drop(key)
+                return None
+            # Most recently used goes to the end.
+            del self._entries[key]
+            self._entries[key] = entry
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        """Store `value` (`bytes`) under `key` for `ttl` seconds."""
+        if ttl is None:
+            ttl = self.ttl
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (value, time.time() + ttl)
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def delete(self, key):
+        """Remove `key`, if present."""
+        with self._lock:
+            self._drop(key)
+
+    def clear(self):
+        """Remove every entry."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _drop(self, key):
+        """Remove `key` with the lock held."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[0])
+
+
+class SharedCache(object):
+    """
+    A cache of `bytes` values shared by every process on a host, stored in
+    an SQLite database in write-ahead-log mode.  Entries have a
+    time-to-live, and once their total size exceeds `max_bytes` the
+    oldest-written entries are evicted.
+
+    Writes are atomic transactions, and keep a running total of the
+    cache's size so that they do not slow down as it grows.  In WAL mode
+    readers never block on, or are blocked by, the writer, and reads do
+    not write (so eviction order is by age rather than by use).  Each
+    thread of each process opens its own connection on first use;
+    connections are never shared across `fork()`.
+
+    This has the same interface as :class:`apikit.cache.MemoryCache`, so
+    either may be passed as `cache` to :func:`apikit.retry_request`.
+
+    Parameters
+    ----------
+    path: `str`
+        Database file.  All processes sharing the cache must use the same
+        path on local (not network) storage.
+    ttl: `float`, optional
+        Default lifetime of an entry in seconds.  Defaults to `300`.
+    max_bytes: `int`, optional
+        Total size of values to retain.  Defaults to 256 MiB.
+    timeout: `float`, optional
+        Seconds a writer waits for another writer.  Defaults to `5`.
+    """
+
+    def __init__(self, path, ttl=300, max_bytes=268435456, timeout=5):
+        """Open (creating if necessary) a shared cache."""
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._local = threading.local()
+        conn = self._connection()
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS entries ("
+                         " key TEXT PRIMARY KEY,"
+                         " value BLOB NOT NULL,"
+                         " size INTEGER NOT NULL,"
+                         " stored REAL NOT NULL,"
+                         " expires REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_stored"
+                         " ON entries (stored)")
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_expires"
+                         " ON entries (expires)")
+            # Running total of value sizes, so that writes need not scan.
+            conn.execute("CREATE TABLE IF NOT EXISTS meta ("
+                         " id INTEGER PRIMARY KEY CHECK (id = 0),"
+                         " total INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO meta (id, total)"
+                         " SELECT 0, COALESCE(SUM(size), 0) FROM entries")
+
+    def _connection(self):
+        """This thread's connection, opened on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=self.timeout,
+                               isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.isolation_level = "IMMEDIATE"
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _key(key):
+        """Fixed-size database key."""
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return the value for `key`, or `None` if absent or expired."""
+        row = self._connection().execute(
+            "SELECT value FROM entries WHERE key = ? AND expires >= ?",
+            (self._key(key), time.time())).fetchone()
+        if row is None:
+            return None
+        return bytes(row[0])
+
+    def set(self, key, value, ttl=None):
+        """Store `value` (`bytes`) under `key` for `ttl` seconds."""
+        if ttl is None:
+            ttl = self.ttl
+        if len(value) > self.max_bytes:
+            return
+        now = time.time()
+        dbkey = self._key(key)
+        conn = self._connection()
+        with conn:
+            total = self._adjust(conn, len(value), dbkey)
+            conn.execute("INSERT OR REPLACE INTO entries"
+                         " (key, value, size, stored, expires)"
+                         " VALUES (?, ?, ?, ?, ?)",
+                         (dbkey, sqlite3.Binary(value), len(value),
+                          now, now + ttl))
+            if total > self.max_bytes:
+                self._evict(conn, now, total)
+
+    @staticmethod
+    def _adjust(conn, delta, replacing=None):
+        """Add `delta`, less the size of any entry under database key
+        `replacing`, to the running total; returns the new total.
+        """
+        conn.execute("UPDATE meta SET total = total + ? - COALESCE("
+                     "(SELECT size FROM entries WHERE key = ?), 0)"
+                     " WHERE id = 0", (delta, replacing))
+        return conn.execute("SELECT total FROM meta WHERE id = 0"
+                            ).fetchone()[0]
+
+    def _evict(self, conn, now, total):
+        """Drop expired, then oldest, entries until under `max_bytes`."""
+        freed = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries"
+                             " WHERE expires < ?", (now,)).fetchone()[0]
+        if freed:
+            conn.execute("DELETE FROM entries WHERE expires < ?", (now,))
+            total = self._adjust(conn, -freed)
+        if total <= self.max_bytes:
+            return
+        doomed = []
+        freed = 0
+        for key, size in conn.execute(
+                "SELECT key, size FROM entries ORDER BY stored"):
+            if total - freed <= self.max_bytes:
+                break
+            doomed.append((key,))
+            freed += size
+        conn.executemany("DELETE FROM entries WHERE key = ?", doomed)
+        self._adjust(conn, -freed)
+
+    def delete(self, key):
+        """Remove `key`, if present."""
+        dbkey = self._key(key)
+        conn = self._connection()
+        with conn:
+            self._adjust(conn, 0, dbkey)
+            conn.execute("DELETE FROM entries WHERE key = ?", (dbkey,))
+
+    def clear(self):
+        """Remove every entry."""
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM entries")
+            conn.execute("UPDATE meta SET total = 0 WHERE id = 0")
@@ -1,15 +1,41 @@
 #!/usr/bin/env python
 """Convenience functions for writing LSST microservices"""
+import gzip
+import hashlib
+import io
+import json
 import logging
 import os
+import shutil
 import sys
+import tempfile
 import time
+import uuid
 import logging.handlers
 import requests
 import structlog
-from flask import Flask, jsonify, current_app
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    from urllib import urlencode
+from flask import Flask, Response, jsonify, current_app, g, request
+from flask import has_request_context
 # pylint: disable=redefined-builtin,too-many-arguments
+from future.utils import with_metaclass
 from past.builtins import basestring
+from apikit.fastpath import FastPathDispatcher
+from apikit.health import HealthMonitor, add_health_routes, http_probe
+from apikit.logrotate import RotatingCompressingFileHandler
+from apikit.server import PreforkServer
+from apikit.slowrequest import SlowRequestDetector
+from apikit.tcpsyslog import TCPSysLogHandler
+from apikit.tracing import JSONLinesExporter, Tracer, current_span
+from apikit.tracing import start_client_span
+from apikit.warmup import Warmup, upstream_session
 
 
 def set_flask_metadata(app, version, repository, description,
@@ -162,7 +188,10 @@ def _return_metadata():
 
 # pylint: disable = too-many-locals, too-many-arguments
 def retry_request(method, url, headers=None, payload=None, auth=None,
-                  tries=10, initial_interval=5, callback=None):
+                  tries=10, initial_interval=5, callback=None, data=None,
+                  encoding="json", compress_threshold=None, stream=False,
+                  destination=None, chunk_size=65536, cache=None,
+                  cache_ttl=None):
     """Retry an HTTP request with linear backoff.  Returns the response if
     the status code is < 400 or waits (try * initial_interval) seconds and
     retries (up to tries times) if it
@@ -171,14 +200,15 @@ def retry_request(method, url, headers=None, payload=None, auth=None,
     Parameters
     ----------
     method: `str`
-        Method: `GET`, `PUT`, or `POST`
+        Method: `GET`, `PUT`, `POST`, `PATCH`, or `DELETE`
     url: `str`
         URL of HTTP request
     headers: `dict`
         HTTP headers to supply.
     payload: `dict`
-        Payload for request; passed as parameters to `GET`, JSON message
-        body for `PUT`/`POST`.
+        Payload for request; passed as parameters to `GET`/`DELETE`,
+        encoded according to `encoding` as the message body for
+        `PUT`/`POST`/`PATCH`.
     auth: `tuple`
         Authentication tuple for Basic/Digest/Custom HTTP Auth.
     tries: `int`
@@ -194,11 +224,63 @@ def retry_request(method, url, headers=None, payload=None, auth=None,
         - ``remaining``: number of tries remaining (integer).
         - ``status``: HTTP status of the previous call.
         - ``content``: body content of the previous call.
+    data: `bytes`, `str`, `dict`, file object, or iterator, optional
+        Message body, sent as-is instead of an encoded `payload`.  Supply
+        your own `Content-Type` header.  Any bytes-like value (such as a
+        `bytearray`) is sent unchanged; a `dict` (or list of pairs) is
+        form-encoded, as :mod:`requests` does.  File objects and iterators of
+        `bytes` are streamed: seekable files are rewound to their starting
+        position for each attempt, and anything else is first copied to an
+        anonymous spill file (unless `tries` is `1`), so that memory use
+        does not depend on the size of the body.
+    encoding: `str` or `tuple`, optional
+        How to encode `payload` as a message body: `json` (the default),
+        `msgpack` (if the `msgpack` package is installed), or a
+        `(content_type, encoder)` tuple, where `encoder` turns the payload
+        into `bytes`.
+    compress_threshold: `int` or `None`, optional
+        If set, message bodies of at least this many bytes are
+        gzip-compressed and sent with `Content-Encoding: gzip`.  The
+        upstream must accept compressed requests.  Streamed bodies are
+        never compressed.
+    stream: `bool`, optional
+        If `True`, do not read the response body; instead return an
+        :class:`apikit.ResponseStream` which yields it in chunks.
+    destination: `str`, file object, or `None`, optional
+        If given, stream the response body into this path or writable
+        binary file object, and return the response without its body.
+    chunk_size: `int`, optional
+        Size of chunks for streamed bodies.  Defaults to `65536`.
+    cache: cache instance or `None`, optional
+        A :class:`apikit.MemoryCache` or :class:`apikit.SharedCache`.
+        If given, successful non-streamed `GET` responses are stored in
+        and answered from this cache, keyed on the URL, parameters,
+        headers, and credentials of the request (by username and a
+        digest of the password; requests with other kinds of `auth`
+        object are not cached).
+    cache_ttl: `float` or `None`, optional
+        Lifetime of cached responses, in seconds.  Defaults to the cache's
+        own `ttl`.
+
+    The message body is encoded (and compressed) once, and the same bytes
+    are reused for every attempt.
+
+    Requests are sent over a per-process pool of keep-alive connections,
+    which resolves host names through the in-process DNS cache
+    :data:`apikit.warmup.dns_cache`; see :meth:`apikit.APIFlask.warm_up`.
+
+    If a streamed `GET` response is interrupted, the request is retried
+    (within the same `tries` budget) and the transfer resumes where it
+    left off: with a `Range` request if the upstream advertises
+    `Accept-Ranges: bytes`, and otherwise by discarding the part of the
+    body already delivered.  A body that changes between attempts (per its
+    `ETag` or `Last-Modified` header) is an error.
 
     Returns
     -------
-    :class:`requests.Response`
-        The final HTTP Response received.
+    :class:`requests.Response` or :class:`apikit.ResponseStream`
+        The final HTTP Response received, or, if `stream` is set, a
+        stream of its body.
 
     Raises
     ------
@@ -208,20 +290,52 @@ def retry_request(method, url, headers=None, payload=None, auth=None,
         received.
     """
     method = method.lower()
-    attempt = 1
-    while True:
-        if method == "get":
-            resp = requests.get(url, headers=headers, params=payload,
-                                auth=auth)
-        elif method == "put" or method == "post":
-            resp = requests.put(url, headers=headers, json=payload, auth=auth)
-        else:
-            raise_ise("Bad method %s: must be 'get', 'put', or 'post" %
-                      method)
-        if resp.status_code < 400:
-            break
-        delay = initial_interval * attempt
+    if method not in _DISPATCH:
+        raise_ise("Bad method %s: must be one of %s" %
+                  (method, ", ".join("'%s'" % x for x in sorted(_DISPATCH))))
+    has_body = _DISPATCH[method]
+    session = upstream_session()
+    params = None
+    if not has_body:
+        params, payload = payload, None
+    if _is_stream(data):
+        body, rewind, spill = _rewindable(data, tries, chunk_size)
+    else:
+        rewind, spill = None, None
+        body, extra = _encode_body(payload, data, encoding,
+                                   compress_threshold)
+        if extra:
+            extra.update(headers or {})
+            headers = extra
+    streaming = stream or destination is not None
+    cache_key = None
+    if cache is not None and method == "get" and not streaming:
+        cache_key = _cache_key(url, params, headers, auth)
+        cached = cache.get(cache_key) if cache_key is not None else None
+        if cached is not None:
+            resp = _from_cache(cached)
+            _record_upstream(method, url, resp.status_code, [], 0.0)
+            return resp
+    trace = {"status": None, "attempts": [], "attempt": 1}
+
+    def request(extra_headers=None):
+        """Send one attempt."""
+        hdrs = headers
+        if extra_headers:
+            hdrs = dict(headers or {})
+            hdrs.update(extra_headers)
+        if rewind is not None:
+            body.seek(rewind)
+        return session.request(method.upper(), url, headers=hdrs,
+                               params=params, data=body, auth=auth,
+                               stream=streaming)
+
+    def retry(resp, span):
+        """Wait before the next attempt, or give up."""
+        attempt = trace["attempt"]
         if attempt >= tries:
+            if span is not None:
+                span.finish(status=resp.status_code, error="gave up")
             raise_ise("Failed to '%s' %s after %d attempts." %
                       (method, url, tries) +
                       "  Last response was '%d %s' [%s]" %
@@ -229,11 +343,367 @@ def retry_request(method, url, headers=None, payload=None, auth=None,
         if callback is not None:
             callback(n=attempt, remaining=tries - attempt,
                      status=resp.status_code, content=resp.text.strip())
+        resp.close()
+        delay = initial_interval * attempt
+        if span is not None:
+            span.add_event("backoff", delay=delay)
+            span.finish(status=resp.status_code)
         time.sleep(delay)
-        attempt += 1
+        trace["attempt"] = attempt + 1
+
+    def attempt_until_ok(extra_headers=None):
+        """Send attempts until one succeeds."""
+        while True:
+            span = start_client_span(method, url, trace["attempt"])
+            hdrs = extra_headers
+            if span is not None:
+                hdrs = dict(extra_headers or {})
+                hdrs["traceparent"] = span.traceparent()
+            sent = time.time()
+            try:
+                resp = request(hdrs)
+            except Exception as exc:
+                if span is not None:
+                    span.finish(error=str(exc))
+                raise
+            trace["attempts"].append(time.time() - sent)
+            trace["status"] = resp.status_code
+            if resp.status_code < 400:
+                if span is not None:
+                    span.finish(status=resp.status_code)
+                return resp
+            retry(resp, span)
+
+    started = time.time()
+    try:
+        resp = attempt_until_ok()
+    finally:
+        _record_upstream(method, url, trace["status"], trace["attempts"],
+                         time.time() - started)
+        if spill is not None:
+            spill.close()
+    if cache_key is not None:
+        cache.set(cache_key, _to_cache(resp), cache_ttl)
+    if not streaming:
+        return resp
+    first = resp.headers
+    validator = first.get("ETag") or first.get("Last-Modified")
+
+    def reopen(offset, exc):
+        """Resume an interrupted transfer at `offset`."""
+        rng = None
+        if (offset and first.get("Accept-Ranges") == "bytes" and
+                not first.get("Content-Encoding")):
+            rng = {"Range": "bytes=%d-" % offset}
+            if validator:
+                rng["If-Range"] = validator
+        while True:
+            if method != "get" or trace["attempt"] >= tries:
+                raise_ise("Transfer of '%s' %s interrupted after %d bytes: "
+                          "%s" % (method, url, offset, exc))
+            time.sleep(initial_interval * trace["attempt"])
+            trace["attempt"] += 1
+            try:
+                nxt = attempt_until_ok(rng)
+                break
+            except requests.exceptions.RequestException as err:
+                # The upstream is unreachable: try again, within `tries`.
+                exc = err
+        if nxt.status_code == 206:
+            crange = nxt.headers.get("Content-Range", "")
+            if not crange.startswith("bytes %d-" % offset):
+                raise_ise("Bad Content-Range '%s' resuming %s at %d" %
+                          (crange, url, offset))
+            return nxt, 0
+        if validator and validator != (nxt.headers.get("ETag") or
+                                       nxt.headers.get("Last-Modified")):
+            raise_ise("%s changed while being transferred" % url)
+        return nxt, offset
+
+    chunks = ResponseStream(resp, reopen, chunk_size)
+    if destination is None:
+        return chunks
+    if isinstance(destination, basestring):
+        with open(destination, "wb") as dest:
+            for chunk in chunks:
+                dest.write(chunk)
+    else:
+        for chunk in chunks:
+            destination.write(chunk)
+    return chunks.response
+
+
+class ResponseStream(object):
+    """
+    An iterator over the body of a streamed :func:`apikit.retry_request`
+    response, in `bytes` chunks, which transparently resumes interrupted
+    transfers.
+
+    Parameters
+    ----------
+    response: :class:`requests.Response`
+        A response opened with `stream=True`.
+    reopen: callable
+        Called as `reopen(offset, exc)` when the transfer is interrupted
+        after `offset` bytes by `exc`.  Must return a tuple of a new
+        streamed response and the number of leading bytes of that
+        response's body to discard, or raise.
+    chunk_size: `int`, optional
+        Size of chunks to read.  Defaults to `65536`.
+
+    Returns
+    -------
+    :class:`apikit.ResponseStream` instance.  Its `response` field is the
+    response currently being read, and `offset` counts the bytes delivered
+    so far.
+
+    Notes
+    -----
+    A body which ends before its `Content-Length` (or the end of its
+    `Content-Range`) counts as interrupted, as older urllib3 releases end
+    a truncated body quietly rather than raising.
+    """
+
+    def __init__(self, response, reopen, chunk_size=65536):
+        """Wrap a streamed response."""
+        self.response = response
+        self.offset = 0
+        self.chunk_size = chunk_size
+        self._reopen = reopen
+
+    def __iter__(self):
+        """Yield the body in chunks."""
+        skip = 0
+        while True:
+            expected = _body_length(self.response)
+            received = 0
+            try:
+                for chunk in self.response.iter_content(self.chunk_size):
+                    received += len(chunk)
+                    if skip:
+                        dropped = min(skip, len(chunk))
+                        chunk = chunk[dropped:]
+                        skip -= dropped
+                    if not chunk:
+                        continue
+                    self.offset += len(chunk)
+                    yield chunk
+                if expected is None or received >= expected:
+                    return
+                exc = requests.exceptions.ChunkedEncodingError(
+                    "Body ended after %d of %d bytes" % (received, expected))
+            except (requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.ConnectionError) as err:
+                exc = err
+            self.response.close()
+            self.response, skip = self._reopen(self.offset, exc)
+
+    def close(self):
+        """Release the underlying connection."""
+        self.response.close()
+
+    @property
+    def status_code(self):
+        """Status code of the response."""
+        return self.response.status_code
+
+    @property
+    def headers(self):
+        """Headers of the response."""
+        return self.response.headers
+
+
+def _body_length(resp):
+    """Length in bytes of `resp`'s body as delivered by `iter_content`, or
+    `None` if unknown (including when it is decoded from a compressed
+    transfer).
+    """
+    if resp.headers.get("Content-Encoding", "identity") != "identity":
+        return None
+    length = resp.headers.get("Content-Length")
+    if length is not None and length.isdigit():
+        return int(length)
+    crange = resp.headers.get("Content-Range", "")
+    if crange.startswith("bytes ") and "-" in crange:
+        try:
+            start, end = crange[6:].split("/")[0].split("-")
+            return int(end) - int(start) + 1
+        except ValueError:
+            return None
+    return None
+
+
+def _is_stream(data):
+    """Is `data` a file object or an iterator, rather than a body?"""
+    if data is None or isinstance(data, (bytes, basestring)):
+        return False
+    if hasattr(data, "read"):
+        return True
+    try:
+        return iter(data) is data
+    except TypeError:
+        return False
+
+
+def _rewindable(data, tries, chunk_size):
+    """Make a streamed body replayable.  Returns the body, the offset to
+    seek to before each attempt (or `None` if it cannot be replayed), and
+    a spill file to close when done (or `None`).
+    """
+    if hasattr(data, "read"):
+        seekable = getattr(data, "seekable", None)
+        if seekable is not None and seekable():
+            return data, data.tell(), None
+    if tries <= 1:
+        return data, None, None
+    spill = tempfile.TemporaryFile()
+    if hasattr(data, "read"):
+        shutil.copyfileobj(data, spill, chunk_size)
+    else:
+        for chunk in data:
+            if not isinstance(chunk, bytes):
+                chunk = chunk.encode("utf-8")
+            spill.write(chunk)
+    return spill, 0, spill
+
+
+def _encode_msgpack(payload):
+    """Encode `payload` with msgpack."""
+    if msgpack is None:
+        raise_ise("Encoding 'msgpack' requires the msgpack package")
+    return msgpack.packb(payload, use_bin_type=True)
+
+
+_CODECS = {
+    "json": ("application/json",
+             lambda p: json.dumps(p, separators=(",", ":")).encode("utf-8")),
+    "msgpack": ("application/msgpack", _encode_msgpack),
+}
+
+# method: whether `payload` is the message body
+_DISPATCH = {
+    "get": False,
+    "delete": False,
+    "put": True,
+    "post": True,
+    "patch": True,
+}
+
+
+def _encode_body(payload, data, encoding, compress_threshold):
+    """Serialize a request body once, for reuse across retries.  Returns
+    the body (or `None`) and a `dict` of headers describing it.
+    """
+    hdrs = {}
+    if data is not None:
+        body = data
+        if isinstance(body, (dict, list, tuple)):
+            # Form-encoded, as requests itself would.
+            body = urlencode(body, doseq=True).encode("utf-8")
+            hdrs["Content-Type"] = "application/x-www-form-urlencoded"
+        elif not isinstance(body, (bytes, bytearray, memoryview)):
+            body = body.encode("utf-8")
+    elif payload is not None:
+        if isinstance(encoding, tuple):
+            content_type, encoder = encoding
+        elif encoding in _CODECS:
+            content_type, encoder = _CODECS[encoding]
+        else:
+            raise_ise("Bad encoding %s: must be one of %s" %
+                      (encoding, ", ".join("'%s'" % x for x in
+                                           sorted(_CODECS))))
+        body = encoder(payload)
+        hdrs["Content-Type"] = content_type
+    else:
+        return None, hdrs
+    if compress_threshold is not None and len(body) >= compress_threshold:
+        buf = io.BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode="wb") as gzf:
+            gzf.write(body)
+        body = buf.getvalue()
+        hdrs["Content-Encoding"] = "gzip"
+    return body, hdrs
+
+
+def _auth_identity(auth):
+    """Stable form of `auth` for a cache key, holding no password: the
+    kind, the username, and a digest of the password.  `None` if `auth`
+    is an object whose credentials are unknown, so cannot be cached.
+    """
+    if auth is None:
+        return ""
+    if isinstance(auth, (tuple, list)) and len(auth) == 2:
+        kind, (username, password) = "basic", auth
+    elif hasattr(auth, "username") and hasattr(auth, "password"):
+        # requests' HTTPBasicAuth, HTTPDigestAuth and the like
+        kind = auth.__class__.__name__
+        username, password = auth.username, auth.password
+    else:
+        return None
+    if not isinstance(password, bytes):
+        password = password.encode("utf-8")
+    return "%s:%s:%s" % (kind, username,
+                         hashlib.sha256(password).hexdigest())
+
+
+def _cache_key(url, params, headers, auth):
+    """Cache key for a `GET`, or `None` if it cannot be cached."""
+    identity = _auth_identity(auth)
+    if identity is None:
+        return None
+    parts = [url, repr(sorted((params or {}).items())),
+             repr(sorted((headers or {}).items())), identity]
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+# Headers which describe the body as sent, not as cached.
+_TRANSFER_HEADERS = frozenset(["content-encoding", "content-length",
+                               "transfer-encoding"])
+
+
+def _to_cache(resp):
+    """Serialize a response for a cache.  The body is stored decoded, so
+    headers describing its transfer form are dropped.
+    """
+    headers = dict((k, v) for k, v in resp.headers.items()
+                   if k.lower() not in _TRANSFER_HEADERS)
+    meta = json.dumps({"status_code": resp.status_code,
+                       "reason": resp.reason,
+                       "url": resp.url,
+                       "encoding": resp.encoding,
+                       "headers": headers})
+    return meta.encode("utf-8") + b"\n" + resp.content
+
+
+def _from_cache(data):
+    """Rebuild a response from a cache."""
+    meta, content = data.split(b"\n", 1)
+    meta = json.loads(meta.decode("utf-8"))
+    resp = requests.Response()
+    resp.status_code = meta["status_code"]
+    resp.reason = meta["reason"]
+    resp.url = meta["url"]
+    resp.encoding = meta["encoding"]
+    resp.headers = requests.structures.CaseInsensitiveDict(meta["headers"])
+    # pylint: disable=protected-access
+    resp._content = content
     return resp
 
 
+def _record_upstream(method, url, status, timings, elapsed):
+    """Note a `retry_request` call against the current Flask request, if
+    there is one, so that per-request upstream timings can be reported.
+    """
+    if not has_request_context():
+        return
+    g.setdefault("apikit_upstream", []).append({
+        "method": method,
+        "url": url,
+        "status": status,
+        "attempts": timings,
+        "elapsed": elapsed})
+
+
 def raise_ise(text):
     """Turn a failed request response into a BackendError that represents
     an Internal Server Error.  Handy for reflecting HTTP errors from farther
@@ -280,7 +750,9 @@ def raise_from_response(resp):
                        content=resp.text)
 
 
-def get_logger(file=None, syslog=False, loghost=None, level=None):
+def get_logger(file=None, syslog=False, loghost=None, level=None,
+               transport="udp", spool=None, max_bytes=0, rotate_interval=0,
+               backup_count=7, compress=True):
     """Creates a logging object compatible with Python standard logging,
        but which, as a `structlog` instance, emits JSON.
 
@@ -291,12 +763,30 @@ def get_logger(file=None, syslog=False, loghost=None, level=None):
     syslog: `bool` (default `False`)
         If `True`, log to syslog.
     loghost: `None` or `str` (default `None`)
-        If given, send syslog output to specified host, UDP port 514.
+        If given, send syslog output to specified host, port 514.
     level: `None` or `str` (default `None`)
         If given, and if one of (case-insensitive) `DEBUG`, `INFO`,
         `WARNING`, `ERROR`, or `CRITICAL`, log events of that level or
         higher.  Defaults to `WARNING`.
-
+    transport: `str` (default `udp`)
+        Syslog transport: `udp` sends each event as its own datagram;
+        `tcp` uses a :class:`apikit.tcpsyslog.TCPSysLogHandler`, which
+        batches events over a persistent TCP connection with RFC 6587
+        octet-counted framing.
+    spool: `None` or `str` (default `None`)
+        With the `tcp` transport, a file in which to hold events while the
+        collector is unreachable.
+    max_bytes: `int` (default `0`)
+        If non-zero, rotate `file` once it reaches this size.
+    rotate_interval: `float` (default `0`)
+        If non-zero, rotate `file` every `rotate_interval` seconds.
+    backup_count: `int` (default `7`)
+        Number of rotated segments of `file` to keep.
+    compress: `bool` (default `True`)
+        Whether to gzip rotated segments of `file`.  Rotation and
+        compression are done by a
+        :class:`apikit.logrotate.RotatingCompressingFileHandler` in a
+        background thread.
 
     Returns
     -------
@@ -308,11 +798,17 @@ def get_logger(file=None, syslog=False, loghost=None, level=None):
     if not syslog:
         if not file:
             handler = logging.StreamHandler(sys.stdout)
+        elif max_bytes or rotate_interval:
+            handler = RotatingCompressingFileHandler(
+                file, max_bytes=max_bytes, interval=rotate_interval,
+                backup_count=backup_count, compress=compress)
         else:
             handler = logging.FileHandler(file)
+    elif transport == "tcp":
+        handler = TCPSysLogHandler(loghost or "localhost", 514, spool=spool)
     else:
         if loghost:
-            handler = logging.handlers.SysLogHandler(loghost, 514)
+            handler = logging.handlers.SysLogHandler((loghost, 514))
         else:
             handler = logging.handlers.SysLogHandler()
     root_logger = logging.getLogger()
@@ -366,14 +862,47 @@ class APIFlask(Flask):
     object.
 
     If the environment variable `LOGFILE` is set, the logger will send its
-    logs to that file rather than standard output.  If `LOGFILE` is not set and
+    logs to that file rather than standard output.  `LOGFILE_MAX_BYTES` and
+    `LOGFILE_ROTATE_INTERVAL` (seconds) rotate that file by size and age;
+    rotated segments are gzip-compressed in the background (unless
+    `LOGFILE_COMPRESS` is `0` or `false`), and the newest
+    `LOGFILE_BACKUP_COUNT` (default `7`) are kept.  If `LOGFILE` is not set and
     `LOG_TO_SYSLOG` is set, the logger will send its logs to syslog, and
     additionally if `LOGHOST` is also set, then the logger will send its logs
-    to syslog on LOGHOST port 514 UDP.  If `LOGLEVEL` is set (to one of the
-    standard `DEBUG`, `INFO`, `WARNING`, `ERROR`, or `CRITICAL`), logs of that
-    severity or higher only will be recorded; otherwise the default loglevel
-    is `WARNING`.  The environment variable `DEBUG` implies `LOGLEVEL` will be
-    treated as `DEBUG`.
+    to syslog on LOGHOST port 514 UDP.  If `LOG_TRANSPORT` is `tcp`, syslog
+    events are instead batched over TCP, and spooled to the file named by
+    `LOG_SPOOL` (if set) while the collector is unreachable.  If `LOGLEVEL`
+    is set (to one of the standard `DEBUG`, `INFO`, `WARNING`, `ERROR`, or
+    `CRITICAL`), logs of that severity or higher only will be recorded;
+    otherwise the default loglevel is `WARNING`.  The environment variable
+    `DEBUG` implies `LOGLEVEL` will be treated as `DEBUG`.
+
+    If the environment variable `SLOW_REQUEST_THRESHOLD` is set to a number
+    of seconds, a :class:`apikit.slowrequest.SlowRequestDetector` is
+    attached, and any request exceeding that latency is logged along with
+    its upstream timings and a stack snapshot.  `SLOW_REQUEST_RATE_LIMIT`
+    sets the minimum number of seconds between such events for any one
+    route (default `60`).
+
+    If the environment variable `TRACE_FILE` is set, a
+    :class:`apikit.tracing.Tracer` is attached, and spans for each request
+    and each `retry_request` attempt it makes are appended to that file as
+    JSON lines.  `TRACE_SAMPLE_RATE` sets the fraction of new traces
+    recorded (default `1`).
+
+    Requests for the metadata routes and `/healthz` are answered by an
+    :class:`apikit.fastpath.FastPathDispatcher` around `wsgi_app` (kept
+    as `fast_path`), from bytes rendered on first use, without the Flask
+    request cycle; the slow request detector and tracer do not see them.
+
+    `/healthz` and `/readyz` routes are added under every route prefix.
+    They answer from memory: `/readyz` reports the cached results of the
+    dependency probes registered with `add_dependency()`, which a
+    :class:`apikit.health.HealthMonitor` runs in the background.
+
+    The app's `UPSTREAMS` config lists the base URLs of the services it
+    calls, initially from the comma-separated environment variable
+    `UPSTREAMS`; `warm_up()` connects to them ahead of the first request.
 
     Parameters
     ----------
@@ -434,16 +963,92 @@ class APIFlask(Flask):
                            api_version=api_version,
                            auth=auth,
                            route=route)
+        self.setup_logging()
+        HealthMonitor(self)
+        add_health_routes(self, route)
+        self.config["ERROR_CONTENT_LIMIT"] = 1024
+        self.register_error_handler(BackendError, handle_backend_error)
+        self.fast_path = FastPathDispatcher(self, self.wsgi_app)
+        self.wsgi_app = self.fast_path
+        if ("SLOW_REQUEST_THRESHOLD" in os.environ and
+                os.environ["SLOW_REQUEST_THRESHOLD"]):
+            ratelimit = 60.0
+            if ("SLOW_REQUEST_RATE_LIMIT" in os.environ and
+                    os.environ["SLOW_REQUEST_RATE_LIMIT"]):
+                ratelimit = float(os.environ["SLOW_REQUEST_RATE_LIMIT"])
+            SlowRequestDetector(
+                self, threshold=float(os.environ["SLOW_REQUEST_THRESHOLD"]),
+                rate_limit=ratelimit)
+        if "TRACE_FILE" in os.environ and os.environ["TRACE_FILE"]:
+            samplerate = 1.0
+            if ("TRACE_SAMPLE_RATE" in os.environ and
+                    os.environ["TRACE_SAMPLE_RATE"]):
+                samplerate = float(os.environ["TRACE_SAMPLE_RATE"])
+            Tracer(self, exporter=JSONLinesExporter(os.environ["TRACE_FILE"]),
+                   sample_rate=samplerate)
+        self.config["UPSTREAMS"] = []
+        if "UPSTREAMS" in os.environ and os.environ["UPSTREAMS"]:
+            self.config["UPSTREAMS"] = [
+                x.strip() for x in os.environ["UPSTREAMS"].split(",")
+                if x.strip()]
+        self.config["WARMUP"] = None
+
+    def add_route_prefix(self, route):
+        """Add a new route at the front of the metadata, health, and
+        readiness routes.
+        """
+        add_metadata_route(self, route)
+        add_health_routes(self, route)
+        self.fast_path.refresh()
+
+    def add_dependency(self, name, probe, interval=10, timeout=2,
+                       failure_threshold=3, critical=True):
+        """Probe a dependency in the background for `/readyz`; see
+        :meth:`apikit.health.HealthMonitor.add_check`.  `probe` may be a
+        callable, or a URL to check with
+        :func:`apikit.health.http_probe`.
+        """
+        if isinstance(probe, str):
+            probe = http_probe(probe, timeout=timeout)
+        self.config["HEALTH"].add_check(name, probe, interval=interval,
+                                        timeout=timeout,
+                                        failure_threshold=failure_threshold,
+                                        critical=critical)
+
+    def setup_logging(self):
+        """(Re)create the app's `LOGGER` from the environment.  Called on
+        construction, and once in each worker process by
+        :class:`apikit.server.PreforkServer`.
+        """
         logfile = None
         syslog = False
         loghost = None
         loglevel = None
+        transport = "udp"
+        spool = None
+        rotation = {}
         if "LOGFILE" in os.environ and os.environ["LOGFILE"]:
             logfile = os.environ["LOGFILE"]
+            for env, arg, cast in [("LOGFILE_MAX_BYTES", "max_bytes", int),
+                                   ("LOGFILE_ROTATE_INTERVAL",
+                                    "rotate_interval", float),
+                                   ("LOGFILE_BACKUP_COUNT", "backup_count",
+                                    int)]:
+                if env in os.environ and os.environ[env]:
+                    rotation[arg] = cast(os.environ[env])
+            if ("LOGFILE_COMPRESS" in os.environ and
+                    os.environ["LOGFILE_COMPRESS"]):
+                rotation["compress"] = (os.environ["LOGFILE_COMPRESS"].lower()
+                                        not in ["0", "false", "no"])
         elif "LOG_TO_SYSLOG" in os.environ and os.environ["LOG_TO_SYSLOG"]:
             syslog = True
             if "LOGHOST" in os.environ and os.environ["LOGHOST"]:
                 loghost = os.environ["LOGHOST"]
+            if ("LOG_TRANSPORT" in os.environ and
+                    os.environ["LOG_TRANSPORT"]):
+                transport = os.environ["LOG_TRANSPORT"].lower()
+            if "LOG_SPOOL" in os.environ and os.environ["LOG_SPOOL"]:
+                spool = os.environ["LOG_SPOOL"]
         if "LOGLEVEL" in os.environ and os.environ["LOGLEVEL"]:
             loglevel = os.environ["LOGLEVEL"]
         if "DEBUG" in os.environ and os.environ["DEBUG"]:
@@ -451,15 +1056,136 @@ class APIFlask(Flask):
             self.config["DEBUG"] = True
             loglevel = "DEBUG"
         log = get_logger(file=logfile, syslog=syslog, loghost=loghost,
-                         level=loglevel)
+                         level=loglevel, transport=transport, spool=spool,
+                         **rotation)
         self.config["LOGGER"] = log
 
-    def add_route_prefix(self, route):
-        """Add a new route at the front of the metadata routes."""
-        add_metadata_route(self, route)
+    def warm_up(self, connections=1, timeout=10, background=True):
+        """Resolve and open keep-alive connections to each URL in the
+        app's `UPSTREAMS` config, so that the first requests do not pay
+        for DNS, TCP and TLS set-up.  Called by `serve()` in each worker
+        process.  The :class:`apikit.warmup.Warmup` is stored as the
+        app's `WARMUP` config, and its duration is logged at `INFO`.
+
+        Parameters
+        ----------
+        connections: `int`, optional
+            Connections to open to each upstream.  Defaults to `1`.
+        timeout: `float`, optional
+            Timeout for each connection.  Defaults to `10`.
+        background: `bool`, optional
+            If `True` (the default) return at once; the warmup's `ready`
+            event is set when it finishes.
+
+        Returns
+        -------
+        :class:`apikit.warmup.Warmup`
+        """
+        warmup = Warmup(self.config.get("UPSTREAMS") or [],
+                        connections=connections, timeout=timeout)
+        self.config["WARMUP"] = warmup
+        if background:
+            return warmup.start(self.config["LOGGER"])
+        warmup.run(self.config["LOGGER"])
+        return warmup
+
+    def serve(self, host="0.0.0.0", port=5000, workers=None, threads=4,
+              max_requests=None, max_memory=None, graceful_timeout=30):
+        """Serve the app with :class:`apikit.server.PreforkServer`, a
+        pre-fork, multi-process production server, rather than the
+        single-process development server started by `run()`.  Blocks
+        until the server receives `SIGTERM` or `SIGINT`; `SIGHUP` restarts
+        the workers gracefully.
+
+        Parameters
+        ----------
+        host: `str`, optional
+            Address to listen on.  Defaults to `0.0.0.0`.
+        port: `int`, optional
+            Port to listen on.  Defaults to `5000`.
+        workers: `int` or `None`, optional
+            Number of worker processes.  Defaults to the number of CPUs.
+        threads: `int`, optional
+            Threads per worker.  Defaults to `4`.
+        max_requests: `int` or `None`, optional
+            Requests after which a worker is replaced.  Defaults to never.
+        max_memory: `int` or `None`, optional
+            Peak RSS, in megabytes, after which a worker is replaced.
+            Defaults to never.
+        graceful_timeout: `float`, optional
+            Seconds to wait for workers to finish on shutdown.  Defaults to
+            `30`.
+        """
+        PreforkServer(self, host=host, port=port, workers=workers,
+                      threads=threads, max_requests=max_requests,
+                      max_memory=max_memory,
+                      graceful_timeout=graceful_timeout).run()
+
+
+def handle_backend_error(error):
+    """Flask error handler turning a :class:`apikit.BackendError` into a
+    compact JSON response with the error's status code.
 
+    The body has the fields of :meth:`apikit.BackendError.to_dict`, with
+    `error_content` cut to the app's `ERROR_CONTENT_LIMIT` characters
+    (default `1024`; `None` for no limit), plus `request_id`, which is
+    also sent as the `X-Request-ID` header.  The request ID is taken from
+    the request's own `X-Request-ID` header, or else its trace ID if it is
+    traced, or else freshly generated.
 
-class BackendError(Exception):
+    :class:`apikit.APIFlask` installs this handler; to replace it,
+    register your own for :class:`apikit.BackendError`.
+    """
+    content = error.content
+    limit = current_app.config.get("ERROR_CONTENT_LIMIT", 1024)
+    if content is not None and limit is not None and len(content) > limit:
+        content = content[:limit] + "..."
+    request_id = request.headers.get("X-Request-ID", "")[:128]
+    if not request_id:
+        span = current_span()
+        request_id = span.trace_id if span is not None else uuid.uuid4().hex
+    body = json.dumps({"reason": error.reason,
+                       "status_code": error.status_code,
+                       "error_content": content,
+                       "request_id": request_id}, separators=(",", ":"))
+    return Response(body, error.status_code, {"X-Request-ID": request_id},
+                    mimetype="application/json")
+
+
+class _Field(object):
+    """A :class:`apikit.BackendError` field kept in a slot.  Read from the
+    class, it is the field's default.
+    """
+
+    __slots__ = ("slot", "default")
+
+    def __init__(self, slot, default):
+        self.slot = slot
+        self.default = default
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self.default
+        return getattr(obj, self.slot, self.default)
+
+    def __set__(self, obj, value):
+        setattr(obj, self.slot, value)
+
+
+class _BackendErrorType(type):
+    """Metaclass turning defaults overridden by plain class attributes in
+    a :class:`apikit.BackendError` subclass back into slot-backed fields.
+    """
+
+    def __init__(cls, name, bases, namespace):
+        type.__init__(cls, name, bases, namespace)
+        for field in ("reason", "status_code", "content"):
+            default = namespace.get(field)
+            if field in namespace and not isinstance(default, _Field):
+                setattr(cls, field, _Field("_" + field, default))
+
+
+class BackendError(with_metaclass(_BackendErrorType, Exception)):
     """
     Creates a JSON-formatted error for use in LSST/DM microservices.
 
@@ -469,10 +1195,12 @@ class BackendError(Exception):
         Reason for the exception
 
     status_code: `int`, optional
-        Status code to be returned, defaults to 400.
+        Status code to be returned, defaults to the class's `status_code`
+        (400).
 
     content: `str`, optional
-        Textual content of the underlying error.
+        Textual content of the underlying error, defaults to the class's
+        `content` (`None`).
 
     Returns
     -------
@@ -488,12 +1216,22 @@ class BackendError(Exception):
     Notes
     -----
     This class is intended for use pretty much as described at
-    (http://flask.pocoo.org/docs/0.11/patterns/apierrors/).
+    (http://flask.pocoo.org/docs/0.11/patterns/apierrors/).  An
+    :class:`apikit.APIFlask` app installs a handler for it already.
+
+    The fields are kept in `__slots__`, so setting them does not make
+    Python allocate the instance dictionary that every exception can
+    have, and setting any other attribute raises `AttributeError`
+    (unless a subclass leaves out `__slots__`, as usual in Python).  A
+    subclass may still override a default with a plain class attribute,
+    as in `class NotFound(BackendError): status_code = 404`.
     """
 
-    reason = None
-    status_code = 400
-    content = None
+    __slots__ = ("_reason", "_status_code", "_content")
+
+    reason = _Field("_reason", None)
+    status_code = _Field("_status_code", 400)
+    content = _Field("_content", None)
 
     def __init__(self, reason, status_code=None, content=None):
         """Exception for target service error."""
@@ -501,16 +1239,32 @@ class BackendError(Exception):
         if not isinstance(reason, str):
             raise TypeError("'reason' must be a str")
         self.reason = reason
-        if status_code is not None:
-            if isinstance(status_code, int):
-                self.status_code = status_code
-            else:
-                raise TypeError("'status_code' must be an int")
-        if content is not None:
-            if not isinstance(content, basestring):
-                raise TypeError("'content' must be a basestring")
+        if status_code is None:
+            status_code = type(self).status_code
+        elif not isinstance(status_code, int):
+            raise TypeError("'status_code' must be an int")
+        self.status_code = status_code
+        if content is None:
+            content = type(self).content
+        elif not isinstance(content, basestring):
+            raise TypeError("'content' must be a basestring")
         self.content = content
 
+    def __setattr__(self, name, value):
+        """Refuse attributes that would need the instance dictionary."""
+        cls = type(self)
+        if (not hasattr(cls, name) and name != "__notes__" and
+                all("__slots__" in vars(klass) for klass in cls.__mro__
+                    if issubclass(klass, BackendError))):
+            raise AttributeError("%r object has no attribute %r" %
+                                 (cls.__name__, name))
+        Exception.__setattr__(self, name, value)
+
+    def __reduce__(self):
+        """Pickle by constructor arguments, as slots are not pickled."""
+        return (self.__class__, (self.reason, self.status_code,
+                                 self.content))
+
     def __str__(self):
         """Useful textual representation"""
         return "BackendError: %d %s [%s]" % (self.status_code,
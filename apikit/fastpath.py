@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""WSGI fast path for static infrastructure routes"""
+import threading
+
+# WSGI environ key marking the requests that render fast-path responses,
+#  so that instrumentation can ignore them.
+RENDERING = "apikit.fast_path.rendering"
+
+
+def render_safe(hook):
+    """Mark `hook`, a `before_request` or `url_value_preprocessor`
+    function, as not affecting what fast-path routes answer (for instance
+    because it only instruments requests, and skips those marked by
+    :data:`RENDERING`), so that it does not keep them off the fast path.
+    Returns `hook`.
+    """
+    hook.fast_path_safe = True
+    return hook
+
+
+class FastPathDispatcher(object):
+    """
+    WSGI middleware which answers `GET` and `HEAD` requests for an app's
+    static infrastructure routes (by default the metadata routes and
+    `/healthz`) from precomputed bytes, without pushing a request context
+    or matching URLs.  Every other request passes through to the wrapped
+    WSGI app unchanged.
+
+    Responses are rendered once, through Flask's full request dispatch
+    (the view and after-request hooks, so headers such as CORS ones are
+    included), the first time any fast-path route is requested.  A route
+    whose render is not a `200` is left to Flask.  Hooks do not run again
+    for fast-path requests, so a route is only served on the fast path if
+    no `before_request` or `url_value_preprocessor` hook applies to it
+    (other than those marked by :func:`render_safe`): such hooks may
+    answer, or change the answer, per request, and would otherwise be
+    frozen at their first result.  Fast-path requests are invisible to
+    per-request instrumentation: neither the
+    :class:`apikit.slowrequest.SlowRequestDetector` nor the
+    :class:`apikit.tracing.Tracer` sees them (or the render, which is
+    marked by :data:`RENDERING` in its environ).  Call `refresh()` after
+    changing the routes, the metadata they report, or the hooks.
+
+    :class:`apikit.APIFlask` installs one around its `wsgi_app` and keeps
+    it as `app.fast_path`; refresh it there, since `wsgi_app` may since
+    have been wrapped by other middleware.
+
+    Parameters
+    ----------
+    app: :class:`flask.Flask`
+        Application whose routes are served.
+    wsgi_app: callable or `None`, optional
+        WSGI app to pass other requests to.  Defaults to `app.wsgi_app`.
+    endpoints: iterable of `str`, optional
+        Endpoints to serve.  Only rules without arguments are served.
+    """
+
+    def __init__(self, app, wsgi_app=None,
+                 endpoints=("_return_metadata", "_return_health")):
+        """Wrap `app`."""
+        self.app = app
+        self.wsgi_app = wsgi_app if wsgi_app is not None else app.wsgi_app
+        self.endpoints = frozenset(endpoints)
+        self._routes = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Discard precomputed responses; they are rebuilt on next use."""
+        self._routes = None
+
+    def _build(self):
+        """Render each fast-path route as Flask would serve it."""
+        routes = {}
+        for rule in self.app.url_map.iter_rules():
+            if (rule.endpoint not in self.endpoints or rule.arguments or
+                    "GET" not in (rule.methods or ()) or
+                    self._hooked(rule.endpoint)):
+                continue
+            with self.app.test_request_context(
+                    rule.rule, environ_overrides={RENDERING: True}):
+                resp = self.app.full_dispatch_request()
+            if resp.status_code != 200:
+                continue
+            body = resp.get_data()
+            headers = [(k, v) for k, v in resp.headers.to_wsgi_list()
+                       if k.lower() != "content-length"]
+            headers.append(("Content-Length", str(len(body))))
+            routes[rule.rule] = (resp.status, headers, body)
+        return routes
+
+    def _hooked(self, endpoint):
+        """Do request hooks, not marked by :func:`render_safe`, apply to
+        `endpoint`?
+        """
+        scopes = [None]
+        blueprint = endpoint.rpartition(".")[0]
+        while blueprint:
+            scopes.append(blueprint)
+            blueprint = blueprint.rpartition(".")[0]
+        for registry in (self.app.before_request_funcs,
+                         self.app.url_value_preprocessors):
+            for scope in scopes:
+                for hook in registry.get(scope, ()):
+                    if not getattr(hook, "fast_path_safe", False):
+                        return True
+        return False
+
+    def __call__(self, environ, start_response):
+        """Answer from memory, or pass through."""
+        if environ.get("REQUEST_METHOD") in ("GET", "HEAD"):
+            routes = self._routes
+            if routes is None:
+                with self._lock:
+                    if self._routes is None:
+                        self._routes = self._build()
+                    routes = self._routes
+            hit = routes.get(environ.get("PATH_INFO"))
+            if hit is not None:
+                start_response(hit[0], list(hit[1]))
+                if environ["REQUEST_METHOD"] == "HEAD":
+                    return [b""]
+                return [hit[2]]
+        return self.wsgi_app(environ, start_response)
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+"""Liveness and readiness routes backed by background dependency probes"""
+import json
+import os
+import threading
+import time
+from flask import Response, current_app
+from apikit.warmup import upstream_session
+
+_JSON = "application/json"
+
+
+class _Check(object):
+    """State of one dependency probe."""
+
+    def __init__(self, name, probe, interval, timeout, failure_threshold,
+                 critical):
+        self.name = name
+        self.probe = probe
+        self.interval = interval
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.critical = critical
+        self.failures = 0
+        self.checked = None
+        self.latency = None
+        self.error = None
+        self.due = 0.0
+        self.started = None
+        self.thread = None
+        self.reported = False
+
+    @property
+    def ok(self):
+        """Has the probe run, and not failed too often in a row?"""
+        return (self.checked is not None and
+                self.failures < self.failure_threshold)
+
+    def to_dict(self):
+        """Reportable state."""
+        return {"ok": self.ok, "critical": self.critical,
+                "failures": self.failures, "checked": self.checked,
+                "latency": self.latency, "error": self.error}
+
+
+class HealthMonitor(object):
+    """
+    Runs dependency probes on a background scheduler thread and keeps the
+    answers for the `/healthz` and `/readyz` routes, so that serving a
+    probe request is an in-memory read and never calls a dependency.
+
+    Each probe runs in a thread of its own, timed from when it starts, so
+    a hung probe cannot delay any other.  A probe which times out is
+    counted as failed, and again each interval while it is still running,
+    but is never started a second time alongside itself.
+
+    The scheduler starts on the first readiness request in each process,
+    not when checks are added, so a :class:`apikit.PreforkServer` master
+    runs no probes and each worker probes for itself.
+
+    The app is ready once every critical check has succeeded at least
+    once and has not since failed `failure_threshold` times in a row, and
+    any :meth:`apikit.APIFlask.warm_up` has finished.
+
+    Parameters
+    ----------
+    app: :class:`apikit.APIFlask` or `None`
+        Application to attach to.  If `None`, call `init_app` later.
+    """
+
+    def __init__(self, app=None):
+        """Create a monitor with no checks."""
+        self._checks = []
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._ready = (200, b'{"checks":{},"ready":true}')
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Attach the monitor to `app`."""
+        app.config["HEALTH"] = self
+
+    def add_check(self, name, probe, interval=10, timeout=2,
+                  failure_threshold=3, critical=True):
+        """Probe a dependency periodically.
+
+        Parameters
+        ----------
+        name: `str`
+            Name reported by `/readyz`.
+        probe: callable
+            Called with no arguments; the dependency is healthy if it
+            returns without raising and its result is not `False`.  See
+            :func:`apikit.health.http_probe`.
+        interval: `float`, optional
+            Seconds between probes.  Defaults to `10`.
+        timeout: `float`, optional
+            Seconds after which a probe counts as failed.  Defaults to `2`.
+        failure_threshold: `int`, optional
+            Consecutive failures after which the dependency is unhealthy.
+            Defaults to `3`.
+        critical: `bool`, optional
+            Whether the app is unready while this dependency is unhealthy.
+            Defaults to `True`.
+        """
+        with self._lock:
+            self._checks.append(_Check(name, probe, interval, timeout,
+                                       failure_threshold, critical))
+            self._render()
+        # A running scheduler picks it up now; otherwise readiness()
+        #  starts one.
+        self._wake.set()
+
+    def _ensure_running(self):
+        """Start the scheduler in this process, if it is not running."""
+        if self._pid == os.getpid() or not self._checks:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # First use, or first in a forked worker: the parent's
+            #  threads did not survive the fork.
+            for check in self._checks:
+                check.thread = None
+                check.due = 0.0
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run,
+                                            name="apikit-health")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        """Scheduler thread."""
+        while True:
+            now = time.time()
+            wait = 1.0
+            with self._lock:
+                for check in self._checks:
+                    if check.thread is None:
+                        if check.due <= now:
+                            self._start(check, now)
+                    elif (not check.reported and
+                          now - check.started >= check.timeout):
+                        # Give up waiting: a late answer is ignored.
+                        check.reported = True
+                        self._record(check, "timed out after %gs" %
+                                     check.timeout)
+                        check.due = now + check.interval
+                    elif check.reported and check.due <= now:
+                        # Still hung: fail again rather than start another.
+                        self._record(check, "timed out after %gs, still "
+                                     "running" % check.timeout)
+                        check.due = now + check.interval
+                    if check.thread is not None and not check.reported:
+                        wait = min(wait, check.started + check.timeout - now)
+                    else:
+                        wait = min(wait, check.due - now)
+            self._wake.wait(max(wait, 0.01))
+            self._wake.clear()
+
+    def _start(self, check, now):
+        """Start a probe in its own thread; the lock must be held."""
+        check.started = now
+        check.reported = False
+        check.thread = threading.Thread(target=self._probe, args=(check,),
+                                        name="apikit-health-" + check.name)
+        check.thread.daemon = True
+        check.thread.start()
+
+    def _probe(self, check):
+        """Run a probe and record its outcome, unless it was given up on."""
+        error = None
+        try:
+            if check.probe() is False:
+                error = "probe failed"
+        except Exception as exc:  # pylint: disable=broad-except
+            error = str(exc) or exc.__class__.__name__
+        with self._lock:
+            if check.thread is not threading.current_thread():
+                return
+            check.thread = None
+            if not check.reported:
+                self._record(check, error)
+        self._wake.set()
+
+    def _record(self, check, error):
+        """Update a check's state; the lock must be held."""
+        now = time.time()
+        check.latency = now - check.started
+        check.checked = now
+        check.error = error
+        check.failures = check.failures + 1 if error else 0
+        check.due = check.started + check.interval
+        self._render()
+
+    def _render(self):
+        """Precompute the `/readyz` answer; the lock must be held."""
+        ready = all(c.ok for c in self._checks if c.critical)
+        body = json.dumps({"ready": ready,
+                           "checks": dict((c.name, c.to_dict())
+                                          for c in self._checks)},
+                          separators=(",", ":"), sort_keys=True)
+        self._ready = (200 if ready else 503, body.encode("utf-8"))
+
+    def readiness(self):
+        """Current `/readyz` status code and JSON body."""
+        self._ensure_running()
+        return self._ready
+
+
+def http_probe(url, timeout=2):
+    """Build a probe which `GET`s `url`, over the connection pool used by
+    :func:`apikit.retry_request`, and succeeds on a status below 400.
+    """
+    def probe():
+        """GET the URL."""
+        resp = upstream_session().get(url, timeout=timeout)
+        resp.close()
+        if resp.status_code >= 400:
+            raise RuntimeError("%s returned %d" % (url, resp.status_code))
+        return True
+    return probe
+
+
+def add_health_routes(app, route):
+    """
+    Creates `/healthz` (liveness) and `/readyz` (readiness) routes.  If
+    route is specified, prepends it (or each component) to the front of
+    the routes, as :func:`apikit.add_metadata_route` does.
+
+    Both answer from memory.  `/healthz` is always `200`.  `/readyz` is
+    `200` if the app's :class:`apikit.health.HealthMonitor` (its `HEALTH`
+    config) reports ready, and `503` otherwise, with the state of each
+    dependency check as JSON.
+
+    Parameters
+    ----------
+    app : :class:`flask.Flask` instance
+        Flask application with metadata already set.
+
+    route : `None`, `str`, or list of `str`, optional
+        The 'route' parameter must be None, a string, or a list of strings.
+        If supplied, each string will be prepended to the routes.
+
+    Returns
+    -------
+        Nothing, but decorates app with `/healthz` and `/readyz`.
+    """
+    errstr = add_health_routes.__doc__
+    if route is None:
+        route = [""]
+    if isinstance(route, str):
+        route = [route]
+    if not isinstance(route, list):
+        raise TypeError(errstr)
+    if not all(isinstance(item, str) for item in route):
+        raise TypeError(errstr)
+    if app.config.get("HEALTH") is None:
+        HealthMonitor(app)
+    for rcomp in route:
+        # Make canonical
+        rcomp = "/" + rcomp.strip("/")
+        if rcomp == "/":
+            rcomp = ""
+        with app.app_context():
+            app.add_url_rule(rcomp + "/healthz", '_return_health',
+                             _return_health)
+            app.add_url_rule(rcomp + "/readyz", '_return_readiness',
+                             _return_readiness)
+
+
+def _return_health():
+    """The process is up and serving."""
+    return Response(b'{"status":"ok"}', 200, mimetype=_JSON)
+
+
+def _return_readiness():
+    """Cached readiness of the app's dependencies."""
+    warmup = current_app.config.get("WARMUP")
+    if warmup is not None and not warmup.ready.is_set():
+        return Response(b'{"ready":false,"warming_up":true}', 503,
+                        mimetype=_JSON)
+    status, body = current_app.config["HEALTH"].readiness()
+    return Response(body, status, mimetype=_JSON)
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+"""Log file rotation with background compression"""
+import gzip
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_SEGMENT = re.compile(r"^(\d{8}-\d{6}-\d{6})(?:-(\d+))?(?:\.gz)?$")
+
+# Seconds from rotating a segment to compressing it, for other processes
+#  to follow the rename, so that their last writes to it are not lost.
+_SETTLE = 1.0
+
+
+class RotatingCompressingFileHandler(logging.FileHandler):
+    """
+    A file logging handler which rotates its file by size and/or age,
+    compresses rotated segments with gzip, and keeps only the newest
+    `backup_count` of them.
+
+    Several processes, such as the workers of a
+    :class:`apikit.server.PreforkServer`, may each log to the same file
+    through their own handler.  Writing a record appends to the file,
+    first reopening it if another process has rotated it away (as
+    :class:`logging.handlers.WatchedFileHandler` does).  When a limit is
+    crossed, a background thread takes an exclusive lock on
+    `<filename>.lock`, checks that the shared file is still due, renames
+    it aside and reopens it, so each rotation happens in exactly one
+    process.  A moment later, once other processes have followed the
+    rename, the same thread compresses the segment and prunes old ones
+    (still under the lock, but not holding up further rotations in the
+    meantime).  Records keep flowing to the current file throughout.
+    Where :mod:`fcntl` is unavailable there is no lock, and the file
+    should be written by only one process.
+
+    Rotated segments are named `<filename>.<YYYYmmdd-HHMMSS-microseconds>.gz`.
+    Segments left uncompressed by an earlier process are compressed on
+    start-up.
+
+    Parameters
+    ----------
+    filename: `str`
+        Log file path.
+    max_bytes: `int`, optional
+        Rotate once the file reaches this many bytes.  `0` (the default)
+        disables size-based rotation.
+    interval: `float`, optional
+        Rotate a non-empty file every `interval` seconds.  `0` (the
+        default) disables time-based rotation.
+    backup_count: `int`, optional
+        Number of rotated segments to keep.  Defaults to `7`.
+    compress: `bool`, optional
+        Whether to gzip rotated segments.  Defaults to `True`.
+    encoding: `str` or `None`, optional
+        File encoding.
+    """
+
+    def __init__(self, filename, max_bytes=0, interval=0, backup_count=7,
+                 compress=True, encoding=None):
+        """Open the log file and start the rotation thread."""
+        logging.FileHandler.__init__(self, filename, "a", encoding)
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.backup_count = backup_count
+        self.compress = compress
+        self._identity = self._stat_stream()
+        self._size = os.fstat(self.stream.fileno()).st_size
+        open(self.baseFilename + ".lock", "a").close()
+        self._next_rollover = None
+        if interval:
+            self._next_rollover = self._last_rotation() + interval
+        self._pending = []
+        self._wake = threading.Event()
+        self._closing = False
+        self._thread = threading.Thread(target=self._run,
+                                        name="apikit-logrotate")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _stat_stream(self):
+        """Device and inode of the open file."""
+        stat = os.fstat(self.stream.fileno())
+        return stat.st_dev, stat.st_ino
+
+    def _last_rotation(self):
+        """When any process last rotated the file (the lock file's
+        modification time).
+        """
+        return os.path.getmtime(self.baseFilename + ".lock")
+
+    def emit(self, record):
+        """Write a record, and signal the rotation thread if a limit has
+        been crossed.
+        """
+        try:
+            msg = self.format(record) + "\n"
+            try:
+                stat = os.stat(self.baseFilename)
+                moved = (stat.st_dev, stat.st_ino) != self._identity
+            except OSError:
+                moved = True
+            if moved:
+                # Rotated by another process: follow the file name.
+                self.stream.close()
+                self.stream = self._open()
+                self._identity = self._stat_stream()
+            self.stream.write(msg)
+            self.stream.flush()
+            # The shared file's size in bytes, whoever wrote them.
+            self._size = os.fstat(self.stream.fileno()).st_size
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+            return
+        if self._due():
+            self._wake.set()
+
+    def _due(self):
+        """Is a rotation due?"""
+        if self.max_bytes and self._size >= self.max_bytes:
+            return True
+        return (self._next_rollover is not None and self._size > 0 and
+                time.time() >= self._next_rollover)
+
+    def close(self):
+        """Stop the rotation thread and close the file."""
+        self._closing = True
+        self._wake.set()
+        if (self._thread.is_alive() and
+                self._thread is not threading.current_thread()):
+            self._thread.join()
+        logging.FileHandler.close(self)
+
+    def _run(self):
+        """Rotation thread."""
+        self._locked(self._compress_leftovers)
+        while not self._closing:
+            timeout = None
+            if self._next_rollover is not None:
+                timeout = max(self._next_rollover - time.time(), 0.01)
+            if self._pending:
+                settle = max(self._pending[0][0] - time.time(), 0.01)
+                timeout = settle if timeout is None else min(timeout, settle)
+            self._wake.wait(timeout)
+            self._wake.clear()
+            if self._closing:
+                break
+            if (self._next_rollover is not None and self._size == 0 and
+                    time.time() >= self._next_rollover):
+                # Nothing to rotate; try again next interval.
+                self._next_rollover = time.time() + self.interval
+            if self._due():
+                segment = self._locked(self._rollover)
+                if segment is not None:
+                    self._pending.append((time.time() + _SETTLE, segment))
+            self._finish_settled()
+        self._finish_settled(wait=True)
+
+    def _finish_settled(self, wait=False):
+        """Finish segments this handler rotated once they have settled,
+        waiting for them if `wait`.
+        """
+        while self._pending:
+            ready, segment = self._pending[0]
+            if ready > time.time():
+                if not wait:
+                    return
+                time.sleep(ready - time.time())
+            self._pending.pop(0)
+            self._locked(self._finish, segment)
+
+    def _locked(self, func, *args):
+        """Call `func` holding the lock shared by every process logging to
+        this file, and return its result.
+        """
+        if fcntl is None:
+            return func(*args)
+        # A fresh open file per call: a descriptor inherited across a fork
+        #  would share its lock with the parent.
+        with open(self.baseFilename + ".lock", "a") as lockfile:
+            fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
+            try:
+                return func(*args)
+            finally:
+                fcntl.flock(lockfile.fileno(), fcntl.LOCK_UN)
+
+    def _rollover(self):
+        """Rotate the file if, now that we hold the lock, it is still due;
+        another process may have just rotated it.  Returns the rotated
+        segment's path, or `None`.
+        """
+        try:
+            size = os.path.getsize(self.baseFilename)
+        except OSError:
+            size = 0
+        due = self.max_bytes and size >= self.max_bytes
+        if self.interval:
+            self._next_rollover = self._last_rotation() + self.interval
+            due = due or (size > 0 and time.time() >= self._next_rollover)
+        if not due:
+            self._size = size
+            return None
+        self.acquire()
+        try:
+            segment = self._rotate()
+        finally:
+            self.release()
+        # Record the rotation for every process's time-based schedule.
+        os.utime(self.baseFilename + ".lock", None)
+        return segment
+
+    def _rotate(self):
+        """Rename the file aside and reopen it; the handler lock must be
+        held.  Returns the rotated segment's path.
+        """
+        now = time.time()
+        stamp = "%s-%06d" % (time.strftime("%Y%m%d-%H%M%S",
+                                           time.localtime(now)),
+                             int((now % 1) * 1000000))
+        segment = "%s.%s" % (self.baseFilename, stamp)
+        serial = 0
+        while os.path.exists(segment) or os.path.exists(segment + ".gz"):
+            serial += 1
+            segment = "%s.%s-%d" % (self.baseFilename, stamp, serial)
+        if self.stream is not None:
+            self.stream.close()
+        os.rename(self.baseFilename, segment)
+        self.stream = self._open()
+        self._identity = self._stat_stream()
+        self._size = 0
+        if self.interval:
+            self._next_rollover = time.time() + self.interval
+        return segment
+
+    def _finish(self, segment):
+        """Compress a rotated segment, unless another process already has,
+        and prune old ones; the lock must be held.
+        """
+        if self.compress and os.path.exists(segment):
+            with open(segment, "rb") as src:
+                with gzip.open(segment + ".gz.tmp", "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+            os.rename(segment + ".gz.tmp", segment + ".gz")
+            os.remove(segment)
+        self._prune()
+
+    def _segments(self):
+        """Rotated segments, oldest first."""
+        dirname, base = os.path.split(self.baseFilename)
+        prefix = base + "."
+        found = []
+        for name in os.listdir(dirname or "."):
+            if not name.startswith(prefix):
+                continue
+            match = _SEGMENT.match(name[len(prefix):])
+            if match is None:
+                continue
+            key = (match.group(1), int(match.group(2) or 0))
+            found.append((key, os.path.join(dirname, name)))
+        return [path for _, path in sorted(found)]
+
+    def _compress_leftovers(self):
+        """Compress segments an earlier process rotated but did not."""
+        if not self.compress:
+            return
+        for segment in self._segments():
+            # Recent segments are left to the process that rotated them.
+            if (not segment.endswith(".gz") and
+                    time.time() - os.path.getmtime(segment) >= _SETTLE):
+                self._finish(segment)
+
+    def _prune(self):
+        """Delete all but the newest `backup_count` segments."""
+        segments = self._segments()
+        for segment in segments[:max(len(segments) - self.backup_count, 0)]:
+            os.remove(segment)
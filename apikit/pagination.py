@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""Concurrent fetching of paginated upstream listings"""
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from apikit.convenience import retry_request
+from apikit.tracing import propagate
+try:
+    from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+except ImportError:
+    from urllib import urlencode
+    from urlparse import parse_qsl, urlsplit, urlunsplit
+
+
+def paginate(url, headers=None, payload=None, auth=None, window=4,
+             page_param="page", tries=10, initial_interval=5, callback=None):
+    """Fetch every page of a listing which is paginated with `Link`
+    headers (as GitHub's API is), yielding the pages in order.
+
+    If the first page links to `rel="last"`, and the `next` and `last`
+    URLs differ in the `page_param` query parameter, all remaining pages
+    are known in advance and are fetched concurrently, at most `window` at
+    a time.  Otherwise each page's `rel="next"` link is followed, and the
+    next page is prefetched while the caller consumes the current one.
+
+    Every page is fetched with :func:`apikit.retry_request`; when called
+    while serving a traced request, pages fetched on pool threads are part
+    of the request's trace.
+
+    Parameters
+    ----------
+    url: `str`
+        URL of the first page.
+    headers: `dict`
+        HTTP headers to supply.
+    payload: `dict`
+        Query parameters for the first page.  Later pages use the URLs
+        from the `Link` header, which carry their own parameters.
+    auth: `tuple`
+        Authentication tuple for Basic/Digest/Custom HTTP Auth.
+    window: `int`, optional
+        Most pages in flight at once.  Defaults to `4`.
+    page_param: `str`, optional
+        Query parameter holding the page number.  Defaults to `page`.
+    tries: `int`
+        Attempts per page.  Defaults to `10`.
+    initial_interval: `int`
+        Backoff interval for each page, as for `retry_request`.  Defaults
+        to `5`.
+    callback : callable
+        Retry callback, as for `retry_request`.
+
+    Returns
+    -------
+    generator
+        Yields the :class:`requests.Response` for each page, in order.
+
+    Raises
+    ------
+    ValueError
+        If `window` is not positive; raised at once, not on iteration.
+    :class:`apikit.BackendError`
+        If any page cannot be fetched.
+    """
+    if window < 1:
+        raise ValueError("'window' must be positive")
+
+    def fetch(page_url, params=None):
+        """Fetch a single page."""
+        return retry_request("GET", page_url, headers=headers,
+                             payload=params, auth=auth, tries=tries,
+                             initial_interval=initial_interval,
+                             callback=callback)
+
+    # Pages fetched on pool threads stay part of the caller's trace.
+    return _pages(url, payload, propagate(fetch), window, page_param)
+
+
+def _pages(url, payload, fetch, window, page_param):
+    """Generator behind :func:`apikit.paginate`."""
+    resp = fetch(url, payload)
+    yield resp
+    nxt = resp.links.get("next", {}).get("url")
+    if not nxt:
+        return
+    last = resp.links.get("last", {}).get("url")
+    pages = _page_range(nxt, last, page_param)
+    executor = ThreadPoolExecutor(max_workers=window)
+    pending = []
+    try:
+        if pages is not None:
+            # Every page is known: keep `window` of them in flight.
+            pages = iter(pages)
+            for page_url in itertools.islice(pages, window):
+                pending.append(executor.submit(fetch, page_url))
+            while pending:
+                resp = pending.pop(0).result()
+                page_url = next(pages, None)
+                if page_url is not None:
+                    pending.append(executor.submit(fetch, page_url))
+                yield resp
+        else:
+            # Only the next page is known: fetch it while this one is
+            #  being consumed.
+            pending.append(executor.submit(fetch, nxt))
+            while pending:
+                resp = pending.pop(0).result()
+                nxt = resp.links.get("next", {}).get("url")
+                if nxt:
+                    pending.append(executor.submit(fetch, nxt))
+                yield resp
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def _page_range(nxt, last, page_param):
+    """Return a generator of the URLs of every page from `nxt` through
+    `last`, or `None` if they cannot be worked out from the page numbers.
+    """
+    if not last:
+        return None
+    nparts = urlsplit(nxt)
+    nquery = parse_qsl(nparts.query, keep_blank_values=True)
+    lquery = dict(parse_qsl(urlsplit(last).query, keep_blank_values=True))
+    try:
+        first = int(dict(nquery)[page_param])
+        final = int(lquery[page_param])
+    except (KeyError, ValueError):
+        return None
+    return _page_urls(nparts, nquery, page_param, first, final)
+
+
+def _page_urls(nparts, nquery, page_param, first, final):
+    """Yield the URL of each page from `first` through `final`."""
+    for page in range(first, final + 1):
+        query = [(k, str(page) if k == page_param else v)
+                 for k, v in nquery]
+        yield urlunsplit((nparts.scheme, nparts.netloc, nparts.path,
+                          urlencode(query), nparts.fragment))
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+"""On-demand stack-sampling profiler for LSST microservices"""
+import os
+import sys
+import threading
+import time
+from flask import Response, current_app, jsonify, request
+from apikit.auth import authenticator
+from apikit.convenience import BackendError
+
+
+class SamplingProfiler(object):
+    """
+    A low-overhead statistical profiler that periodically samples the stacks
+    of every thread in the process.
+
+    Nothing is installed in the interpreter (no `sys.setprofile` or
+    `sys.settrace` hooks), so the profiler costs nothing when it is not
+    running.  While running, the sampling loop executes in the calling
+    thread, which is excluded from its own samples.
+
+    Only one profile may run in a process at a time, since the samples
+    cover every thread anyway; this makes it safe to trigger from a
+    threaded server.
+
+    Parameters
+    ----------
+    interval: `float`, optional
+        Seconds between samples.  Defaults to `0.005`.
+    """
+
+    _active = threading.Lock()
+
+    def __init__(self, interval=0.005):
+        """Create a new profiler."""
+        if not isinstance(interval, (int, float)) or interval <= 0:
+            raise ValueError("'interval' must be a positive number")
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self.duration = 0.0
+
+    def run(self, duration):
+        """Sample all threads for `duration` seconds.
+
+        Parameters
+        ----------
+        duration: `float`
+            Number of seconds to sample for.
+
+        Raises
+        ------
+        :class:`apikit.BackendError`
+            With `status_code` `409` if another profile is already running.
+
+        Returns
+        -------
+        :class:`apikit.profiler.SamplingProfiler`
+            `self`, so that results may be read off directly.
+        """
+        if not SamplingProfiler._active.acquire(False):
+            raise BackendError(status_code=409, reason="Conflict",
+                               content="A profile is already running")
+        try:
+            self._sample(duration)
+        finally:
+            SamplingProfiler._active.release()
+        return self
+
+    def _sample(self, duration):
+        """Inner sampling loop."""
+        me = threading.current_thread().ident
+        stacks = {}
+        samples = 0
+        start = time.time()
+        deadline = start + duration
+        while True:
+            # pylint: disable=protected-access
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                key = _collapse(frame)
+                stacks[key] = stacks.get(key, 0) + 1
+            samples += 1
+            now = time.time()
+            if now >= deadline:
+                break
+            time.sleep(min(self.interval, deadline - now))
+        self.stacks = stacks
+        self.samples = samples
+        self.duration = time.time() - start
+
+    def collapsed(self):
+        """Return the samples in collapsed-stack format, as consumed by
+        `flamegraph.pl` and compatible tools: one line per distinct stack,
+        frames from root to leaf separated by `;`, followed by a space and
+        the number of times that stack was seen.
+        """
+        lines = ["%s %d" % (";".join(stk), cnt) for stk, cnt in
+                 sorted(self.stacks.items(), key=lambda x: -x[1])]
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def top(self, limit=20):
+        """Return the hottest functions.
+
+        Parameters
+        ----------
+        limit: `int`, optional
+            Maximum number of entries to return.  Defaults to `20`.
+
+        Returns
+        -------
+        `list` of `dict`
+            Each entry has the fields `function` (`str`), `self` (number of
+            samples in which the function was the innermost frame), and
+            `total` (number of samples in which it appeared anywhere on the
+            stack), sorted by `self` and then `total`, descending.
+        """
+        selfcount = {}
+        total = {}
+        for stk, cnt in self.stacks.items():
+            if not stk:
+                continue
+            leaf = stk[-1]
+            selfcount[leaf] = selfcount.get(leaf, 0) + cnt
+            for func in set(stk):
+                total[func] = total.get(func, 0) + cnt
+        ranked = sorted(total.keys(),
+                        key=lambda f: (-selfcount.get(f, 0), -total[f]))
+        return [{"function": func,
+                 "self": selfcount.get(func, 0),
+                 "total": total[func]} for func in ranked[:limit]]
+
+
+def _collapse(frame):
+    """Turn a frame into a root-first tuple of frame descriptions."""
+    stk = []
+    while frame is not None:
+        code = frame.f_code
+        stk.append("%s (%s:%d)" % (code.co_name,
+                                   os.path.basename(code.co_filename),
+                                   code.co_firstlineno))
+        frame = frame.f_back
+    stk.reverse()
+    return tuple(stk)
+
+
+def add_profiler_route(app, route=None, max_seconds=60):
+    """
+    Creates an authenticated `/admin/profile` route that runs a
+    :class:`apikit.profiler.SamplingProfiler` over all threads.  If route
+    is specified, prepends it (or each component) to the front of the
+    route, as :func:`apikit.add_metadata_route` does.
+
+    The route accepts the query parameters `seconds` (default `5`),
+    `interval` (milliseconds between samples, default `5`), `top` (number
+    of hot functions to report, default `20`), and `format`.  With
+    `format=collapsed` the response is the plain-text collapsed stacks;
+    otherwise it is a JSON object with the fields `samples`, `duration`,
+    `collapsed`, and `top`.
+
+    Requests are authenticated according to the app's `AUTH`
+    configuration, by its :class:`apikit.auth.Authenticator`.
+
+    Parameters
+    ----------
+    app : :class:`flask.Flask` instance
+        Flask application with metadata already set.
+
+    route : `None`, `str`, or list of `str`, optional
+        The 'route' parameter must be None, a string, or a list of strings.
+        If supplied, each string will be prepended to the profiler route.
+
+    max_seconds: `int`, optional
+        Longest profile that may be requested.  Defaults to `60`.
+
+    Raises
+    ------
+    TypeError
+        If `route` is not of the appropriate type.
+    ValueError
+        If the app's `AUTH` type is `none` (the profiler is never served
+        unauthenticated), or its :class:`apikit.auth.Authenticator`
+        cannot be created.
+
+    Returns
+    -------
+        Nothing, but decorates app with `/admin/profile`.
+    """
+    errstr = add_profiler_route.__doc__
+    if route is None:
+        route = [""]
+    if isinstance(route, str):
+        route = [route]
+    if not isinstance(route, list):
+        raise TypeError(errstr)
+    if not all(isinstance(item, str) for item in route):
+        raise TypeError(errstr)
+    if app.config["AUTH"]["type"] == "none":
+        raise ValueError(errstr)
+    # Reject misconfigured auth now, not on the first request.
+    authenticator(app)
+    app.config["PROFILER_MAX_SECONDS"] = max_seconds
+    for rcomp in route:
+        rcomp = "/" + rcomp.strip("/")
+        if rcomp == "/":
+            rcomp = ""
+        with app.app_context():
+            app.add_url_rule(rcomp + "/admin/profile", '_return_profile',
+                             _return_profile)
+
+
+def _return_profile():
+    """
+    Run a profile and return its results.
+    Requires flask.current_app to be set, which means
+     `with app.app_context()`
+    """
+    auth = authenticator(current_app)
+    if not auth.check():
+        return auth.challenge()
+    try:
+        seconds = float(request.args.get("seconds", 5))
+        interval = float(request.args.get("interval", 5)) / 1000.0
+        limit = int(request.args.get("top", 20))
+    except ValueError:
+        return Response("Bad profiling parameters\n", 400)
+    if not 0 < seconds <= current_app.config["PROFILER_MAX_SECONDS"]:
+        return Response("Bad profiling duration\n", 400)
+    if not (interval > 0 and limit > 0):
+        return Response("Bad profiling parameters\n", 400)
+    try:
+        prof = SamplingProfiler(interval=interval).run(seconds)
+    except ValueError:
+        return Response("Bad profiling parameters\n", 400)
+    except BackendError as exc:
+        return Response(exc.content + "\n", exc.status_code)
+    if request.args.get("format") == "collapsed":
+        return Response(prof.collapsed(), 200, mimetype="text/plain")
+    return jsonify({"samples": prof.samples,
+                    "duration": prof.duration,
+                    "collapsed": prof.collapsed(),
+                    "top": prof.top(limit)})
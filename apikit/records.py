@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+"""Incremental parsing of large JSON responses"""
+import codecs
+import json
+from apikit.convenience import raise_ise
+
+_WHITESPACE = " \t\n\r"
+
+
+def iter_json_records(resp, lines=None, chunk_size=65536,
+                      max_record_size=16777216):
+    """Yield records, one at a time, from a streamed response whose body is
+    either a top-level JSON array or JSON lines (one JSON value per line),
+    without holding the whole body in memory.
+
+    Parameters
+    ----------
+    resp: :class:`apikit.ResponseStream`, :class:`requests.Response`, or
+        iterable of `bytes`
+        The body to parse.  A :class:`requests.Response` should have been
+        requested with `stream=True`; the result of
+        `apikit.retry_request(..., stream=True)` is ideal, since it also
+        resumes interrupted transfers.
+    lines: `bool` or `None`, optional
+        `True` for JSON lines, `False` for a top-level array, `None` (the
+        default) to decide from the first non-whitespace character of the
+        body.
+    chunk_size: `int`, optional
+        Bytes to read at a time from a :class:`requests.Response`.
+        Defaults to `65536`.
+    max_record_size: `int`, optional
+        Largest single record, in characters, that will be buffered.
+        Defaults to 16 MiB.
+
+    Returns
+    -------
+    generator
+        Yields each record as it would be returned by `json.loads`.
+
+    Raises
+    ------
+    :class:`apikit.BackendError`
+        The `status_code` will be `500`, and the reason `Internal Server
+        Error`, if the body is malformed or a record exceeds
+        `max_record_size`.
+    """
+    if hasattr(resp, "iter_content"):
+        chunks = resp.iter_content(chunk_size)
+    else:
+        chunks = iter(resp)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    text = _iter_text(chunks, decoder)
+    buf = ""
+    for piece in text:
+        buf += piece
+        if buf.lstrip(_WHITESPACE):
+            break
+    buf = buf.lstrip(_WHITESPACE)
+    if not buf:
+        return
+    if lines is None:
+        lines = not buf.startswith("[")
+    if lines:
+        records = _iter_lines(buf, text, max_record_size)
+    else:
+        records = _iter_array(buf, text, max_record_size)
+    for record in records:
+        yield record
+
+
+def _iter_text(chunks, decoder):
+    """Decode `bytes` chunks to text."""
+    for chunk in chunks:
+        piece = decoder.decode(chunk)
+        if piece:
+            yield piece
+    piece = decoder.decode(b"", final=True)
+    if piece:
+        yield piece
+
+
+def _iter_lines(buf, text, max_record_size):
+    """Parse JSON lines."""
+    more = True
+    while True:
+        nl = buf.find("\n")
+        if nl < 0 and more:
+            if len(buf) > max_record_size:
+                raise_ise("JSON record exceeds %d characters" %
+                          max_record_size)
+            try:
+                buf += next(text)
+            except StopIteration:
+                more = False
+            continue
+        if nl < 0:
+            line, buf = buf, ""
+        else:
+            line, buf = buf[:nl], buf[nl + 1:]
+        line = line.strip(_WHITESPACE)
+        if line:
+            try:
+                yield json.loads(line)
+            except ValueError as exc:
+                raise_ise("Malformed JSON line: %s" % exc)
+        if not more and not buf:
+            return
+
+
+def _iter_array(buf, text, max_record_size):
+    """Parse the elements of a top-level JSON array."""
+    decoder = json.JSONDecoder()
+    pos = 1
+    expect_value = True
+    first = True
+    more = True
+    while True:
+        while pos < len(buf) and buf[pos] in _WHITESPACE:
+            pos += 1
+        if pos >= len(buf):
+            buf, pos, more = _refill(buf, pos, text, more, max_record_size)
+            continue
+        char = buf[pos]
+        if char == "]" and (first or not expect_value):
+            rest = buf[pos + 1:]
+            while True:
+                if rest.strip(_WHITESPACE):
+                    raise_ise("Trailing data after JSON array")
+                try:
+                    rest = next(text)
+                except StopIteration:
+                    return
+        if not expect_value:
+            if char != ",":
+                raise_ise("Expected ',' or ']' in JSON array, got %r" % char)
+            pos += 1
+            expect_value = True
+            continue
+        try:
+            record, end = decoder.raw_decode(buf, pos)
+        except ValueError as exc:
+            if not more:
+                raise_ise("Malformed JSON array: %s" % exc)
+            # Read at least as much again before reparsing, so that a
+            #  large record costs linear rather than quadratic time.
+            buf, pos, more = _refill(buf, pos, text, more, max_record_size,
+                                     2 * (len(buf) - pos))
+            continue
+        # A number at the end of the buffer may be cut short (`-7.` of
+        #  `-7.5e3`); be sure the value is delimited before accepting it.
+        tail = end
+        while tail < len(buf) and buf[tail] in _WHITESPACE:
+            tail += 1
+        if (tail >= len(buf) or buf[tail] not in ",]") and more:
+            buf, pos, more = _refill(buf, pos, text, more, max_record_size,
+                                     2 * (len(buf) - pos))
+            continue
+        yield record
+        pos = end
+        expect_value = False
+        first = False
+
+
+def _refill(buf, pos, text, more, max_record_size, minimum=0):
+    """Discard consumed text and read more, until the buffer holds at
+    least `minimum` characters or the text is exhausted.  Returns the new
+    buffer, position, and whether more text may follow.
+    """
+    if not more:
+        raise_ise("Truncated JSON array")
+    pieces = [buf[pos:]]
+    size = len(pieces[0])
+    while True:
+        if size > max_record_size:
+            raise_ise("JSON record exceeds %d characters" % max_record_size)
+        try:
+            piece = next(text)
+        except StopIteration:
+            more = False
+            break
+        pieces.append(piece)
+        size += len(piece)
+        if size >= minimum:
+            break
+    return "".join(pieces), 0, more
@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+"""Pre-fork production server for LSST microservices"""
+import argparse
+import errno
+import importlib
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class _QuietHandler(WSGIRequestHandler):
+    """Request handler which leaves access logging to the application."""
+
+    def log_message(self, *args):
+        """Do not write access logs to stderr."""
+        pass
+
+
+class _PooledWSGIServer(WSGIServer):
+    """WSGI server that serves each accepted connection on its own thread,
+    at most `threads` at once, and which serves from an already-listening
+    socket.
+
+    A slot is taken before `accept()`, so a worker whose threads are all
+    busy stops accepting and leaves new connections to idle workers.
+    """
+
+    def __init__(self, listener, app, threads, on_request):
+        """Create a server on `listener`, without binding."""
+        WSGIServer.__init__(self, listener.getsockname()[:2], _QuietHandler,
+                            bind_and_activate=False)
+        self.socket.close()
+        self.socket = listener
+        host, port = listener.getsockname()[:2]
+        self.server_name = socket.getfqdn(host)
+        self.server_port = port
+        self.setup_environ()
+        self.set_app(app)
+        self.threads = threads
+        self.slots = threading.Semaphore(threads)
+        self.on_request = on_request
+
+    def get_request(self):
+        """Wait for a free thread, then accept a connection."""
+        self.slots.acquire()
+        try:
+            return WSGIServer.get_request(self)
+        except Exception:
+            # Usually another worker won the accept().
+            self.slots.release()
+            raise
+
+    def process_request(self, request, client_address):
+        """Serve the connection on its own thread."""
+        thd = threading.Thread(target=self._process,
+                               args=(request, client_address))
+        thd.daemon = True
+        thd.start()
+
+    def _process(self, request, client_address):
+        """Serve one connection, account for it, and free its slot."""
+        try:
+            self.finish_request(request, client_address)
+        except Exception:  # pylint: disable=broad-except
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+            self.on_request()
+
+    def server_close(self):
+        """Finish in-flight requests; leave the shared socket open."""
+        for _ in range(self.threads):
+            self.slots.acquire()
+        for _ in range(self.threads):
+            self.slots.release()
+
+
+class PreforkServer(object):
+    """
+    A pre-fork, multi-process, multi-threaded WSGI server built only on the
+    standard library.
+
+    The master process opens one listening socket and forks `workers`
+    children, each of which accepts connections from that socket and
+    serves them on up to `threads` threads.  A worker whose threads are
+    all busy stops accepting, leaving new connections to idle workers.
+    The master restarts any worker that exits.
+
+    Workers recycle themselves (finish in-flight requests, exit, and are
+    replaced) once they have served `max_requests` requests or their peak
+    resident set size exceeds `max_memory` megabytes.  Each worker
+    reconfigures the app's logger once after it starts, so that no log
+    handler state is shared with the master.
+
+    Signals to the master:
+
+    - `SIGHUP`: graceful restart.  Fresh workers are started, and the old
+      ones finish their in-flight requests and exit.
+    - `SIGTERM`, `SIGINT`: graceful shutdown.  Workers that have not
+      finished within `graceful_timeout` seconds are killed.
+
+    Parameters
+    ----------
+    app: WSGI application
+        Usually a :class:`apikit.APIFlask`.
+    host: `str`, optional
+        Address to listen on.  Defaults to `0.0.0.0`.
+    port: `int`, optional
+        Port to listen on.  Defaults to `5000`.
+    workers: `int` or `None`, optional
+        Number of worker processes.  Defaults to the number of CPUs.
+    threads: `int`, optional
+        Threads per worker.  Defaults to `4`.
+    max_requests: `int` or `None`, optional
+        Requests after which a worker is recycled.  `None` (the default)
+        means never.
+    max_memory: `int` or `None`, optional
+        Peak RSS, in megabytes, after which a worker is recycled.  `None`
+        (the default) means never.
+    graceful_timeout: `float`, optional
+        Seconds to wait for workers to finish on shutdown.  Defaults to
+        `30`.
+    backlog: `int`, optional
+        Listen backlog.  Defaults to `128`.
+    """
+
+    def __init__(self, app, host="0.0.0.0", port=5000, workers=None,
+                 threads=4, max_requests=None, max_memory=None,
+                 graceful_timeout=30, backlog=128):
+        """Create a new server."""
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        if workers < 1 or threads < 1:
+            raise ValueError("'workers' and 'threads' must be positive")
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.threads = threads
+        self.max_requests = max_requests
+        self.max_memory = max_memory
+        self.graceful_timeout = graceful_timeout
+        self.backlog = backlog
+        self.listener = None
+        self._children = {}
+        self._retiring = set()
+        self._stopping = False
+        self._restart = False
+
+    def bind(self):
+        """Open the shared listening socket.  Called by `run` if needed."""
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((self.host, self.port))
+        listener.listen(self.backlog)
+        # Every worker selects on the same socket; only one wins accept().
+        listener.setblocking(False)
+        self.listener = listener
+        self.port = listener.getsockname()[1]
+        return listener
+
+    def run(self):
+        """Run the master process until told to stop."""
+        if self.listener is None:
+            self.bind()
+        signal.signal(signal.SIGHUP, self._on_hup)
+        signal.signal(signal.SIGTERM, self._on_term)
+        signal.signal(signal.SIGINT, self._on_term)
+        self._spawn_all()
+        while not self._stopping:
+            if self._restart:
+                self._restart = False
+                old = list(self._children.keys())
+                self._retiring.update(old)
+                self._children = {}
+                self._spawn_all()
+                self._signal(old, signal.SIGTERM)
+            self._reap()
+            while len(self._children) < self.workers and not self._stopping:
+                self._spawn()
+            time.sleep(0.1)
+        self._signal(self._alive(), signal.SIGTERM)
+        deadline = time.time() + self.graceful_timeout
+        while self._alive() and time.time() < deadline:
+            time.sleep(0.1)
+            self._reap()
+        self._signal(self._alive(), signal.SIGKILL)
+        for pid in self._alive():
+            os.waitpid(pid, 0)
+        self._children = {}
+        self._retiring = set()
+        self.listener.close()
+
+    def _on_hup(self, signum, frame):
+        """Master SIGHUP handler."""
+        # pylint: disable=unused-argument
+        self._restart = True
+
+    def _on_term(self, signum, frame):
+        """Master SIGTERM/SIGINT handler."""
+        # pylint: disable=unused-argument
+        self._stopping = True
+
+    @staticmethod
+    def _signal(pids, signum):
+        """Send `signum` to each of `pids` that still exists."""
+        for pid in pids:
+            try:
+                os.kill(pid, signum)
+            except OSError as exc:
+                if exc.errno != errno.ESRCH:
+                    raise
+
+    def _alive(self):
+        """Pids of all running children, current and retiring."""
+        return list(self._children.keys()) + list(self._retiring)
+
+    def _reap(self):
+        """Collect exited workers."""
+        while True:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except OSError as exc:
+                if exc.errno == errno.ECHILD:
+                    self._children = {}
+                    self._retiring = set()
+                    return
+                raise
+            if pid == 0:
+                return
+            self._children.pop(pid, None)
+            self._retiring.discard(pid)
+
+    def _spawn_all(self):
+        """Start a full complement of workers."""
+        for _ in range(self.workers):
+            self._spawn()
+
+    def _spawn(self):
+        """Fork one worker."""
+        pid = os.fork()
+        if pid:
+            self._children[pid] = time.time()
+            return
+        status = 0
+        try:
+            self._worker()
+        except BaseException:  # pylint: disable=broad-except
+            logging.getLogger(__name__).exception("Worker failed")
+            status = 1
+        finally:
+            os._exit(status)  # pylint: disable=protected-access
+
+    def _worker(self):
+        """Body of a worker process."""
+        done = threading.Event()
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, lambda signum, frame: done.set())
+        _reset_logging(self.app)
+        warm_up = getattr(self.app, "warm_up", None)
+        if warm_up is not None:
+            warm_up()
+        served = [0]
+        lock = threading.Lock()
+
+        def on_request():
+            """Check recycle limits after each request."""
+            with lock:
+                served[0] += 1
+                count = served[0]
+            if self.max_requests and count >= self.max_requests:
+                done.set()
+            if self.max_memory and _peak_rss_mb() >= self.max_memory:
+                done.set()
+
+        server = _PooledWSGIServer(self.listener, self.app, self.threads,
+                                   on_request)
+        thd = threading.Thread(target=server.serve_forever,
+                               kwargs={"poll_interval": 0.1})
+        thd.daemon = True
+        thd.start()
+        while not done.wait(0.5):
+            if os.getppid() == 1:
+                # Master is gone
+                break
+        server.shutdown()
+        server.server_close()
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process, in megabytes."""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / (1024.0 * 1024.0)
+    return peak / 1024.0
+
+
+def _reset_logging(app):
+    """Drop log handlers inherited from the master and let the app build
+    its own, once, in this worker.
+    """
+    setup = getattr(app, "setup_logging", None)
+    if setup is None:
+        return
+    root_logger = logging.getLogger()
+    for handler in root_logger.handlers[:]:
+        root_logger.removeHandler(handler)
+        handler.close()
+    setup()
+
+
+def _load_app(target):
+    """Import `module:attribute` and return the application.  If the
+    attribute is a callable factory rather than a WSGI app, call it.
+    """
+    if ":" in target:
+        modname, attr = target.split(":", 1)
+    else:
+        modname, attr = target, "app"
+    sys.path.insert(0, os.getcwd())
+    mod = importlib.import_module(modname)
+    app = getattr(mod, attr)
+    if not hasattr(app, "wsgi_app") and callable(app):
+        app = app()
+    return app
+
+
+def main(argv=None):
+    """Entry point for the `apikit` console script."""
+    parser = argparse.ArgumentParser(
+        prog="apikit", description="LSST DM SQuaRE microservice tools")
+    subparsers = parser.add_subparsers(dest="command")
+    serve = subparsers.add_parser(
+        "serve", help="Run an app under the pre-fork server")
+    serve.add_argument("app", help="Application, as 'module:attribute'")
+    serve.add_argument("--host", default="0.0.0.0")
+    serve.add_argument("--port", type=int, default=5000)
+    serve.add_argument("--workers", type=int, default=None)
+    serve.add_argument("--threads", type=int, default=4)
+    serve.add_argument("--max-requests", type=int, default=None)
+    serve.add_argument("--max-memory", type=int, default=None,
+                       help="Recycle workers above this peak RSS (MB)")
+    serve.add_argument("--graceful-timeout", type=float, default=30)
+    args = parser.parse_args(argv)
+    if args.command != "serve":
+        parser.print_help()
+        return 2
+    PreforkServer(_load_app(args.app), host=args.host, port=args.port,
+                  workers=args.workers, threads=args.threads,
+                  max_requests=args.max_requests,
+                  max_memory=args.max_memory,
+                  graceful_timeout=args.graceful_timeout).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""Detection and reporting of individual slow requests"""
+import sys
+import threading
+import time
+import traceback
+from flask import current_app, g, request
+from apikit.fastpath import RENDERING, render_safe
+
+
+class SlowRequestDetector(object):
+    """
+    Flask middleware which emits one structured log event, through the
+    app's `LOGGER`, for each request that takes longer than `threshold`
+    seconds.
+
+    A single monitor thread watches in-flight requests; once a request has
+    been running longer than `threshold`, the monitor snapshots the stack
+    of the thread serving it, so that the logged stack shows where the
+    request was stuck rather than where it finished.  The event also
+    carries the timing of each `apikit.retry_request` call made while
+    serving the request.
+
+    At most one event per route is emitted every `rate_limit` seconds;
+    the number of slow requests suppressed in between is reported with
+    the next event.
+
+    Parameters
+    ----------
+    app: :class:`apikit.APIFlask` or `None`
+        Application to attach to.  If `None`, call `init_app` later.
+
+    threshold: `float`, optional
+        Latency, in seconds, above which a request is slow.  Defaults to
+        `1.0`.
+
+    rate_limit: `float`, optional
+        Minimum seconds between events for the same route.  Defaults to
+        `60.0`.
+    """
+
+    def __init__(self, app=None, threshold=1.0, rate_limit=60.0):
+        """Create a new detector."""
+        if not isinstance(threshold, (int, float)) or threshold <= 0:
+            raise ValueError("'threshold' must be a positive number")
+        self.threshold = threshold
+        self.rate_limit = rate_limit
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._last = {}
+        self._suppressed = {}
+        self._monitor = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Attach the detector to `app`."""
+        app.before_request(self._before)
+        app.teardown_request(self._teardown)
+        app.config["SLOW_REQUEST_DETECTOR"] = self
+
+    @render_safe
+    def _before(self):
+        """Register the request as in flight, unless it is only rendering
+        a fast-path response.
+        """
+        if request.environ.get(RENDERING):
+            return
+        ident = threading.current_thread().ident
+        g.apikit_slow_ident = ident
+        with self._lock:
+            self._inflight[ident] = [time.time(), None]
+            if self._monitor is None or not self._monitor.is_alive():
+                self._monitor = threading.Thread(target=self._watch,
+                                                 name="apikit-slow-request")
+                self._monitor.daemon = True
+                self._monitor.start()
+
+    def _watch(self):
+        """Snapshot the stacks of requests which have become slow."""
+        poll = max(self.threshold / 4.0, 0.005)
+        while True:
+            time.sleep(poll)
+            now = time.time()
+            with self._lock:
+                late = [ident for ident, entry in self._inflight.items()
+                        if entry[1] is None and
+                        now - entry[0] >= self.threshold]
+                if not late:
+                    continue
+                # pylint: disable=protected-access
+                frames = sys._current_frames()
+                for ident in late:
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        self._inflight[ident][1] = [
+                            line.rstrip() for line in
+                            traceback.format_stack(frame)]
+
+    def _teardown(self, exc=None):
+        """Emit an event if the request was slow."""
+        # pylint: disable=unused-argument
+        ident = g.get("apikit_slow_ident")
+        if ident is None:
+            return
+        with self._lock:
+            entry = self._inflight.pop(ident, None)
+        if entry is None:
+            return
+        started, stack = entry
+        elapsed = time.time() - started
+        if elapsed < self.threshold:
+            return
+        rule = request.url_rule
+        # Unmatched paths share one key, so that scanners cannot grow the
+        #  rate-limit tables without bound.
+        route = rule.rule if rule is not None else "<unmatched>"
+        with self._lock:
+            now = time.time()
+            if now - self._last.get(route, 0) < self.rate_limit:
+                self._suppressed[route] = self._suppressed.get(route, 0) + 1
+                return
+            self._last[route] = now
+            suppressed = self._suppressed.pop(route, 0)
+        upstream = g.get("apikit_upstream", [])
+        current_app.config["LOGGER"].warning(
+            "Slow request",
+            route=route,
+            method=request.method,
+            path=request.path,
+            elapsed=elapsed,
+            threshold=self.threshold,
+            upstream_elapsed=sum(x["elapsed"] for x in upstream),
+            upstream=upstream,
+            stack=stack,
+            suppressed=suppressed)
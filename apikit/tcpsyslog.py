@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+"""Batched, spooling TCP syslog transport"""
+import logging
+import logging.handlers
+import os
+import socket
+import threading
+import time
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Syslog severities for logging levels.
+_SEVERITY = [(logging.CRITICAL, 2), (logging.ERROR, 3), (logging.WARNING, 4),
+             (logging.INFO, 6)]
+
+
+class TCPSysLogHandler(logging.Handler):
+    """
+    A logging handler which sends records to a syslog collector over one
+    persistent TCP connection, framed by octet counting as in RFC 6587
+    (`LEN SP <PRI>MSG`), so messages of any length arrive intact.
+
+    `emit` only queues the formatted frame.  A background thread sends
+    queued frames in batches, whenever `batch_bytes` have accumulated or
+    every `flush_interval` seconds.  If the collector cannot be reached,
+    the thread reconnects with exponential backoff up to `max_backoff`
+    seconds; meanwhile batches are appended to the `spool` file, if one is
+    given, and replayed in order once the collector is back.  Without a
+    spool, up to `buffer_bytes` of unsent frames are held in memory and
+    the oldest records beyond that are dropped and counted in `dropped`.
+    While backing off, the thread sleeps until the next attempt (waking
+    every `flush_interval` to spool), however much is queued.
+
+    Every process logging through a handler, such as the workers of a
+    :class:`apikit.PreforkServer`, runs its own sender thread, started on
+    its first record after a fork.  They may share one spool: each takes
+    an exclusive lock on `<spool>.lock` to append to it, and holds it
+    while draining the spool, so every spooled frame is sent once.
+
+    A connection that fails part way through a frame is abandoned, and
+    the frame is sent again, whole, on the next connection; the collector
+    discards the truncated copy.
+
+    Parameters
+    ----------
+    host: `str`, optional
+        Collector host.  Defaults to `localhost`.
+    port: `int`, optional
+        Collector port.  Defaults to `514`.
+    facility: `int`, optional
+        Syslog facility.  Defaults to `LOG_USER`.
+    spool: `str` or `None`, optional
+        Path of a file to hold frames while the collector is unreachable.
+    batch_bytes: `int`, optional
+        Queue size that triggers an immediate send.  Defaults to `65536`.
+    flush_interval: `float`, optional
+        Longest time a frame waits in the queue.  Defaults to `1.0`.
+    max_backoff: `float`, optional
+        Longest wait between reconnection attempts.  Defaults to `30`.
+    buffer_bytes: `int`, optional
+        Unsent frames held in memory without a spool.  Defaults to 16 MiB.
+    timeout: `float`, optional
+        Socket connect and send timeout.  Defaults to `5`.
+    """
+
+    def __init__(self, host="localhost", port=514,
+                 facility=logging.handlers.SysLogHandler.LOG_USER,
+                 spool=None, batch_bytes=65536, flush_interval=1.0,
+                 max_backoff=30.0, buffer_bytes=16777216, timeout=5.0):
+        """Create the handler and start its sender thread."""
+        logging.Handler.__init__(self)
+        self.address = (host, port)
+        self.facility = facility
+        self.spool = spool
+        self.batch_bytes = batch_bytes
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.buffer_bytes = buffer_bytes
+        self.timeout = timeout
+        self.dropped = 0
+        self._sock = None
+        self._backoff = 0.0
+        self._next_connect = 0.0
+        self._queue = []
+        self._queued = 0
+        self._sending = False
+        self._closing = False
+        self._start()
+
+    def _start(self):
+        """Start the sender thread for this process."""
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run,
+                                        name="apikit-syslog")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _frame(self, record):
+        """Octet-counted frame for `record`."""
+        severity = 7
+        for level, sev in _SEVERITY:
+            if record.levelno >= level:
+                severity = sev
+                break
+        msg = ("<%d>" % (self.facility * 8 + severity) +
+               self.format(record)).encode("utf-8")
+        return ("%d " % len(msg)).encode("ascii") + msg
+
+    def emit(self, record):
+        """Queue a record for sending."""
+        try:
+            frame = self._frame(record)
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+            return
+        if self._pid != os.getpid():
+            # First record in a forked worker: the parent's thread did not
+            #  survive the fork, and its queue and connection are its own.
+            self._queue = []
+            self._queued = 0
+            self._sending = False
+            self._sock = None
+            self._backoff = 0.0
+            self._next_connect = 0.0
+            self._start()
+        with self._cond:
+            self._queue.append(frame)
+            self._queued += len(frame)
+            # Wake the sender only on crossing the threshold, so that a
+            #  queue held back by backoff does not wake it on every record.
+            if self._queued >= self.batch_bytes > self._queued - len(frame):
+                self._cond.notify_all()
+
+    def flush(self):
+        """Wait, for at most `timeout` seconds, until everything queued so
+        far has been sent or spooled.
+        """
+        deadline = time.time() + self.timeout
+        with self._cond:
+            self._cond.notify_all()
+            while ((self._queue or self._sending) and
+                   self._thread.is_alive() and time.time() < deadline):
+                self._cond.wait(0.05)
+
+    def close(self):
+        """Send what can be sent, then stop the sender thread."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join(self.timeout + 1)
+        self._disconnect()
+        logging.Handler.close(self)
+
+    def _run(self):
+        """Sender thread."""
+        while True:
+            with self._cond:
+                backoff = (self._next_connect - time.time()
+                           if self._sock is None else 0)
+                if not self._closing:
+                    if backoff > 0:
+                        self._cond.wait(min(backoff, self.flush_interval))
+                    elif self._queued < self.batch_bytes:
+                        self._cond.wait(self.flush_interval)
+                batch = self._queue
+                self._queue = []
+                self._queued = 0
+                closing = self._closing
+                self._sending = bool(batch)
+            try:
+                if batch or self._spool_pending():
+                    self._deliver(batch)
+            finally:
+                with self._cond:
+                    self._sending = False
+                    self._cond.notify_all()
+            if closing:
+                return
+
+    def _deliver(self, frames):
+        """Send `frames`, preserving order with anything spooled."""
+        if self.spool is not None:
+            if self._spool_pending():
+                # Spooled frames go first, so queue behind them.
+                self._append_spool(frames)
+                self._drain_spool()
+            elif frames:
+                self._append_spool(self._send(frames))
+            return
+        if frames:
+            unsent = self._send(frames)
+            if unsent:
+                self._requeue(unsent)
+
+    def _locked(self, func, *args):
+        """Call `func` holding the lock shared by every process using this
+        spool, and return its result.
+        """
+        if fcntl is None:
+            return func(*args)
+        # A fresh open file per call: a descriptor inherited across a fork
+        #  would share its lock with the parent.
+        with open(self.spool + ".lock", "a") as lockfile:
+            fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
+            try:
+                return func(*args)
+            finally:
+                fcntl.flock(lockfile.fileno(), fcntl.LOCK_UN)
+
+    def _append_spool(self, frames):
+        """Add `frames` to the end of the spool file."""
+        if frames:
+            self._locked(self._write_spool, b"".join(frames))
+
+    def _write_spool(self, data):
+        """Append `data` to the spool file."""
+        with open(self.spool, "ab") as spf:
+            spf.write(data)
+
+    def _requeue(self, frames):
+        """Put unsent frames back at the front of the queue, dropping the
+        oldest as needed to keep within `buffer_bytes`.
+        """
+        with self._cond:
+            total = sum(len(frame) for frame in frames) + self._queued
+            drop = 0
+            while drop < len(frames) and total > self.buffer_bytes:
+                total -= len(frames[drop])
+                drop += 1
+            self.dropped += drop
+            self._queue[0:0] = frames[drop:]
+            self._queued = total
+
+    def _spool_pending(self):
+        """Is there spooled data left to send?"""
+        if self.spool is None:
+            return False
+        try:
+            return os.path.getsize(self.spool) > 0
+        except OSError:
+            return False
+
+    def _drain_spool(self):
+        """Send the spool file, then empty it, holding the spool lock."""
+        self._locked(self._drain_spool_locked)
+
+    def _drain_spool_locked(self):
+        """Send the spool file; empty it, or, if the collector went away,
+        leave only the frames not yet sent.
+        """
+        try:
+            spf = open(self.spool, "rb")
+        except (IOError, OSError):
+            return
+        with spf:
+            while True:
+                start = spf.tell()
+                frames = self._read_frames(spf)
+                if not frames:
+                    break
+                unsent = self._send(frames)
+                if unsent:
+                    spf.seek(start + sum(
+                        len(frame) for frame in frames[:-len(unsent)]))
+                    self._keep_spool(spf)
+                    return
+        with open(self.spool, "wb"):
+            pass
+
+    def _keep_spool(self, spf):
+        """Replace the spool with the rest of `spf`, atomically, so that
+        a crash leaves either the old spool or the new one.
+        """
+        tmp = "%s.%d.tmp" % (self.spool, os.getpid())
+        with open(tmp, "wb") as out:
+            while True:
+                chunk = spf.read(65536)
+                if not chunk:
+                    break
+                out.write(chunk)
+        getattr(os, "replace", os.rename)(tmp, self.spool)
+
+    def _read_frames(self, spf):
+        """Read whole frames, about `batch_bytes` of them, from `spf`.  A
+        frame cut short by a crash while spooling ends the list.
+        """
+        frames = []
+        size = 0
+        while size < self.batch_bytes:
+            start = spf.tell()
+            head = spf.read(16)
+            space = head.find(b" ")
+            if space <= 0 or not head[:space].isdigit():
+                break
+            spf.seek(start + space + 1)
+            length = int(head[:space])
+            msg = spf.read(length)
+            if len(msg) < length:
+                break
+            frames.append(head[:space + 1] + msg)
+            size += len(frames[-1])
+        return frames
+
+    def _send(self, frames):
+        """Send `frames` over the connection, connecting if need be.
+        Returns the frames not sent in full, which must be sent again on
+        a new connection.
+        """
+        if self._sock is None:
+            now = time.time()
+            if now < self._next_connect:
+                return frames
+            try:
+                self._sock = socket.create_connection(self.address,
+                                                      self.timeout)
+            except (OSError, socket.error):
+                self._failed()
+                return frames
+        data = memoryview(b"".join(frames))
+        sent = 0
+        try:
+            while sent < len(data):
+                sent += self._sock.send(data[sent:])
+        except (OSError, socket.error):
+            self._disconnect()
+            self._failed()
+            for n, frame in enumerate(frames):
+                if sent < len(frame):
+                    return frames[n:]
+                sent -= len(frame)
+        self._backoff = 0.0
+        return []
+
+    def _failed(self):
+        """Schedule the next connection attempt."""
+        self._backoff = min(max(self._backoff * 2, 0.1), self.max_backoff)
+        self._next_connect = time.time() + self._backoff
+
+    def _disconnect(self):
+        """Drop the connection."""
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except (OSError, socket.error):
+                pass
+            self._sock = None
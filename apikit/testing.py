@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+"""Fault-injecting upstream stub and load driver for testing services"""
+import json
+import math
+import random
+import socket
+import struct
+import threading
+import time
+import requests
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+def uniform(low, high):
+    """Latency distribution: uniform between `low` and `high` seconds."""
+    return lambda rng: rng.uniform(low, high)
+
+
+def exponential(mean):
+    """Latency distribution: exponential with the given mean, in
+    seconds.
+    """
+    return lambda rng: rng.expovariate(1.0 / mean)
+
+
+def lognormal(median, sigma):
+    """Latency distribution: log-normal with the given median, in seconds,
+    and shape `sigma`.  Heavy-tailed, like most real services.
+    """
+    return lambda rng: rng.lognormvariate(math.log(median), sigma)
+
+
+class FaultProfile(object):
+    """
+    How a :class:`apikit.testing.StubServer` route behaves.
+
+    Parameters
+    ----------
+    status: `int`, optional
+        Status of a normal response.  Defaults to `200`.
+    body: `bytes`, `str`, or JSON-serializable, optional
+        Body of a normal response.  Defaults to `{}`.
+    headers: `dict`, optional
+        Extra headers for every response.
+    latency: `float`, callable, or `None`, optional
+        Delay before responding: a number of seconds, or a callable taking
+        a :class:`random.Random` and returning seconds, such as
+        :func:`apikit.testing.lognormal`.
+    error_rate: `float` or callable, optional
+        Probability of answering with `error_status` instead: a number, or
+        a callable taking the seconds since the server started and
+        returning a probability, for error storms that come and go.
+    error_status: `int`, optional
+        Status of an injected error.  Defaults to `503`.
+    schedule: list of `int`, optional
+        Statuses for the first requests, in order, before the profile's
+        random behaviour takes over.  `[503, 503]` fails twice, then
+        succeeds.  A status of `0` resets the connection.
+    retry_after: `int` or `None`, optional
+        If set, injected errors carry this `Retry-After` header.
+    reset_rate: `float`, optional
+        Probability of resetting the connection without any response.
+    bytes_per_second: `float` or `None`, optional
+        If set, the body is trickled out at this rate.
+    """
+
+    def __init__(self, status=200, body=None, headers=None, latency=None,
+                 error_rate=0.0, error_status=503, schedule=None,
+                 retry_after=None, reset_rate=0.0, bytes_per_second=None):
+        """Create a profile."""
+        if body is None:
+            body = {}
+        if not isinstance(body, (bytes, str)):
+            body = json.dumps(body)
+        if not isinstance(body, bytes):
+            body = body.encode("utf-8")
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.schedule = list(schedule or [])
+        self.retry_after = retry_after
+        self.reset_rate = reset_rate
+        self.bytes_per_second = bytes_per_second
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """Serve requests according to the route's profile."""
+
+    protocol_version = "HTTP/1.1"
+
+    def _serve(self):
+        """Serve any method."""
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        path = self.path.split("?", 1)[0]
+        stub = self.server.stub
+        profile, status, delay = stub.plan(path)
+        if profile is None:
+            self._respond(404, b'{"error": "no such route"}', {})
+            return
+        if delay:
+            time.sleep(delay)
+        if status == 0:
+            # Reset: close with SO_LINGER 0 so the peer sees RST.
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                                       struct.pack("ii", 1, 0))
+            self.close_connection = True
+            return
+        headers = dict(profile.headers)
+        if status == profile.status:
+            body = profile.body
+        else:
+            body = json.dumps({"error": "injected",
+                               "status": status}).encode("utf-8")
+            if profile.retry_after is not None:
+                headers["Retry-After"] = str(profile.retry_after)
+        self._respond(status, body, headers, profile.bytes_per_second)
+
+    do_GET = do_PUT = do_POST = do_PATCH = do_DELETE = do_HEAD = _serve
+
+    def _respond(self, status, body, headers, rate=None):
+        """Write a response, optionally trickling the body."""
+        self.send_response(status)
+        if "Content-Type" not in headers:
+            self.send_header("Content-Type", "application/json")
+        for key, val in headers.items():
+            self.send_header(key, val)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+        if not rate:
+            self.wfile.write(body)
+            return
+        chunk = max(int(rate / 20), 1)
+        for start in range(0, len(body), chunk):
+            self.wfile.write(body[start:start + chunk])
+            self.wfile.flush()
+            time.sleep(chunk / float(rate))
+
+    def log_message(self, *args):
+        """Be quiet."""
+        pass
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """Threaded HTTP server."""
+
+    daemon_threads = True
+
+
+class StubServer(object):
+    """
+    An in-process HTTP server, on a free local port, which stands in for
+    an upstream service.  Each route follows a
+    :class:`apikit.testing.FaultProfile`, so that
+    :func:`apikit.retry_request`, :func:`apikit.raise_from_response` and
+    services built on them can be exercised against slow, flaky, or
+    failing upstreams without real ones.
+
+    Use it as a context manager, or call `start` and `stop`.
+
+    Parameters
+    ----------
+    routes: `dict`, optional
+        Map of path to :class:`apikit.testing.FaultProfile`.
+    seed: `int` or `None`, optional
+        Seed for the random faults, for reproducible runs.
+    """
+
+    def __init__(self, routes=None, seed=None):
+        """Create a stopped server."""
+        self.routes = dict(routes or {})
+        self.hits = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self._started = None
+
+    def route(self, path, profile=None, **kwargs):
+        """Add or replace the route at `path`.  Keyword arguments build a
+        :class:`apikit.testing.FaultProfile` if `profile` is not given.
+        """
+        with self._lock:
+            self.routes[path] = profile or FaultProfile(**kwargs)
+
+    def plan(self, path):
+        """Decide how to answer a request for `path`.  Returns the profile
+        (or `None` for an unknown route), the status to send (`0` to reset
+        the connection), and the delay before sending.
+        """
+        with self._lock:
+            profile = self.routes.get(path)
+            self.hits[path] = self.hits.get(path, 0) + 1
+            if profile is None:
+                return None, 404, 0
+            delay = profile.latency or 0
+            if callable(delay):
+                delay = delay(self._rng)
+            if profile.schedule:
+                return profile, profile.schedule.pop(0), delay
+            if self._rng.random() < profile.reset_rate:
+                return profile, 0, delay
+            rate = profile.error_rate
+            if callable(rate):
+                rate = rate(time.time() - self._started)
+            if self._rng.random() < rate:
+                return profile, profile.error_status, delay
+            return profile, profile.status, delay
+
+    def start(self):
+        """Start serving in a background thread."""
+        self._server = _ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+        self._server.stub = self
+        self._started = time.time()
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        kwargs={"poll_interval": 0.05})
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        """Start on entering a `with` block."""
+        return self.start()
+
+    def __exit__(self, *args):
+        """Stop on leaving a `with` block."""
+        self.stop()
+
+    @property
+    def url(self):
+        """Base URL of the running server."""
+        return "http://127.0.0.1:%d" % self._server.server_address[1]
+
+    def url_for(self, path):
+        """Full URL of `path` on the running server."""
+        return self.url + path
+
+
+class LoadReport(object):
+    """
+    Results of :func:`apikit.testing.run_load`.
+
+    Fields: `requests`, `errors` (responses with status >= 400 plus
+    exceptions), `statuses` (`dict` of status to count), `elapsed`
+    (seconds), `throughput` (requests per second), and `latencies`
+    (sorted, in seconds).
+    """
+
+    def __init__(self, latencies, statuses, errors, elapsed):
+        """Summarize a run."""
+        self.latencies = sorted(latencies)
+        self.statuses = statuses
+        self.errors = errors
+        self.elapsed = elapsed
+        self.requests = len(latencies)
+        self.throughput = self.requests / elapsed if elapsed else 0.0
+
+    def percentile(self, pct):
+        """Latency, in seconds, at percentile `pct` (0-100)."""
+        if not self.latencies:
+            return 0.0
+        idx = int(math.ceil(pct / 100.0 * len(self.latencies))) - 1
+        return self.latencies[min(max(idx, 0), len(self.latencies) - 1)]
+
+    def to_dict(self):
+        """Summary suitable for JSON, e.g. to compare apikit versions."""
+        return {"requests": self.requests,
+                "errors": self.errors,
+                "statuses": dict((str(k), v) for k, v in
+                                 self.statuses.items()),
+                "elapsed": self.elapsed,
+                "throughput": self.throughput,
+                "p50": self.percentile(50),
+                "p90": self.percentile(90),
+                "p99": self.percentile(99),
+                "max": self.latencies[-1] if self.latencies else 0.0}
+
+    def __str__(self):
+        """Human-readable summary."""
+        return ("%(requests)d requests, %(errors)d errors in "
+                "%(elapsed).2fs: %(throughput).1f req/s; "
+                "p50 %(p50).4fs p90 %(p90).4fs p99 %(p99).4fs "
+                "max %(max).4fs" % self.to_dict())
+
+
+def run_load(target, path="/", total=1000, concurrency=8, method="GET"):
+    """Drive `total` requests at a service from `concurrency` threads and
+    report throughput and latency percentiles.
+
+    Parameters
+    ----------
+    target: :class:`flask.Flask` or `str`
+        An app (usually an :class:`apikit.APIFlask`), driven in-process
+        through its test client, or the base URL of a running service.
+    path: `str`, optional
+        Path to request.  Defaults to `/`.
+    total: `int`, optional
+        Number of requests.  Defaults to `1000`.
+    concurrency: `int`, optional
+        Number of concurrent clients.  Defaults to `8`.
+    method: `str`, optional
+        HTTP method.  Defaults to `GET`.
+
+    Returns
+    -------
+    :class:`apikit.testing.LoadReport`
+    """
+    lock = threading.Lock()
+    latencies = []
+    statuses = {}
+    errors = [0]
+    remaining = [total]
+
+    def client():
+        """One client thread."""
+        if isinstance(target, str):
+            session = requests.Session()
+
+            def call():
+                """Issue one request over HTTP."""
+                return session.request(method, target + path).status_code
+        else:
+            test_client = target.test_client()
+
+            def call():
+                """Issue one request in-process."""
+                return test_client.open(path, method=method).status_code
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            start = time.time()
+            try:
+                status = call()
+            except Exception:  # pylint: disable=broad-except
+                status = None
+            took = time.time() - start
+            with lock:
+                latencies.append(took)
+                statuses[status] = statuses.get(status, 0) + 1
+                if status is None or status >= 400:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.time()
+    for thd in threads:
+        thd.start()
+    for thd in threads:
+        thd.join()
+    return LoadReport(latencies, statuses, errors[0], time.time() - start)
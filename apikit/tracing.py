@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+"""Lightweight distributed tracing with W3C trace context"""
+import json
+import os
+import random
+import re
+import threading
+import time
+from flask import g, request
+from apikit.fastpath import RENDERING, render_safe
+
+_TRACEPARENT = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-"
+                          r"([0-9a-f]{2})$")
+
+# The span being served by this thread, if any.
+_local = threading.local()
+
+
+def _hex(bits):
+    """Random non-zero lowercase hex id of `bits` bits."""
+    value = 0
+    while not value:
+        value = random.getrandbits(bits)
+    return "%0*x" % (bits // 4, value)
+
+
+def current_span():
+    """The server span of the request this thread is serving, or `None`."""
+    return getattr(_local, "span", None)
+
+
+def propagate(func):
+    """Wrap `func` so that, when called on another thread (for instance
+    by a thread pool), upstream requests it makes belong to the span
+    current here and now.
+    """
+    span = getattr(_local, "span", None)
+    if span is None:
+        return func
+
+    def wrapper(*args, **kwargs):
+        """Call `func` with the captured span current."""
+        saved = getattr(_local, "span", None)
+        _local.span = span
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.span = saved
+    return wrapper
+
+
+def start_client_span(method, url, attempt):
+    """Start a client span for one attempt of an upstream request, as a
+    child of the current span.  Returns `None` (at no cost) if this thread
+    is not serving a traced request.
+    """
+    parent = getattr(_local, "span", None)
+    if parent is None:
+        return None
+    return Span(parent.tracer, "%s %s" % (method.upper(), url), "client",
+                trace_id=parent.trace_id, parent_id=parent.span_id,
+                sampled=parent.sampled,
+                attributes={"http.method": method.upper(),
+                            "http.url": url,
+                            "attempt": attempt})
+
+
+class Span(object):
+    """
+    One timed operation in a trace: a server span for an incoming request,
+    or a client span for one upstream attempt.
+
+    Unsampled spans still carry ids, so that trace context propagates, but
+    are never exported.
+    """
+
+    __slots__ = ("tracer", "name", "kind", "trace_id", "span_id",
+                 "parent_id", "sampled", "start", "end", "attributes",
+                 "events")
+
+    def __init__(self, tracer, name, kind, trace_id=None, parent_id=None,
+                 sampled=True, attributes=None):
+        """Start a span now."""
+        self.tracer = tracer
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id or _hex(128)
+        self.span_id = _hex(64)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.start = time.time()
+        self.end = None
+        self.attributes = attributes or {}
+        self.events = []
+
+    def add_event(self, name, **attributes):
+        """Record a point-in-time event, such as a retry backoff."""
+        if self.sampled:
+            self.events.append({"name": name, "time": time.time(),
+                                "attributes": attributes})
+
+    def finish(self, status=None, error=None):
+        """End the span and hand it to the tracer for export."""
+        if self.end is not None:
+            return
+        self.end = time.time()
+        if not self.sampled:
+            return
+        if status is not None:
+            self.attributes["http.status_code"] = status
+        if error is not None:
+            self.attributes["error"] = error
+        self.tracer.export(self)
+
+    def traceparent(self):
+        """W3C `traceparent` header value naming this span as parent."""
+        return "00-%s-%s-%s" % (self.trace_id, self.span_id,
+                                "01" if self.sampled else "00")
+
+    def to_dict(self):
+        """Exportable representation."""
+        return {"trace_id": self.trace_id,
+                "span_id": self.span_id,
+                "parent_id": self.parent_id,
+                "name": self.name,
+                "kind": self.kind,
+                "start": self.start,
+                "end": self.end,
+                "duration": self.end - self.start,
+                "attributes": self.attributes,
+                "events": self.events}
+
+
+class JSONLinesExporter(object):
+    """
+    Span exporter which appends one JSON object per span to a file.
+
+    Any object with an `export(spans)` method, taking a list of `dict`, may
+    be used as an exporter instead.
+
+    Parameters
+    ----------
+    path: `str`
+        File to append to.
+    """
+
+    def __init__(self, path):
+        """Create an exporter for `path`."""
+        self.path = path
+
+    def export(self, spans):
+        """Append `spans` to the file."""
+        with open(self.path, "a") as out:
+            out.write("".join(json.dumps(span, sort_keys=True) + "\n"
+                              for span in spans))
+
+
+class Tracer(object):
+    """
+    Flask middleware which traces each request with a server span, and
+    each :func:`apikit.retry_request` attempt made while serving it with
+    a client span; retry backoffs are recorded as events on the attempt
+    that failed.  Outgoing requests carry a W3C `traceparent` header, and
+    an incoming one makes the server span part of the caller's trace.
+
+    Sampling is decided once, at the head of the trace: a request with a
+    `traceparent` follows its caller's decision, and any other is sampled
+    with probability `sample_rate`.  Unsampled requests propagate context
+    but record nothing.
+
+    Finished spans are queued, and a background thread exports them in
+    batches of up to `batch_size`, or every `flush_interval` seconds.  If
+    more than `max_queue` spans are waiting, new ones are dropped and
+    counted in `dropped`.
+
+    Parameters
+    ----------
+    app: :class:`apikit.APIFlask` or `None`
+        Application to attach to.  If `None`, call `init_app` later.
+
+    exporter: object
+        Receives batches through `export(spans)`; for example a
+        :class:`apikit.tracing.JSONLinesExporter`.
+
+    sample_rate: `float`, optional
+        Fraction of new traces to record.  Defaults to `1.0`.
+
+    batch_size: `int`, optional
+        Most spans per export.  Defaults to `512`.
+
+    flush_interval: `float`, optional
+        Longest time a span waits before export.  Defaults to `1.0`.
+
+    max_queue: `int`, optional
+        Most spans waiting for export.  Defaults to `8192`.
+    """
+
+    def __init__(self, app=None, exporter=None, sample_rate=1.0,
+                 batch_size=512, flush_interval=1.0, max_queue=8192):
+        """Create a new tracer."""
+        if exporter is None:
+            raise ValueError("'exporter' is required")
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError("'sample_rate' must be between 0 and 1")
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.dropped = 0
+        self._queue = []
+        self._exporting = False
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Attach the tracer to `app`."""
+        app.before_request(self._before)
+        app.after_request(self._after)
+        app.teardown_request(self._teardown)
+        app.config["TRACER"] = self
+
+    @render_safe
+    def _before(self):
+        """Start the server span, unless the request is only rendering a
+        fast-path response.
+        """
+        if request.environ.get(RENDERING):
+            return
+        parent_id = None
+        trace_id = None
+        match = _TRACEPARENT.match(
+            request.headers.get("traceparent", "").strip().lower())
+        if match is not None and match.group(1) != "ff":
+            trace_id = match.group(2)
+            parent_id = match.group(3)
+            sampled = bool(int(match.group(4), 16) & 1)
+        else:
+            sampled = random.random() < self.sample_rate
+        rule = request.url_rule
+        span = Span(self, "%s %s" % (request.method,
+                                     rule.rule if rule is not None
+                                     else request.path),
+                    "server", trace_id=trace_id, parent_id=parent_id,
+                    sampled=sampled,
+                    attributes={"http.method": request.method,
+                                "http.path": request.path})
+        g.apikit_span = span
+        _local.span = span
+
+    def _after(self, response):
+        """Record the response status on the server span."""
+        span = g.get("apikit_span")
+        if span is not None:
+            span.attributes["http.status_code"] = response.status_code
+        return response
+
+    def _teardown(self, exc=None):
+        """Finish the server span."""
+        span = g.get("apikit_span")
+        _local.span = None
+        if span is not None:
+            span.finish(error=str(exc) if exc is not None else None)
+
+    def export(self, span):
+        """Queue a finished span for export."""
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                self.dropped += 1
+                return
+            self._queue.append(span.to_dict())
+            if self._thread is None or self._pid != os.getpid():
+                # First span, or first in a forked worker: the parent's
+                #  thread did not survive the fork.
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run,
+                                                name="apikit-tracing")
+                self._thread.daemon = True
+                self._thread.start()
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify_all()
+
+    def flush(self, timeout=5.0):
+        """Wait, for at most `timeout` seconds, until every queued span
+        has been exported.
+        """
+        deadline = time.time() + timeout
+        with self._cond:
+            self._cond.notify_all()
+            while ((self._queue or self._exporting) and
+                   self._thread is not None and self._thread.is_alive() and
+                   time.time() < deadline):
+                self._cond.wait(0.05)
+
+    def _run(self):
+        """Export thread."""
+        while True:
+            with self._cond:
+                if len(self._queue) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                batch = self._queue[:self.batch_size]
+                del self._queue[:self.batch_size]
+                self._exporting = bool(batch)
+            try:
+                if batch:
+                    self.exporter.export(batch)
+            except Exception:  # pylint: disable=broad-except
+                # Tracing must never take the service down with it.
+                pass
+            finally:
+                with self._cond:
+                    self._exporting = False
+                    self._cond.notify_all()
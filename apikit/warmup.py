@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+"""Upstream connection pooling, DNS caching, and start-up warmup"""
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from urllib3.util.connection import allowed_gai_family, create_connection
+try:
+    from http.cookiejar import DefaultCookiePolicy
+    from urllib.parse import urlsplit
+except ImportError:
+    from cookielib import DefaultCookiePolicy
+    from urlparse import urlsplit
+
+
+class DNSCache(object):
+    """
+    An in-process cache of `socket.getaddrinfo` results, so that upstream
+    connections do not wait on the resolver for every request.  Failed
+    lookups are not cached.
+
+    Parameters
+    ----------
+    ttl: `float`, optional
+        Seconds to keep a result.  Defaults to `60`.
+    max_entries: `int`, optional
+        Most results to keep.  Defaults to `1024`.
+    """
+
+    def __init__(self, ttl=60, max_entries=1024):
+        """Create an empty cache."""
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, host, port, family=0):
+        """Addresses for `host` and `port`, as from `socket.getaddrinfo`
+        for TCP in address `family` (by default, any).
+        """
+        key = (host, port, family)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+        addrs = socket.getaddrinfo(host, port, family, socket.SOCK_STREAM)
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries = dict((k, v) for k, v in
+                                     self._entries.items() if v[1] > now)
+                if len(self._entries) >= self.max_entries:
+                    self._entries.clear()
+            self._entries[key] = (addrs, now + self.ttl)
+        return addrs
+
+    def invalidate(self, host=None, port=None):
+        """Forget `host` (only on `port`, if given), or every host if
+        `None`.
+        """
+        with self._lock:
+            if host is None:
+                self._entries.clear()
+                return
+            for key in [k for k in self._entries if k[0] == host and
+                        port in (None, k[1])]:
+                del self._entries[key]
+
+
+# Shared by every upstream connection in this process.
+dns_cache = DNSCache()
+
+
+def _new_conn(conn):
+    """Open a socket for a urllib3 connection, resolving through
+    `dns_cache` (in the address families urllib3 allows) and connecting
+    with urllib3's own `create_connection`, so that failures raise what
+    urllib3 would: :class:`urllib3.exceptions.ConnectTimeoutError` for a
+    timeout, and :class:`urllib3.exceptions.NewConnectionError` otherwise.
+    """
+    try:
+        addrs = dns_cache.resolve(conn.host, conn.port, allowed_gai_family())
+    except socket.gaierror as exc:
+        raise NewConnectionError(conn, "Failed to resolve '%s': %s" %
+                                 (conn.host, exc))
+    err = None
+    for _, _, _, _, addr in addrs:
+        try:
+            # An address literal: create_connection will not look it up.
+            return create_connection(addr[:2], conn.timeout,
+                                     source_address=conn.source_address,
+                                     socket_options=conn.socket_options)
+        except (OSError, socket.error) as exc:
+            err = exc
+    # The host may have moved: look it up afresh next time.
+    dns_cache.invalidate(conn.host, conn.port)
+    if isinstance(err, socket.timeout):
+        raise ConnectTimeoutError(conn, "Connection to %s timed out. "
+                                  "(connect timeout=%s)" %
+                                  (conn.host, conn.timeout))
+    raise NewConnectionError(conn, "Failed to establish a new connection: "
+                             "%s" % err)
+
+
+class _CachedHTTPConnection(HTTPConnection):
+    """HTTP connection resolving through the DNS cache."""
+
+    _new_conn = _new_conn
+
+
+class _CachedHTTPSConnection(HTTPSConnection):
+    """HTTPS connection resolving through the DNS cache.  Certificates are
+    still verified against the host name.
+    """
+
+    _new_conn = _new_conn
+
+
+class _CachedHTTPConnectionPool(HTTPConnectionPool):
+    """Pool of DNS-cached HTTP connections."""
+
+    ConnectionCls = _CachedHTTPConnection
+
+
+class _CachedHTTPSConnectionPool(HTTPSConnectionPool):
+    """Pool of DNS-cached HTTPS connections."""
+
+    ConnectionCls = _CachedHTTPSConnection
+
+
+class _CachedDNSAdapter(HTTPAdapter):
+    """Transport adapter whose pools resolve through the DNS cache."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        """Create the pool manager with DNS-cached pools."""
+        HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CachedHTTPConnectionPool,
+            "https": _CachedHTTPSConnectionPool}
+
+
+_session = {"pid": None, "session": None}
+_session_lock = threading.Lock()
+
+
+def upstream_session():
+    """The :class:`requests.Session` which :func:`apikit.retry_request`
+    sends through, created once per process so that keep-alive
+    connections are never shared across `fork()`.  It resolves through
+    `dns_cache`, and keeps no cookies between requests.
+    """
+    with _session_lock:
+        if _session["pid"] != os.getpid():
+            session = requests.Session()
+            session.cookies.set_policy(DefaultCookiePolicy(
+                allowed_domains=[]))
+            adapter = _CachedDNSAdapter(pool_connections=32,
+                                        pool_maxsize=32)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session["session"] = session
+            _session["pid"] = os.getpid()
+        return _session["session"]
+
+
+class Warmup(object):
+    """
+    Resolves and connects to an app's declared upstreams, so that the
+    first requests after start-up do not pay for DNS, TCP, and TLS set-up.
+
+    For each upstream URL, the host is resolved into `dns_cache` and
+    `connections` concurrent `HEAD` requests open keep-alive connections
+    in the pool used by :func:`apikit.retry_request`.  Any HTTP response
+    counts as success; the status does not matter.
+
+    Parameters
+    ----------
+    upstreams: list of `str`
+        Upstream URLs.
+    connections: `int`, optional
+        Connections to open to each upstream.  Defaults to `1`.
+    timeout: `float`, optional
+        Timeout for each request.  Defaults to `10`.
+
+    Attributes
+    ----------
+    ready: :class:`threading.Event`
+        Set once warmup has finished, successfully or not.
+    elapsed: `float` or `None`
+        Seconds warmup took, once finished.
+    results: `dict`
+        For each upstream: `ok`, `elapsed`, and `error` (or `None`).
+    """
+
+    def __init__(self, upstreams, connections=1, timeout=10):
+        """Create a warmup which has not started."""
+        self.upstreams = list(upstreams)
+        self.connections = connections
+        self.timeout = timeout
+        self.ready = threading.Event()
+        self.elapsed = None
+        self.results = {}
+
+    def start(self, logger=None):
+        """Warm up in a background thread, reporting to `logger` when
+        done.
+        """
+        thd = threading.Thread(target=self.run, args=(logger,),
+                               name="apikit-warmup")
+        thd.daemon = True
+        thd.start()
+        return self
+
+    def run(self, logger=None):
+        """Warm up every upstream, concurrently, then mark ready."""
+        started = time.time()
+        try:
+            if self.upstreams:
+                pool = ThreadPoolExecutor(
+                    max_workers=min(len(self.upstreams), 32))
+                try:
+                    results = list(pool.map(self._warm, self.upstreams))
+                finally:
+                    pool.shutdown()
+                self.results = dict(zip(self.upstreams, results))
+        finally:
+            self.elapsed = time.time() - started
+            self.ready.set()
+        if logger is not None:
+            logger.info("Upstream warmup complete", elapsed=self.elapsed,
+                        upstreams=self.results)
+
+    def _warm(self, url):
+        """Resolve and connect to one upstream."""
+        started = time.time()
+        error = None
+        try:
+            parts = urlsplit(url)
+            dns_cache.resolve(parts.hostname, parts.port or
+                              (443 if parts.scheme == "https" else 80),
+                              allowed_gai_family())
+            session = upstream_session()
+            if self.connections > 1:
+                with ThreadPoolExecutor(max_workers=self.connections) as pool:
+                    for resp in pool.map(
+                            lambda _: session.head(url, timeout=self.timeout),
+                            range(self.connections)):
+                        resp.close()
+            else:
+                session.head(url, timeout=self.timeout).close()
+        except Exception as exc:  # pylint: disable=broad-except
+            error = str(exc)
+        return {"ok": error is None, "elapsed": time.time() - started,
+                "error": error}
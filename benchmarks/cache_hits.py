@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""Compare cache-hit latency of `apikit.MemoryCache` and
+`apikit.SharedCache`, both directly and through `apikit.retry_request`.
+
+    python benchmarks/cache_hits.py --iterations 20000 --size 4096
+"""
+import argparse
+import os
+import tempfile
+import threading
+import timeit
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import apikit
+
+
+def _serve(body):
+    """Serve `body` on a free port; returns the URL."""
+
+    class Handler(BaseHTTPRequestHandler):
+        """Serve the body."""
+
+        def do_GET(self):
+            """Send the body."""
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            """Be quiet."""
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thd = threading.Thread(target=server.serve_forever)
+    thd.daemon = True
+    thd.start()
+    return "http://127.0.0.1:%d/" % server.server_address[1]
+
+
+def _report(label, seconds, iterations):
+    """Print mean latency."""
+    print("%-32s %10.2f us/hit" % (label, 1e6 * seconds / iterations))
+
+
+def main():
+    """Run the comparison."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--size", type=int, default=4096,
+                        help="Size of cached value in bytes")
+    args = parser.parse_args()
+    value = b"x" * args.size
+    caches = [("MemoryCache", apikit.MemoryCache()),
+              ("SharedCache", apikit.SharedCache(
+                  os.path.join(tempfile.mkdtemp(), "cache.db")))]
+    for label, cache in caches:
+        cache.set("key", value)
+        _report(label + ".get", timeit.timeit(lambda: cache.get("key"),
+                                              number=args.iterations),
+                args.iterations)
+    url = _serve(value)
+    rounds = max(args.iterations // 20, 1)
+    _report("retry_request (no cache)",
+            timeit.timeit(lambda: apikit.retry_request("GET", url),
+                          number=rounds), rounds)
+    for label, cache in caches:
+        apikit.retry_request("GET", url, cache=cache)
+        _report("retry_request + " + label,
+                timeit.timeit(lambda: apikit.retry_request("GET", url,
+                                                           cache=cache),
+                              number=args.iterations), args.iterations)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""Compare error-response throughput of the default `apikit.BackendError`
+handler against the common `jsonify(error.to_dict())` handler, and the
+memory held by raised errors.
+
+    python benchmarks/error_responses.py --iterations 20000 --size 65536
+"""
+import argparse
+import timeit
+import tracemalloc
+from flask import jsonify
+import apikit
+
+
+class _DictError(Exception):
+    """BackendError as it was before `__slots__`, for comparison."""
+
+    def __init__(self, reason, status_code=400, content=None):
+        Exception.__init__(self)
+        self.reason = reason
+        self.status_code = status_code
+        self.content = content
+
+
+def _app(content, handler=None):
+    """App with a route that always fails."""
+    flapp = apikit.APIFlask("bench", "1.0", "http://example.repo", "Bench")
+    if handler is not None:
+        flapp.register_error_handler(apikit.BackendError, handler)
+
+    @flapp.route("/fail")
+    def fail():
+        """Raise a BackendError."""
+        raise apikit.BackendError("upstream failed", 502, content)
+
+    return flapp
+
+
+def _jsonify_handler(error):
+    """The handler services used to write for themselves."""
+    resp = jsonify(error.to_dict())
+    resp.status_code = error.status_code
+    return resp
+
+
+def _held(factory, count):
+    """Bytes held by `count` errors made by `factory`."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    errors = [factory() for _ in range(count)]
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del errors
+    return held
+
+
+def main():
+    """Run the comparison."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--size", type=int, default=65536,
+                        help="Size of the error content in bytes")
+    args = parser.parse_args()
+    content = "x" * args.size
+    for label, handler in [("default handler", None),
+                           ("jsonify(to_dict())", _jsonify_handler)]:
+        client = _app(content, handler).test_client()
+        seconds = timeit.timeit(lambda: client.get("/fail"),
+                                number=args.iterations)
+        size = len(client.get("/fail").data)
+        print("%-24s %10.0f responses/s %8d bytes/response" %
+              (label, args.iterations / seconds, size))
+    count = 100000
+    for label, factory in [
+            ("BackendError", lambda: apikit.BackendError("r", 502, "c")),
+            ("dict-based error", lambda: _DictError("r", 502, "c"))]:
+        print("%-24s %10.1f bytes/instance" %
+              (label, _held(factory, count) / float(count)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""Measure per-request overhead of `apikit.FastPathDispatcher`: metadata
+requests answered from memory versus through Flask, and ordinary requests
+passed through it versus sent straight to Flask.
+
+    python benchmarks/fast_path.py --iterations 50000
+"""
+import argparse
+import timeit
+import apikit
+
+
+def _environ(path):
+    """Minimal WSGI environ for a GET of `path`."""
+    return {"REQUEST_METHOD": "GET", "PATH_INFO": path, "SCRIPT_NAME": "",
+            "QUERY_STRING": "", "SERVER_NAME": "localhost",
+            "SERVER_PORT": "80", "SERVER_PROTOCOL": "HTTP/1.1",
+            "wsgi.url_scheme": "http", "wsgi.input": None,
+            "wsgi.errors": None, "wsgi.multithread": True,
+            "wsgi.multiprocess": False, "wsgi.run_once": False}
+
+
+def _start_response(status, headers, exc_info=None):
+    """Discard the response start."""
+    pass
+
+
+def _timer(wsgi_app, path):
+    """Callable issuing one request to `wsgi_app` and reading the body."""
+    def call():
+        """One request."""
+        body = wsgi_app(_environ(path), _start_response)
+        b"".join(body)
+        if hasattr(body, "close"):
+            body.close()
+    return call
+
+
+def main():
+    """Run the comparison."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=50000)
+    args = parser.parse_args()
+    flapp = apikit.APIFlask("bench", "1.0", "http://example.repo", "Bench")
+
+    @flapp.route("/hello")
+    def hello():
+        """Ordinary view."""
+        return "hi"
+
+    fast = flapp.fast_path
+    flask_only = fast.wsgi_app
+    for label, wsgi_app, path in [
+            ("/metadata via fast path", fast, "/metadata"),
+            ("/metadata via Flask", flask_only, "/metadata"),
+            ("/hello via fast path", fast, "/hello"),
+            ("/hello via Flask", flask_only, "/hello")]:
+        call = _timer(wsgi_app, path)
+        call()
+        seconds = timeit.timeit(call, number=args.iterations)
+        print("%-26s %8.2f us/request" %
+              (label, 1e6 * seconds / args.iterations))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""Compare peak memory of `resp.json()` and `apikit.iter_json_records` on a
+large upstream JSON array.
+
+Each parser runs in a fresh child process, so that its peak RSS is not
+polluted by the other.
+
+    python benchmarks/json_records.py --records 300000
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+
+def _peak_rss_mb():
+    """Peak RSS of this process in MB (Linux reports kB)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _make_body(count):
+    """A JSON array of `count` smallish records."""
+    return json.dumps([{"id": n, "name": "record-%d" % n,
+                        "tags": ["alpha", "beta", "gamma"],
+                        "value": n * 0.5} for n in range(count)]).encode()
+
+
+def _serve(body):
+    """Serve `body` on a free port; returns the URL."""
+
+    class Handler(BaseHTTPRequestHandler):
+        """Serve the body."""
+
+        def do_GET(self):
+            """Send the body."""
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            """Be quiet."""
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thd = threading.Thread(target=server.serve_forever)
+    thd.daemon = True
+    thd.start()
+    return "http://127.0.0.1:%d/" % server.server_address[1]
+
+
+def _child(mode, url):
+    """Parse the body one way and report."""
+    import apikit
+    baseline = _peak_rss_mb()
+    start = time.time()
+    count = 0
+    if mode == "json":
+        resp = apikit.retry_request("GET", url)
+        for _ in resp.json():
+            count += 1
+    else:
+        stream = apikit.retry_request("GET", url, stream=True)
+        for _ in apikit.iter_json_records(stream):
+            count += 1
+    print(json.dumps({"mode": mode, "records": count,
+                      "seconds": time.time() - start,
+                      "peak_rss_mb": _peak_rss_mb(),
+                      "delta_rss_mb": _peak_rss_mb() - baseline}))
+
+
+def main():
+    """Run the comparison."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=300000)
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "URL"),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        _child(*args.child)
+        return
+    body = _make_body(args.records)
+    url = _serve(body)
+    print("Body: %d records, %.1f MB" % (args.records, len(body) / 1e6))
+    print("%-8s %10s %10s %14s %14s" % ("mode", "records", "seconds",
+                                        "peak RSS (MB)", "growth (MB)"))
+    for mode in ["json", "stream"]:
+        out = subprocess.check_output([sys.executable, __file__,
+                                       "--child", mode, url])
+        res = json.loads(out.decode("utf-8"))
+        print("%-8s %10d %10.2f %14.1f %14.1f" % (res["mode"],
+                                                  res["records"],
+                                                  res["seconds"],
+                                                  res["peak_rss_mb"],
+                                                  res["delta_rss_mb"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -19,7 +19,12 @@ def main():
         """The main route."""
         return "Hello, World!"
 
-    app.run()
+    # `app.run()` starts the single-process development server; use it
+    #  only while developing.
+    if app.debug:
+        app.run()
+    else:
+        app.serve()
 
 
 if __name__ == "__main__":
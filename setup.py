@@ -45,11 +45,21 @@ setup(
     install_requires=[
         'Flask==0.11.1',
         'future==0.16.0',
-        'requests>=2.13.0,<3.0.0',
+        # concurrent.futures backport for Python 2.7.
+        'futures>=3.0.5; python_version < "3"',
+        # From 2.16, requests uses urllib3 as a separate package, which
+        # apikit.warmup imports directly.
+        'requests>=2.16.0,<3.0.0',
         'structlog>=16.1.0',
+        'urllib3>=1.21.1',
         # Flask <0.12.4 is incompatible with werkzeug>1.0 but doesn't
         # constrain its version.  The mix produces errors about `is_xhr`.
         'werkzeug<1.0',
     ],
     tests_require=['pytest'],
+    entry_points={
+        'console_scripts': [
+            'apikit = apikit.server:main',
+        ],
+    },
 )
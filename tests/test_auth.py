@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+"""Test cached credential verification.
+"""
+import base64
+import apikit
+import pytest
+from apikit.testing import StubServer
+from werkzeug.security import generate_password_hash
+
+
+def _auth_header(user, password):
+    """Build an HTTP Basic Authorization header."""
+    token = base64.b64encode(("%s:%s" % (user, password)).encode("utf-8"))
+    return {"Authorization": "Basic " + token.decode("ascii")}
+
+
+def test_basic_auth():
+    """Test basic auth against a password hash, with caching."""
+    flapp = apikit.APIFlask("bob", "2.0", "http://example.repo", "BobApp",
+                            auth={"type": "basic",
+                                  "data": {"username": "bob",
+                                           "password_hash":
+                                           generate_password_hash("pw")}})
+    calls = []
+
+    def verify(atype, data, credential):
+        """Count verifications, then check the hash."""
+        calls.append(credential)
+        # pylint: disable=protected-access
+        return apikit.auth._verify_basic(data, credential)
+
+    auth = apikit.Authenticator(flapp, verify=verify)
+
+    @flapp.route("/secret")
+    @apikit.auth_required
+    def secret():
+        """Protected view."""
+        return "sekrit"
+
+    client = flapp.test_client()
+    rv = client.get("/secret")
+    assert rv.status_code == 401
+    assert "WWW-Authenticate" in rv.headers
+    assert calls == []
+    for _ in range(3):
+        rv = client.get("/secret", headers=_auth_header("bob", "pw"))
+        assert rv.status_code == 200
+    assert calls == [("bob", "pw")]
+    # Failures are cached too.
+    for _ in range(3):
+        rv = client.get("/secret", headers=_auth_header("bob", "nope"))
+        assert rv.status_code == 401
+    assert len(calls) == 2
+    auth.invalidate(("bob", "pw"))
+    client.get("/secret", headers=_auth_header("bob", "pw"))
+    assert len(calls) == 3
+    auth.invalidate()
+    client.get("/secret", headers=_auth_header("bob", "nope"))
+    assert len(calls) == 4
+
+
+def test_bitly_proxy_auth():
+    """Test token auth with a pluggable verifier and no auth at all."""
+    flapp = apikit.APIFlask("bob", "2.0", "http://example.repo", "BobApp",
+                            auth={"type": "bitly-proxy", "data": {}})
+    apikit.Authenticator(flapp, verify=lambda t, d, c: c == "good")
+
+    @flapp.route("/secret")
+    @apikit.auth_required
+    def secret():
+        """Protected view."""
+        return "sekrit"
+
+    client = flapp.test_client()
+    assert client.get("/secret").status_code == 401
+    assert client.get("/secret", headers={
+        "X-Forwarded-Access-Token": "good"}).status_code == 200
+    assert client.get("/secret", headers={
+        "X-Forwarded-Access-Token": "bad"}).status_code == 401
+    assert client.get("/secret", headers=_auth_header(
+        "bob", "good")).status_code == 200
+    open_app = apikit.APIFlask("bob", "2.0", "http://example.repo", "BobApp")
+
+    @open_app.route("/open")
+    @apikit.auth_required
+    def unprotected():
+        """View of an app without auth."""
+        return "hi"
+
+    assert open_app.test_client().get("/open").status_code == 200
+
+
+def test_github_auth():
+    """Test bitly-proxy verification against a stub GitHub API."""
+    with StubServer() as stub:
+        stub.route("/user", body={"login": "Bob"})
+        stub.route("/user/memberships/orgs/lsst", body={"state": "active"})
+        stub.route("/user/memberships/orgs/pending",
+                   body={"state": "pending"})
+        api = stub.url
+        for data, status in [({"organization": "lsst"}, 200),
+                             ({"organization": "pending"}, 401),
+                             ({"organization": "other"}, 401),
+                             ({"users": ["bob"]}, 200),
+                             ({"users": ["alice"]}, 401),
+                             ({"users": ["alice"], "organization": "lsst"},
+                              200)]:
+            data["api"] = api
+            flapp = apikit.APIFlask("bob", "2.0", "http://example.repo",
+                                    "BobApp", auth={"type": "bitly-proxy",
+                                                    "data": data})
+
+            @flapp.route("/secret")
+            @apikit.auth_required
+            def secret():
+                """Protected view."""
+                return "sekrit"
+
+            assert flapp.test_client().get("/secret", headers={
+                "X-Forwarded-Access-Token": "tok"}).status_code == status
+
+
+def test_github_auth_forbidden():
+    """Test that a 403 from GitHub is an error, not a bad credential."""
+    with StubServer() as stub:
+        stub.route("/user", status=403, body={"message": "rate limited"},
+                   headers={"X-RateLimit-Remaining": "0"})
+        flapp = apikit.APIFlask("bob", "2.0", "http://example.repo",
+                                "BobApp", auth={"type": "bitly-proxy",
+                                                "data": {"users": ["bob"],
+                                                         "api": stub.url}})
+
+        @flapp.route("/secret")
+        @apikit.auth_required
+        def secret():
+            """Protected view."""
+            return "sekrit"
+
+        client = flapp.test_client()
+        headers = {"X-Forwarded-Access-Token": "tok"}
+        assert client.get("/secret", headers=headers).status_code == 503
+        stub.route("/user", status=403, body={"message": "SSO required"})
+        assert client.get("/secret", headers=headers).status_code == 403
+        # Neither refusal was remembered.
+        stub.route("/user", body={"login": "Bob"})
+        assert client.get("/secret", headers=headers).status_code == 200
+
+
+def test_github_auth_unrestricted():
+    """Test that bitly-proxy auth must restrict who is let in."""
+    flapp = apikit.APIFlask("bob", "2.0", "http://example.repo", "BobApp",
+                            auth={"type": "bitly-proxy", "data": {}})
+    with pytest.raises(ValueError):
+        apikit.Authenticator(flapp)
+    with pytest.raises(ValueError):
+        apikit.add_profiler_route(flapp)
@@ -2,6 +2,8 @@
 """Test BackendError functionality.
 """
 
+import json
+import pickle
 import apikit
 import pytest
 
@@ -42,3 +44,75 @@ def test_backenderror():
     expected = "BackendError: %d %s [%s]" % (exc.status_code, exc.reason,
                                              exc.content)
     assert str(exc) == expected
+
+
+def test_backenderror_handler():
+    """Test APIFlask's default BackendError handler.
+    """
+    flapp = apikit.APIFlask("bob", "2.0", "http://example.repo", "BobApp")
+    flapp.config["ERROR_CONTENT_LIMIT"] = 10
+
+    @flapp.route("/fail")
+    def fail():
+        """Raise a BackendError."""
+        raise apikit.BackendError("upstream broke", 502, "x" * 100)
+
+    client = flapp.test_client()
+    rv = client.get("/fail", headers={"X-Request-ID": "abc123"})
+    assert rv.status_code == 502
+    assert rv.headers["X-Request-ID"] == "abc123"
+    assert json.loads(rv.data.decode("utf-8")) == {
+        "reason": "upstream broke",
+        "status_code": 502,
+        "error_content": "x" * 10 + "...",
+        "request_id": "abc123"}
+    rv = client.get("/fail")
+    assert len(json.loads(rv.data.decode("utf-8"))["request_id"]) == 32
+
+
+def test_backenderror_slots():
+    """Test BackendError stays lean and survives pickling.
+    """
+    exc = apikit.BackendError("bad horse", 666, "thoroughbred of sin")
+    # Every exception has a __dict__ attribute; it must stay empty.
+    assert not vars(exc)
+    with pytest.raises(AttributeError):
+        exc.colour = "grey"
+    assert not vars(exc)
+    with pytest.raises(apikit.BackendError) as caught:
+        raise exc
+    assert caught.value is exc
+    clone = pickle.loads(pickle.dumps(exc))
+    assert str(clone) == str(exc)
+    assert not vars(clone)
+    # A subclass may override a default, and stays slot-only.
+    exc = _NotFound("no such thing")
+    assert exc.status_code == 404
+    assert not vars(exc)
+    assert not vars(_NotFound("gone", 410))
+
+
+class _NotFound(apikit.BackendError):
+    """Subclass overriding the default status code."""
+
+    status_code = 404
+
+
+def test_backenderror_subclass():
+    """Test subclasses may override BackendError's defaults.
+    """
+    assert apikit.BackendError.status_code == 400
+    assert apikit.BackendError.content is None
+    exc = _NotFound("no such thing")
+    assert exc.status_code == 404
+    assert _NotFound("gone", 410).status_code == 410
+    assert apikit.BackendError("other").status_code == 400
+    assert pickle.loads(pickle.dumps(exc)).status_code == 404
+    flapp = apikit.APIFlask("bob", "2.0", "http://example.repo", "BobApp")
+
+    @flapp.route("/missing")
+    def missing():
+        """Raise a subclass."""
+        raise _NotFound("no such thing")
+
+    assert flapp.test_client().get("/missing").status_code == 404
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""Test in-process and shared response caches.
+"""
+import gzip
+import io
+import os
+import time
+import apikit
+import pytest
+from apikit.testing import StubServer
+
+
+def _gzip(data):
+    """Gzip `data`."""
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb") as out:
+        out.write(data)
+    return buf.getvalue()
+
+
+def _check_cache(cache):
+    """Exercise the common cache interface."""
+    assert cache.get("a") is None
+    cache.set("a", b"alpha")
+    assert cache.get("a") == b"alpha"
+    cache.set("a", b"aleph")
+    assert cache.get("a") == b"aleph"
+    cache.set("b", b"beta", ttl=0.05)
+    time.sleep(0.1)
+    assert cache.get("b") is None
+    cache.delete("a")
+    assert cache.get("a") is None
+    # Eviction keeps the total under max_bytes (100)
+    for n in range(10):
+        cache.set("k%d" % n, b"x" * 30)
+    assert cache.get("k9") == b"x" * 30
+    assert sum(cache.get("k%d" % n) is not None for n in range(10)) <= 3
+    cache.clear()
+    assert cache.get("k9") is None
+
+
+def test_memory_cache():
+    """Test MemoryCache.
+    """
+    _check_cache(apikit.MemoryCache(max_bytes=100))
+
+
+def test_shared_cache(tmpdir):
+    """Test SharedCache, including sharing with another process.
+    """
+    path = str(tmpdir.join("cache.db"))
+    cache = apikit.SharedCache(path, max_bytes=100)
+    _check_cache(cache)
+    pid = os.fork()
+    if pid == 0:
+        try:
+            apikit.SharedCache(path).set("from-child", b"hello")
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+    assert cache.get("from-child") == b"hello"
+
+
+def test_shared_cache_total(tmpdir):
+    """Test that SharedCache keeps its running total of sizes exact.
+    """
+    path = str(tmpdir.join("cache.db"))
+    cache = apikit.SharedCache(path, max_bytes=100)
+
+    def total():
+        """Running and actual totals."""
+        conn = cache._connection()
+        return (conn.execute("SELECT total FROM meta").fetchone()[0],
+                conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries"
+                             ).fetchone()[0])
+
+    cache.set("a", b"x" * 10)
+    cache.set("a", b"x" * 20)
+    cache.set("b", b"x" * 30)
+    assert total() == (50, 50)
+    cache.delete("a")
+    cache.delete("missing")
+    assert total() == (30, 30)
+    for n in range(10):
+        cache.set("k%d" % n, b"x" * 30)
+    assert total()[0] == total()[1] <= 100
+    # An existing database is counted when first opened.
+    conn = cache._connection()
+    with conn:
+        conn.execute("DELETE FROM meta")
+    apikit.SharedCache(path, max_bytes=100)
+    assert total()[0] == total()[1]
+    cache.clear()
+    assert total() == (0, 0)
+
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_retry_request_cache(shared, tmpdir):
+    """Test that retry_request answers repeated GETs from a cache.
+    """
+    body = _gzip(b'{"answer": 42}')
+    if shared:
+        cache = apikit.SharedCache(str(tmpdir.join("c.db")))
+    else:
+        cache = apikit.MemoryCache()
+    with StubServer() as stub:
+        stub.route("/", body=body, headers={"Content-Encoding": "gzip"})
+        url = stub.url_for("/")
+        first = apikit.retry_request("GET", url, payload={"q": 1},
+                                     cache=cache)
+        second = apikit.retry_request("GET", url, payload={"q": 1},
+                                      cache=cache)
+        assert second.json() == first.json() == {"answer": 42}
+        assert second.status_code == 200
+        assert second.headers["content-type"] == "application/json"
+        # The cached body is decoded, so must not claim otherwise.
+        assert "content-encoding" not in second.headers
+        assert "content-length" not in second.headers
+        apikit.retry_request("GET", url, payload={"q": 2}, cache=cache)
+        assert stub.hits["/"] == 2
+
+
+def test_retry_request_cache_auth():
+    """Test that credentials are part of the cache key without their
+    password, and that unknown auth objects bypass the cache.
+    """
+    from requests.auth import AuthBase, HTTPBasicAuth
+
+    class _Token(AuthBase):
+        def __call__(self, req):
+            req.headers["Authorization"] = "Bearer t"
+            return req
+
+    key = apikit.convenience._cache_key
+    assert key("u", None, None, HTTPBasicAuth("a", "pw")) == \
+        key("u", None, None, HTTPBasicAuth("a", "pw"))
+    assert key("u", None, None, ("a", "pw")) != \
+        key("u", None, None, ("a", "other"))
+    assert "pw" not in apikit.convenience._auth_identity(("a", "pw"))
+    assert key("u", None, None, _Token()) is None
+    cache = apikit.MemoryCache()
+    with StubServer() as stub:
+        stub.route("/", body={"answer": 42})
+        url = stub.url_for("/")
+        for _ in range(2):
+            apikit.retry_request("GET", url, auth=HTTPBasicAuth("a", "pw"),
+                                 cache=cache)
+        assert stub.hits["/"] == 1
+        for _ in range(2):
+            apikit.retry_request("GET", url, auth=_Token(), cache=cache)
+        assert stub.hits["/"] == 3
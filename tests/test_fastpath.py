@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""Test the fast path for infrastructure routes.
+"""
+import json
+import apikit
+from apikit.fastpath import render_safe
+from flask import abort, request
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+
+def test_fast_path():
+    """Test infrastructure routes bypass Flask and others do not."""
+    flapp = apikit.APIFlask("bob", "2.0", "http://example.repo", "BobApp",
+                            route=["", "/bob"])
+    hooked = []
+    flapp.before_request(render_safe(lambda: hooked.append(1)))
+
+    @flapp.route("/hello")
+    def hello():
+        """Ordinary view."""
+        return "hi"
+
+    client = flapp.test_client()
+    slow = flapp.fast_path.wsgi_app
+    for path in ["/metadata", "/bob/v1.0/metadata.json", "/healthz"]:
+        rv = client.get(path)
+        assert rv.status_code == 200
+        with flapp.test_client() as plain:
+            flapp.wsgi_app, wrapped = slow, flapp.wsgi_app
+            try:
+                expected = plain.get(path)
+            finally:
+                flapp.wsgi_app = wrapped
+        assert rv.data == expected.data
+        assert rv.headers["Content-Type"] == expected.headers["Content-Type"]
+    # The priming render and the comparison requests ran the hook; fast
+    #  path requests did not.
+    before = len(hooked)
+    assert client.get("/metadata").status_code == 200
+    assert client.head("/healthz").data == b""
+    assert len(hooked) == before
+    assert client.get("/hello").data == b"hi"
+    assert client.post("/metadata").status_code == 405
+    assert len(hooked) == before + 2
+    flapp.config["VERSION"] = "2.1"
+    rv = client.get("/metadata")
+    assert json.loads(rv.data.decode("utf-8"))["version"] == "2.0"
+    flapp.fast_path.refresh()
+    rv = client.get("/metadata")
+    assert json.loads(rv.data.decode("utf-8"))["version"] == "2.1"
+
+
+def test_fast_path_headers():
+    """Test after-request headers are served on the fast path, and that
+    it can be refreshed behind other middleware.
+    """
+    flapp = apikit.APIFlask("bob", "2.0", "http://example.repo", "BobApp")
+
+    @flapp.after_request
+    def cors(response):
+        """Add a CORS header."""
+        response.headers["Access-Control-Allow-Origin"] = "*"
+        return response
+
+    flapp.wsgi_app = ProxyFix(flapp.wsgi_app)
+    flapp.add_route_prefix("/api")
+    client = flapp.test_client()
+    for path in ["/metadata", "/api/metadata", "/healthz"]:
+        rv = client.get(path)
+        assert rv.status_code == 200
+        assert rv.headers["Access-Control-Allow-Origin"] == "*"
+    flapp.fast_path.refresh()
+    assert client.get("/api/healthz").headers[
+        "Access-Control-Allow-Origin"] == "*"
+
+
+def test_fast_path_hooks():
+    """Test routes with request hooks are left to Flask.
+    """
+    flapp = apikit.APIFlask("bob", "2.0", "http://example.repo", "BobApp")
+    apikit.SlowRequestDetector(flapp)
+
+    @flapp.before_request
+    def gate():
+        """Answer per request."""
+        if request.headers.get("X-Key") != "sesame":
+            abort(403)
+
+    client = flapp.test_client()
+    for _ in range(2):
+        assert client.get("/metadata").status_code == 403
+        assert client.get("/metadata", headers={
+            "X-Key": "sesame"}).status_code == 200
+    assert not flapp.fast_path._routes
+    flapp.before_request_funcs[None].remove(gate)
+    flapp.url_value_preprocessors[None].append(lambda *args: None)
+    flapp.fast_path.refresh()
+    assert client.get("/healthz").status_code == 200
+    assert not flapp.fast_path._routes
+    # Render-safe hooks, such as the slow request detector's, keep the
+    #  fast path.
+    del flapp.url_value_preprocessors[None][:]
+    flapp.fast_path.refresh()
+    assert client.get("/healthz").status_code == 200
+    assert "/healthz" in flapp.fast_path._routes
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""Test liveness and readiness routes.
+"""
+import json
+import threading
+import time
+import apikit
+
+
+def _wait_for(client, path, status, timeout=5):
+    """Poll `path` until it answers `status`."""
+    deadline = time.time() + timeout
+    while True:
+        rv = client.get(path)
+        if rv.status_code == status or time.time() > deadline:
+            return rv
+        time.sleep(0.02)
+
+
+def test_health_routes():
+    """Test the routes exist under every prefix."""
+    flapp = apikit.APIFlask("bob", "2.0", "http://example.repo", "BobApp",
+                            route=["/", "bob"])
+    flapp.add_route_prefix("/api")
+    client = flapp.test_client()
+    for prefix in ["", "/bob", "/api"]:
+        rv = client.get(prefix + "/healthz")
+        assert rv.status_code == 200
+        rv = client.get(prefix + "/readyz")
+        assert rv.status_code == 200
+        assert json.loads(rv.data.decode("utf-8"))["ready"]
+
+
+def test_readiness_probes():
+    """Test readiness follows cached probe results."""
+    flapp = apikit.APIFlask("bob", "2.0", "http://example.repo", "BobApp")
+    healthy = threading.Event()
+    healthy.set()
+    calls = []
+
+    def probe():
+        """Flaky dependency."""
+        calls.append(time.time())
+        if not healthy.is_set():
+            raise RuntimeError("down")
+
+    hang = threading.Event()
+    flapp.add_dependency("db", probe, interval=0.05, failure_threshold=2)
+    flapp.add_dependency("cache", hang.wait, interval=0.05, timeout=0.05,
+                         critical=False)
+    # Nothing runs until the first readiness request, so that a pre-fork
+    #  master starts no threads.
+    time.sleep(0.1)
+    assert not calls
+    assert flapp.config["HEALTH"]._thread is None
+    client = flapp.test_client()
+    rv = _wait_for(client, "/readyz", 200)
+    assert rv.status_code == 200
+    # Probes run on their own schedule, not per request.
+    before = len(calls)
+    for _ in range(50):
+        client.get("/readyz")
+    assert len(calls) - before < 10
+    healthy.clear()
+    rv = _wait_for(client, "/readyz", 503)
+    assert rv.status_code == 503
+    state = json.loads(rv.data.decode("utf-8"))
+    assert not state["ready"]
+    assert state["checks"]["db"]["error"] == "down"
+    assert state["checks"]["db"]["failures"] >= 2
+    assert "timed out" in state["checks"]["cache"]["error"]
+    assert client.get("/healthz").status_code == 200
+    healthy.set()
+    assert _wait_for(client, "/readyz", 200).status_code == 200
+    hang.set()
+
+
+def test_hung_probe():
+    """Test that a hung non-critical probe neither runs twice nor holds up
+    a critical one.
+    """
+    flapp = apikit.APIFlask("bob", "2.0", "http://example.repo", "BobApp")
+    hang = threading.Event()
+    hung = []
+    checked = []
+
+    def stuck():
+        """Dependency which never answers."""
+        hung.append(time.time())
+        hang.wait()
+
+    flapp.add_dependency("slow", stuck, interval=0.02, timeout=0.02,
+                         critical=False)
+    flapp.add_dependency("db", lambda: checked.append(time.time()),
+                         interval=0.02, timeout=0.5, failure_threshold=1)
+    client = flapp.test_client()
+    try:
+        assert _wait_for(client, "/readyz", 200).status_code == 200
+        deadline = time.time() + 0.5
+        while time.time() < deadline:
+            assert client.get("/readyz").status_code == 200
+            time.sleep(0.01)
+        state = json.loads(client.get("/readyz").data.decode("utf-8"))
+        assert state["checks"]["slow"]["failures"] > 1
+        assert len(hung) == 1
+        assert len(checked) > 5
+    finally:
+        hang.set()
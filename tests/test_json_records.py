@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""Test incremental JSON record parsing.
+"""
+import json
+import apikit
+import pytest
+
+
+def _chunked(text, size):
+    """Split text into byte chunks of `size`."""
+    data = text.encode("utf-8")
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def test_json_records_array():
+    """Test records from a top-level array, split at every boundary.
+    """
+    records = [1, 23456, -7.5e3, "café, [tricky]", None, True,
+               {"a": [1, 2, {"b": "]"}]}, [], {}]
+    text = " \n" + json.dumps(records, indent=1) + "\n"
+    for size in [1, 2, 3, 7, 64, 65536]:
+        parsed = list(apikit.iter_json_records(_chunked(text, size)))
+        assert parsed == records
+    assert list(apikit.iter_json_records([b"[]"])) == []
+    assert list(apikit.iter_json_records([b""])) == []
+    assert list(apikit.iter_json_records([b"[12", b"34]"])) == [1234]
+
+
+def test_json_records_lines():
+    """Test records from JSON lines.
+    """
+    records = [{"n": n, "s": "x" * n} for n in range(50)]
+    text = "\n".join(json.dumps(r) for r in records) + "\n\n"
+    for size in [1, 5, 100]:
+        parsed = list(apikit.iter_json_records(_chunked(text, size)))
+        assert parsed == records
+    # No trailing newline; explicit mode
+    parsed = list(apikit.iter_json_records([b"[1]\n[2]"], lines=True))
+    assert parsed == [[1], [2]]
+
+
+def test_json_records_errors():
+    """Test that malformed bodies raise BackendError.
+    """
+    for bad in [b"[1, 2", b"[1 2]", b"[1,]", b"[1] x", b"{\"a\": 1}\n{",
+                b"[\"unterminated]"]:
+        with pytest.raises(apikit.BackendError):
+            list(apikit.iter_json_records([bad]))
+    with pytest.raises(apikit.BackendError):
+        list(apikit.iter_json_records(_chunked(json.dumps(["x" * 1000]), 10),
+                                      max_record_size=100))
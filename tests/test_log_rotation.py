@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""Test rotating, compressing file logging.
+"""
+import gzip
+import logging
+import os
+import time
+import apikit
+
+
+def _wait_for(predicate, timeout=10):
+    """Poll until `predicate()` is true."""
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.02)
+    return predicate()
+
+
+def _logger(handler):
+    """A private logger writing only to `handler`."""
+    logger = logging.getLogger("test_log_rotation.%d" % id(handler))
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    return logger
+
+
+def _segments(path):
+    """Rotated segments of `path`, compressed or not."""
+    dirname, base = os.path.split(path)
+    return [name for name in os.listdir(dirname)
+            if name.startswith(base + ".") and name != base + ".lock"]
+
+
+def _read_all(path):
+    """Every line logged, across compressed segments and the live file."""
+    dirname = os.path.dirname(path)
+    lines = []
+    for name in sorted(os.listdir(dirname)):
+        if name.endswith(".gz"):
+            with gzip.open(os.path.join(dirname, name), "rt") as seg:
+                lines.extend(seg.read().splitlines())
+    with open(path) as live:
+        lines.extend(live.read().splitlines())
+    return lines
+
+
+def test_size_rotation(tmpdir):
+    """Test size-based rotation, compression and retention.
+    """
+    path = str(tmpdir.join("app.log"))
+    handler = apikit.RotatingCompressingFileHandler(path, max_bytes=1000,
+                                                    backup_count=100)
+    logger = _logger(handler)
+    try:
+        for n in range(300):
+            logger.info("line %04d", n)
+            if n % 50 == 49:
+                # Let the background thread catch up occasionally
+                time.sleep(0.05)
+        assert _wait_for(lambda: not [f for f in _segments(path)
+                                      if not f.endswith(".gz")])
+        assert _read_all(path) == ["line %04d" % n for n in range(300)]
+        assert len(_segments(path)) > 1
+    finally:
+        handler.close()
+    handler = apikit.RotatingCompressingFileHandler(path, max_bytes=1000,
+                                                    backup_count=2)
+    logger = _logger(handler)
+    try:
+        for n in range(100):
+            logger.info("more %04d", n)
+        assert _wait_for(lambda: len(_segments(path)) <= 2)
+    finally:
+        handler.close()
+
+
+def test_time_rotation(tmpdir):
+    """Test time-based rotation.
+    """
+    path = str(tmpdir.join("app.log"))
+    handler = apikit.RotatingCompressingFileHandler(path, interval=0.1)
+    logger = _logger(handler)
+    try:
+        logger.info("first")
+        assert _wait_for(lambda: any(f.endswith(".gz")
+                                     for f in _segments(path)))
+        logger.info("second")
+        assert _read_all(path) == ["first", "second"]
+    finally:
+        handler.close()
+
+
+def test_shared_file(tmpdir):
+    """Test that processes logging to one file lose nothing to rotation.
+    """
+    path = str(tmpdir.join("app.log"))
+    pids = []
+    for worker in range(4):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                handler = apikit.RotatingCompressingFileHandler(
+                    path, max_bytes=2000, backup_count=1000)
+                logger = _logger(handler)
+                for n in range(500):
+                    logger.info("worker %d line %04d", worker, n)
+                handler.close()
+            finally:
+                os._exit(0)
+        pids.append(pid)
+    for pid in pids:
+        os.waitpid(pid, 0)
+    # Compress whatever the workers left uncompressed.
+    apikit.RotatingCompressingFileHandler(path, max_bytes=2000,
+                                          backup_count=1000).close()
+    lines = _read_all(path)
+    assert sorted(lines) == sorted("worker %d line %04d" % (worker, n)
+                                   for worker in range(4)
+                                   for n in range(500))
+    # Each rotation happened once: segments are near max_bytes, not tiny.
+    assert len(_segments(path)) < 4 * 500 * 22 // 2000 + 4
+
+
+def test_without_fcntl(tmpdir, monkeypatch):
+    """Test plain rotation where fcntl is unavailable.
+    """
+    monkeypatch.setattr(apikit.logrotate, "fcntl", None)
+    path = str(tmpdir.join("app.log"))
+    handler = apikit.RotatingCompressingFileHandler(path, max_bytes=1000,
+                                                    backup_count=100)
+    logger = _logger(handler)
+    try:
+        for n in range(100):
+            logger.info("line %04d", n)
+        assert _wait_for(lambda: any(f.endswith(".gz")
+                                     for f in _segments(path)))
+        assert _wait_for(lambda: not [f for f in _segments(path)
+                                      if not f.endswith(".gz")])
+        assert _read_all(path) == ["line %04d" % n for n in range(100)]
+    finally:
+        handler.close()
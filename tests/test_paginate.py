@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""Test the Link-header paginator.
+"""
+import threading
+import time
+import apikit
+import pytest
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+PAGES = 8
+DELAY = 0.2
+
+
+class _Listing(BaseHTTPRequestHandler):
+    """Paginated listing; /last advertises rel="last", /next does not."""
+
+    def do_GET(self):
+        """Serve one page after a delay."""
+        path, _, query = self.path.partition("?")
+        page = 1
+        for kv in query.split("&"):
+            if kv.startswith("page="):
+                page = int(kv[len("page="):])
+        time.sleep(DELAY)
+        base = "http://%s:%d%s?per_page=10&page=" % (
+            self.server.server_address + (path,))
+        links = []
+        if page < PAGES:
+            links.append('<%s%d>; rel="next"' % (base, page + 1))
+            if path == "/last":
+                links.append('<%s%d>; rel="last"' % (base, PAGES))
+        body = str(page).encode("utf-8")
+        self.send_response(200)
+        if links:
+            self.send_header("Link", ", ".join(links))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        """Be quiet."""
+        pass
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    """Threaded HTTP server."""
+
+    daemon_threads = True
+
+
+@pytest.fixture
+def upstream():
+    """Run the listing server for the duration of a test."""
+    server = _Server(("127.0.0.1", 0), _Listing)
+    thd = threading.Thread(target=server.serve_forever)
+    thd.daemon = True
+    thd.start()
+    yield "http://127.0.0.1:%d" % server.server_address[1]
+    server.shutdown()
+
+
+def test_paginate_last(upstream):
+    """Test concurrent fetching when rel="last" is known.
+    """
+    start = time.time()
+    pages = [r.text for r in apikit.paginate(upstream + "/last", window=4)]
+    elapsed = time.time() - start
+    assert pages == [str(n) for n in range(1, PAGES + 1)]
+    # Serially this would take PAGES * DELAY
+    assert elapsed < (PAGES * DELAY) * 0.75
+
+
+def test_paginate_next(upstream):
+    """Test prefetching when only rel="next" is known.
+    """
+    start = time.time()
+    pages = []
+    for resp in apikit.paginate(upstream + "/next"):
+        time.sleep(DELAY)
+        pages.append(resp.text)
+    elapsed = time.time() - start
+    assert pages == [str(n) for n in range(1, PAGES + 1)]
+    # Without prefetch, consuming would add to fetching
+    assert elapsed < (2 * PAGES * DELAY) * 0.75
+
+
+def test_paginate_early_exit(upstream):
+    """Test abandoning the generator part way.
+    """
+    for resp in apikit.paginate(upstream + "/last", window=2):
+        if resp.text == "2":
+            break
+    with pytest.raises(ValueError):
+        apikit.paginate(upstream + "/last", window=0)
+
+
+class _Collector(object):
+    """Span exporter which remembers spans."""
+
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        """Record a batch."""
+        self.spans.extend(spans)
+
+
+def test_paginate_traced(upstream):
+    """Test pages fetched on pool threads join the request's trace.
+    """
+    collector = _Collector()
+    flapp = apikit.APIFlask("bob", "2.0", "http://example.repo", "BobApp")
+    tracer = apikit.Tracer(flapp, exporter=collector)
+
+    @flapp.route("/list")
+    def listing():
+        """Fetch every page."""
+        return ",".join(r.text for r in
+                        apikit.paginate(upstream + "/last", window=4))
+
+    assert flapp.test_client().get("/list").status_code == 200
+    tracer.flush()
+    server = [s for s in collector.spans if s["kind"] == "server"]
+    clients = [s for s in collector.spans if s["kind"] == "client"]
+    assert len(server) == 1
+    assert len(clients) == PAGES
+    assert all(s["parent_id"] == server[0]["span_id"] for s in clients)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""Test sampling profiler and its route.
+"""
+import base64
+import json
+import threading
+import time
+import apikit
+import pytest
+
+
+def _spin(stop):
+    """Burn CPU until told to stop."""
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def _auth_header(user, password):
+    """Build an HTTP Basic Authorization header."""
+    token = base64.b64encode(("%s:%s" % (user, password)).encode("utf-8"))
+    return {"Authorization": "Basic " + token.decode("ascii")}
+
+
+def test_profiler():
+    """Test SamplingProfiler sees a busy thread.
+    """
+    stop = threading.Event()
+    thd = threading.Thread(target=_spin, args=(stop,))
+    thd.start()
+    try:
+        prof = apikit.SamplingProfiler(interval=0.001).run(0.2)
+    finally:
+        stop.set()
+        thd.join()
+    assert prof.samples > 0
+    assert "_spin (test_profiler.py" in prof.collapsed()
+    funcs = [x["function"] for x in prof.top(50)]
+    assert any(f.startswith("_spin ") for f in funcs)
+    with pytest.raises(ValueError):
+        apikit.SamplingProfiler(interval=0)
+
+
+def test_profiler_exclusive():
+    """Test that only one profile runs at a time.
+    """
+    thd = threading.Thread(target=apikit.SamplingProfiler().run,
+                           args=(0.3,))
+    thd.start()
+    time.sleep(0.05)
+    try:
+        with pytest.raises(apikit.BackendError) as exc:
+            apikit.SamplingProfiler().run(0.1)
+        assert exc.value.status_code == 409
+    finally:
+        thd.join()
+
+
+def test_profiler_route():
+    """Test the authenticated profiler route.
+    """
+    flapp = apikit.APIFlask("bob", "2.0", "http://example.repo", "BobApp")
+    with pytest.raises(ValueError):
+        apikit.add_profiler_route(flapp)
+    flapp = apikit.APIFlask("bob", "2.0", "http://example.repo", "BobApp",
+                            auth={"type": "basic",
+                                  "data": {"username": "bob",
+                                           "password": "pw"}})
+    apikit.add_profiler_route(flapp, ["", "bob"])
+    client = flapp.test_client()
+    rv = client.get("/admin/profile?seconds=0.05")
+    assert rv.status_code == 401
+    rv = client.get("/admin/profile?seconds=0.05",
+                    headers=_auth_header("bob", "wrong"))
+    assert rv.status_code == 401
+    rv = client.get("/bob/admin/profile?seconds=0.05&top=5",
+                    headers=_auth_header("bob", "pw"))
+    assert rv.status_code == 200
+    result = json.loads(rv.data.decode("utf-8"))
+    assert result["samples"] > 0
+    assert len(result["top"]) <= 5
+    rv = client.get("/admin/profile?seconds=0.05&format=collapsed",
+                    headers=_auth_header("bob", "pw"))
+    assert rv.mimetype == "text/plain"
+    rv = client.get("/admin/profile?seconds=3600",
+                    headers=_auth_header("bob", "pw"))
+    assert rv.status_code == 400
+    for query in ["top=-3", "top=0", "interval=0", "interval=-1",
+                  "interval=nan"]:
+        rv = client.get("/admin/profile?seconds=0.05&" + query,
+                        headers=_auth_header("bob", "pw"))
+        assert rv.status_code == 400
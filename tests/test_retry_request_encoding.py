@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""Test retry_request method dispatch and body encodings.
+"""
+import gzip
+import io
+import json
+import threading
+import apikit
+import pytest
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+
+class _Echo(BaseHTTPRequestHandler):
+    """Upstream which describes the request it received."""
+
+    def _echo(self):
+        """Reply with method, path, headers and body."""
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.GzipFile(fileobj=io.BytesIO(body)).read()
+        reply = json.dumps({
+            "method": self.command,
+            "path": self.path,
+            "content_type": self.headers.get("Content-Type"),
+            "content_encoding": self.headers.get("Content-Encoding"),
+            "length": length,
+            "body": body.decode("utf-8")}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    do_GET = do_PUT = do_POST = do_PATCH = do_DELETE = _echo
+
+    def log_message(self, *args):
+        """Be quiet."""
+        pass
+
+
+@pytest.fixture
+def upstream():
+    """Run an echo server for the duration of a test."""
+    server = HTTPServer(("127.0.0.1", 0), _Echo)
+    thd = threading.Thread(target=server.serve_forever)
+    thd.daemon = True
+    thd.start()
+    yield "http://127.0.0.1:%d/" % server.server_address[1]
+    server.shutdown()
+
+
+def test_retry_request_dispatch(upstream):
+    """Test that each method is sent as itself.
+    """
+    for method in ["GET", "PUT", "POST", "PATCH", "DELETE"]:
+        resp = apikit.retry_request(method, upstream, payload={"a": 1})
+        echo = resp.json()
+        assert echo["method"] == method
+        if method in ["GET", "DELETE"]:
+            assert echo["path"] == "/?a=1"
+        else:
+            assert json.loads(echo["body"]) == {"a": 1}
+            assert echo["content_type"] == "application/json"
+    with pytest.raises(apikit.BackendError):
+        apikit.retry_request("TRACE", upstream)
+
+
+def test_retry_request_encoding(upstream):
+    """Test pre-serialized, compressed and custom-encoded bodies.
+    """
+    echo = apikit.retry_request("POST", upstream, data=b"raw bytes",
+                                headers={"Content-Type": "text/plain"}).json()
+    assert echo["body"] == "raw bytes"
+    assert echo["content_type"] == "text/plain"
+    echo = apikit.retry_request("POST", upstream, data=bytearray(b"x" * 2048),
+                                compress_threshold=1024).json()
+    assert echo["body"] == "x" * 2048
+    assert echo["content_encoding"] == "gzip"
+    echo = apikit.retry_request("POST", upstream,
+                                data={"a": "1 2", "b": ["x", "y"]}).json()
+    assert sorted(echo["body"].split("&")) == ["a=1+2", "b=x", "b=y"]
+    assert echo["content_type"] == "application/x-www-form-urlencoded"
+    payload = {"records": ["x" * 10] * 1000}
+    echo = apikit.retry_request("PUT", upstream, payload=payload,
+                                compress_threshold=1024).json()
+    assert echo["content_encoding"] == "gzip"
+    assert echo["length"] < 1024
+    assert json.loads(echo["body"]) == payload
+    echo = apikit.retry_request("PUT", upstream, payload={"a": 1},
+                                compress_threshold=1024).json()
+    assert echo["content_encoding"] is None
+    codec = ("text/x-repr", lambda p: repr(p).encode("utf-8"))
+    echo = apikit.retry_request("POST", upstream, payload=[1, 2],
+                                encoding=codec).json()
+    assert echo["body"] == "[1, 2]"
+    assert echo["content_type"] == "text/x-repr"
+    with pytest.raises(apikit.BackendError):
+        apikit.retry_request("POST", upstream, payload=[1], encoding="xml")
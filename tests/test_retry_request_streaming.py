@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+"""Test streamed uploads and resumable downloads in retry_request.
+"""
+import io
+import threading
+import apikit
+import pytest
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+BLOB = bytes(bytearray(range(256))) * 4096
+
+
+class _Artifacts(BaseHTTPRequestHandler):
+    """Upstream which fails first attempts and breaks first transfers."""
+
+    protocol_version = "HTTP/1.1"
+    uploads = []
+    hits = {}
+    ranges = []
+
+    def do_PUT(self):
+        """Store an upload, refusing the first attempt."""
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        _Artifacts.uploads.append(body)
+        status = 503 if len(_Artifacts.uploads) == 1 else 201
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        """Serve BLOB, cutting off the first transfer half way.  `/flaky`
+        paths then drop the second request without answering.
+        """
+        hits = _Artifacts.hits.get(self.path, 0) + 1
+        _Artifacts.hits[self.path] = hits
+        if self.path.startswith("/flaky") and hits == 2:
+            self.close_connection = True
+            return
+        ranged = self.path == "/ranged"
+        start = 0
+        rng = self.headers.get("Range")
+        if rng:
+            _Artifacts.ranges.append((self.path, rng))
+        if ranged and rng:
+            start = int(rng[len("bytes="):-1])
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %d-%d/%d" %
+                             (start, len(BLOB) - 1, len(BLOB)))
+        else:
+            self.send_response(200)
+        if ranged:
+            self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", '"v1"')
+        self.send_header("Content-Length", str(len(BLOB) - start))
+        self.end_headers()
+        if hits == 1:
+            self.wfile.write(BLOB[:len(BLOB) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(BLOB[start:])
+
+    def log_message(self, *args):
+        """Be quiet."""
+        pass
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    """Threaded HTTP server, so kept-alive connections do not block."""
+
+    daemon_threads = True
+
+
+@pytest.fixture
+def upstream():
+    """Run the artifact server for the duration of a test."""
+    _Artifacts.uploads = []
+    _Artifacts.hits = {}
+    _Artifacts.ranges = []
+    server = _Server(("127.0.0.1", 0), _Artifacts)
+    thd = threading.Thread(target=server.serve_forever)
+    thd.daemon = True
+    thd.start()
+    yield "http://127.0.0.1:%d" % server.server_address[1]
+    server.shutdown()
+
+
+def test_streamed_upload(upstream):
+    """Test that streamed bodies are replayed on retry.
+    """
+    fobj = io.BytesIO(b"header" + BLOB)
+    fobj.read(6)
+    resp = apikit.retry_request("PUT", upstream + "/up", data=fobj,
+                                tries=2, initial_interval=0)
+    assert resp.status_code == 201
+    assert _Artifacts.uploads == [BLOB, BLOB]
+    _Artifacts.uploads = []
+    chunks = (BLOB[i:i + 1000] for i in range(0, len(BLOB), 1000))
+    resp = apikit.retry_request("PUT", upstream + "/up", data=chunks,
+                                tries=2, initial_interval=0)
+    assert resp.status_code == 201
+    assert _Artifacts.uploads == [BLOB, BLOB]
+
+
+def test_resumed_download(upstream):
+    """Test that interrupted downloads resume, with and without Range.
+    """
+    for path in ["/ranged", "/plain"]:
+        chunks = apikit.retry_request("GET", upstream + path, stream=True,
+                                      tries=2, initial_interval=0)
+        assert chunks.status_code == 200
+        assert b"".join(chunks) == BLOB
+    assert chunks.response.status_code == 200
+    dest = io.BytesIO()
+    resp = apikit.retry_request("GET", upstream + "/dest",
+                                destination=dest, tries=2,
+                                initial_interval=0)
+    assert resp.status_code == 200
+    assert dest.getvalue() == BLOB
+    # Out of tries
+    with pytest.raises(apikit.BackendError):
+        b"".join(apikit.retry_request("GET", upstream + "/once",
+                                      stream=True, tries=1))
+    assert _Artifacts.hits == {"/ranged": 2, "/plain": 2, "/dest": 2,
+                               "/once": 1}
+    assert _Artifacts.ranges == [("/ranged", "bytes=%d-" % (len(BLOB) // 2))]
+
+
+def test_resume_unreachable(upstream):
+    """Test that connection errors while resuming are retried, and end in
+    a BackendError once out of tries.
+    """
+    chunks = apikit.retry_request("GET", upstream + "/flaky", stream=True,
+                                  tries=3, initial_interval=0)
+    assert b"".join(chunks) == BLOB
+    with pytest.raises(apikit.BackendError):
+        b"".join(apikit.retry_request("GET", upstream + "/flaky2",
+                                      stream=True, tries=2,
+                                      initial_interval=0))
+    assert _Artifacts.hits == {"/flaky": 3, "/flaky2": 2}
+
+
+class _Truncated(object):
+    """Streamed response whose body ends early without an error, as under
+    urllib3 1.x.
+    """
+
+    def __init__(self, body, length):
+        self.headers = {"Content-Length": str(length)}
+        self.status_code = 200
+        self.body = body
+
+    def iter_content(self, chunk_size):
+        """Yield the body."""
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i:i + chunk_size]
+
+    def close(self):
+        """Nothing to release."""
+        pass
+
+
+def test_short_body():
+    """Test that a quietly truncated body is resumed.
+    """
+    offsets = []
+
+    def reopen(offset, exc):
+        """Serve the rest of the body."""
+        offsets.append(offset)
+        assert "ended after" in str(exc)
+        return _Truncated(BLOB[offset:], len(BLOB) - offset), 0
+
+    chunks = apikit.ResponseStream(_Truncated(BLOB[:1000], len(BLOB)),
+                                   reopen, chunk_size=300)
+    assert b"".join(chunks) == BLOB
+    assert offsets == [1000]
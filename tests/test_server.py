@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""Test the pre-fork server.
+"""
+import os
+import signal
+import socket
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+import requests
+
+APP = textwrap.dedent("""
+    import os
+    import sys
+    import apikit
+
+    app = apikit.APIFlask("bob", "2.0", "http://example.repo", "BobApp")
+
+    @app.route("/pid")
+    def pid():
+        return str(os.getpid())
+
+    app.serve(host="127.0.0.1", port=int(sys.argv[1]), workers=2,
+              threads=2, max_requests=3, graceful_timeout=5)
+""")
+
+
+def _free_port():
+    """Find a port nobody is listening on."""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def _get(url, timeout=10):
+    """GET, retrying until the server is up."""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return requests.get(url, timeout=5)
+        except requests.ConnectionError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def test_server():
+    """Test serving, recycling, graceful restart and shutdown.
+    """
+    port = _free_port()
+    proc = subprocess.Popen([sys.executable, "-c", APP, str(port)])
+    base = "http://127.0.0.1:%d" % port
+    try:
+        resp = _get(base + "/metadata")
+        assert resp.status_code == 200
+        assert resp.json()["name"] == "bob"
+        pids = set()
+        for _ in range(12):
+            resp = _get(base + "/pid")
+            assert resp.status_code == 200
+            pids.add(int(resp.text))
+        # Two workers at three requests each cannot serve twelve requests
+        assert len(pids) > 2
+        assert proc.pid not in pids
+        os.kill(proc.pid, signal.SIGHUP)
+        time.sleep(0.5)
+        assert _get(base + "/pid").status_code == 200
+        os.kill(proc.pid, signal.SIGTERM)
+        assert proc.wait(timeout=10) == 0
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+
+
+def test_busy_worker_stops_accepting():
+    """Test that a worker with no free thread leaves connections to others.
+    """
+    # pylint: disable=protected-access
+    from apikit.server import PreforkServer, _PooledWSGIServer
+    listener = PreforkServer(None, host="127.0.0.1", port=0, workers=1).bind()
+    release = threading.Event()
+
+    def busy_app(environ, start_response):
+        """Block until released."""
+        release.wait(10)
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        return [b"A"]
+
+    def idle_app(environ, start_response):
+        """Answer at once."""
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        return [b"B"]
+
+    url = "http://127.0.0.1:%d/" % listener.getsockname()[1]
+    busy = _PooledWSGIServer(listener, busy_app, 1, lambda: None)
+    servers = [busy]
+    threading.Thread(target=busy.serve_forever,
+                     kwargs={"poll_interval": 0.05}).start()
+    try:
+        first = threading.Thread(target=requests.get, args=(url,))
+        first.start()
+        deadline = time.time() + 5
+        while busy.slots._value and time.time() < deadline:
+            time.sleep(0.01)
+        idle = _PooledWSGIServer(listener, idle_app, 1, lambda: None)
+        servers.append(idle)
+        threading.Thread(target=idle.serve_forever,
+                         kwargs={"poll_interval": 0.05}).start()
+        for _ in range(3):
+            assert requests.get(url, timeout=5).text == "B"
+        release.set()
+        first.join()
+    finally:
+        release.set()
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+        listener.close()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""Test slow request detection.
+"""
+import time
+import apikit
+import pytest
+from apikit.testing import FaultProfile, StubServer
+
+
+class _Recorder(object):
+    """Stand-in logger which remembers warnings."""
+
+    def __init__(self):
+        self.events = []
+
+    def warning(self, event, **kwargs):
+        """Record a warning."""
+        self.events.append((event, kwargs))
+
+
+def test_slow_request():
+    """Test that slow requests are logged with stacks and upstream timings.
+    """
+    server = StubServer({"/": FaultProfile(body="ok")})
+    server.start()
+    upstream = server.url_for("/")
+    flapp = apikit.APIFlask("bob", "2.0", "http://example.repo", "BobApp")
+    recorder = _Recorder()
+    flapp.config["LOGGER"] = recorder
+    apikit.SlowRequestDetector(flapp, threshold=0.05, rate_limit=60)
+
+    @flapp.route("/slow")
+    def slow():
+        """Call upstream, then dawdle."""
+        apikit.retry_request("GET", upstream)
+        time.sleep(0.2)
+        return "done"
+
+    @flapp.route("/fast")
+    def fast():
+        """Return at once."""
+        return "done"
+
+    try:
+        client = flapp.test_client()
+        assert client.get("/fast").status_code == 200
+        assert recorder.events == []
+        assert client.get("/slow").status_code == 200
+        assert len(recorder.events) == 1
+        event, fields = recorder.events[0]
+        assert event == "Slow request"
+        assert fields["route"] == "/slow"
+        assert fields["elapsed"] >= 0.2
+        assert len(fields["upstream"]) == 1
+        assert fields["upstream"][0]["status"] == 200
+        assert fields["upstream"][0]["url"] == upstream
+        assert any("in slow" in line for line in fields["stack"])
+        # Rate limited
+        client.get("/slow")
+        assert len(recorder.events) == 1
+        flapp.config["SLOW_REQUEST_DETECTOR"].rate_limit = 0
+        client.get("/slow")
+        assert len(recorder.events) == 2
+        assert recorder.events[1][1]["suppressed"] == 1
+    finally:
+        server.stop()
+    with pytest.raises(ValueError):
+        apikit.SlowRequestDetector(threshold=0)
+
+
+def test_slow_unmatched():
+    """Test that unmatched paths share one rate-limit entry."""
+    flapp = apikit.APIFlask("bob", "2.0", "http://example.repo", "BobApp")
+    recorder = _Recorder()
+    flapp.config["LOGGER"] = recorder
+    detector = apikit.SlowRequestDetector(flapp, threshold=0.01,
+                                          rate_limit=60)
+    flapp.before_request(lambda: time.sleep(0.02))
+    client = flapp.test_client()
+    for idx in range(5):
+        assert client.get("/scan/%d" % idx).status_code == 404
+    assert len(recorder.events) == 1
+    assert recorder.events[0][1]["route"] == "<unmatched>"
+    assert recorder.events[0][1]["path"] == "/scan/0"
+    # pylint: disable=protected-access
+    assert list(detector._last) == ["<unmatched>"]
+    assert detector._suppressed == {"<unmatched>": 4}
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+"""Test the batched TCP syslog transport against a stub collector.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import apikit
+import pytest
+try:
+    from socketserver import StreamRequestHandler, ThreadingTCPServer
+except ImportError:
+    from SocketServer import StreamRequestHandler, ThreadingTCPServer
+
+
+class _Collector(StreamRequestHandler):
+    """Stub collector which parses RFC 6587 octet-counted frames."""
+
+    def handle(self):
+        """Read frames until the connection closes."""
+        while True:
+            length = b""
+            while True:
+                char = self.rfile.read(1)
+                if not char:
+                    return
+                if char == b" ":
+                    break
+                length += char
+            self.server.frames.append(self.rfile.read(int(length)))
+
+
+def _free_port():
+    """Find a port nobody is listening on."""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def _collector(port):
+    """Start a collector on `port`."""
+    ThreadingTCPServer.allow_reuse_address = True
+    server = ThreadingTCPServer(("127.0.0.1", port), _Collector)
+    server.daemon_threads = True
+    server.frames = []
+    thd = threading.Thread(target=server.serve_forever)
+    thd.daemon = True
+    thd.start()
+    return server
+
+
+def _wait_for(predicate, timeout=10):
+    """Poll until `predicate()` is true."""
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.05)
+    return predicate()
+
+
+def _logger(name, handler):
+    """Logger sending only to `handler`."""
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    return logger
+
+
+def test_tcp_syslog(tmpdir):
+    """Test that nothing is lost while the collector is away.
+    """
+    port = _free_port()
+    spool = str(tmpdir.join("spool"))
+    handler = apikit.TCPSysLogHandler("127.0.0.1", port, spool=spool,
+                                      batch_bytes=4096, flush_interval=0.05,
+                                      max_backoff=0.2)
+    logger = _logger("test_tcp_syslog", handler)
+    long_line = "x" * 10000
+    try:
+        # Collector is down: everything is spooled
+        for n in range(200):
+            logger.info("before %d", n)
+        logger.warning(long_line)
+        handler.flush()
+        assert os.path.getsize(spool) > 0
+        server = _collector(port)
+        try:
+            for n in range(200):
+                logger.info("after %d", n)
+            expected = (["<14>before %d" % n for n in range(200)] +
+                        ["<12>" + long_line] +
+                        ["<14>after %d" % n for n in range(200)])
+            assert _wait_for(lambda: len(server.frames) >= len(expected))
+            assert [f.decode("utf-8") for f in server.frames] == expected
+            assert _wait_for(lambda: os.path.getsize(spool) == 0)
+        finally:
+            server.shutdown()
+            server.server_close()
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+
+def test_collector_down():
+    """Test that the sender idles, and counts dropped records, while the
+    collector is down and there is no spool.
+    """
+    handler = apikit.TCPSysLogHandler("127.0.0.1", _free_port(),
+                                      batch_bytes=16, flush_interval=0.05,
+                                      max_backoff=0.2, buffer_bytes=400)
+    logger = _logger("test_collector_down", handler)
+    try:
+        # Each frame is 16 bytes, so 20 fit in the buffer.
+        for n in range(20):
+            logger.info("record %02d", n)
+        # Reach the longest backoff, then measure the CPU used.
+        time.sleep(0.5)
+        before = os.times()
+        time.sleep(1)
+        after = os.times()
+        assert (after[0] - before[0]) + (after[1] - before[1]) < 0.3
+        assert handler.dropped == 0
+        for n in range(20, 50):
+            logger.info("record %02d", n)
+        assert _wait_for(lambda: handler.dropped == 25)
+        assert handler._queued == 400
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+def test_shared_spool(tmpdir):
+    """Test that two processes sharing a spool deliver every frame once,
+    each in order.
+    """
+    port = _free_port()
+    spool = str(tmpdir.join("spool"))
+    handler = apikit.TCPSysLogHandler("127.0.0.1", port, spool=spool,
+                                      batch_bytes=512, flush_interval=0.05,
+                                      max_backoff=0.2)
+    logger = _logger("test_shared_spool", handler)
+    ready, done = os.pipe()
+    pid = os.fork()
+    tag = "child" if pid == 0 else "parent"
+    try:
+        # Collector is down: both processes spool
+        for n in range(100):
+            logger.info("%s before %d", tag, n)
+        handler.flush()
+        if pid == 0:
+            os.write(done, b"x")
+            for n in range(100):
+                logger.info("%s after %d", tag, n)
+                time.sleep(0.005)
+            handler.flush()
+            assert _wait_for(lambda: os.path.getsize(spool) == 0)
+            handler.close()
+            os._exit(0)
+        os.read(ready, 1)
+        server = _collector(port)
+        try:
+            for n in range(100):
+                logger.info("%s after %d", tag, n)
+                time.sleep(0.005)
+            assert os.waitpid(pid, 0)[1] == 0
+            handler.flush()
+            assert _wait_for(lambda: len(server.frames) >= 400)
+            time.sleep(0.2)
+            frames = [f.decode("utf-8") for f in server.frames]
+            for name in ("child", "parent"):
+                assert [f for f in frames if f.startswith("<14>" + name)] == (
+                    ["<14>%s before %d" % (name, n) for n in range(100)] +
+                    ["<14>%s after %d" % (name, n) for n in range(100)])
+            assert len(frames) == 400
+        finally:
+            server.shutdown()
+            server.server_close()
+    finally:
+        if pid == 0:
+            os._exit(1)
+        logger.removeHandler(handler)
+        handler.close()
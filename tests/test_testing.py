@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""Test the fault-injecting stub server and load driver.
+"""
+import time
+import apikit
+import pytest
+import requests
+from apikit import testing
+
+
+def test_stub_faults():
+    """Test scripted faults against retry_request and raise_from_response.
+    """
+    stub = testing.StubServer(seed=42)
+    stub.route("/flaky", schedule=[503, 429], retry_after=1,
+               body={"ok": True})
+    stub.route("/down", status=200, error_rate=1.0, error_status=502)
+    stub.route("/reset", schedule=[0])
+    stub.route("/slow", latency=0.2, body=b"x" * 1000,
+               bytes_per_second=10000)
+    with stub:
+        seen = []
+        resp = apikit.retry_request(
+            "GET", stub.url_for("/flaky"), tries=3, initial_interval=0,
+            callback=lambda **kw: seen.append(kw["status"]))
+        assert resp.json() == {"ok": True}
+        assert seen == [503, 429]
+        assert stub.hits["/flaky"] == 3
+        resp = requests.get(stub.url_for("/down"))
+        with pytest.raises(apikit.BackendError) as exc:
+            apikit.raise_from_response(resp)
+        assert exc.value.status_code == 502
+        with pytest.raises(requests.ConnectionError):
+            requests.get(stub.url_for("/reset"))
+        start = time.time()
+        assert len(requests.get(stub.url_for("/slow")).content) == 1000
+        assert time.time() - start >= 0.25
+        assert requests.get(stub.url_for("/nowhere")).status_code == 404
+        resp = requests.get(stub.url_for("/flaky"))
+        assert "Retry-After" not in resp.headers
+
+
+def test_retry_after_header():
+    """Test that injected errors carry Retry-After.
+    """
+    with testing.StubServer({"/busy": testing.FaultProfile(
+            error_rate=1.0, error_status=429, retry_after=7)}) as stub:
+        resp = requests.get(stub.url_for("/busy"))
+        assert resp.status_code == 429
+        assert resp.headers["Retry-After"] == "7"
+
+
+def test_run_load():
+    """Test the load driver against an APIFlask app calling the stub.
+    """
+    with testing.StubServer(seed=1) as stub:
+        stub.route("/data", latency=testing.lognormal(0.002, 0.5),
+                   error_rate=lambda elapsed: 0.2)
+        app = apikit.APIFlask("bob", "2.0", "http://example.repo", "BobApp")
+
+        @app.route("/proxy")
+        def proxy():
+            """Relay the upstream."""
+            resp = apikit.retry_request("GET", stub.url_for("/data"),
+                                        tries=5, initial_interval=0)
+            return resp.text
+
+        report = testing.run_load(app, "/proxy", total=60, concurrency=4)
+        assert report.requests == 60
+        assert report.statuses.get(200, 0) + report.errors == 60
+        assert report.throughput > 0
+        assert report.percentile(50) <= report.percentile(99)
+        assert set(report.to_dict()) >= {"p50", "p90", "p99", "throughput"}
+        assert "req/s" in str(report)
+        report = testing.run_load(stub.url, "/data", total=20,
+                                  concurrency=2)
+        assert report.requests == 20
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""Test distributed tracing.
+"""
+import apikit
+from apikit.testing import StubServer
+
+
+class _Collector(object):
+    """Exporter which remembers spans."""
+
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        """Record a batch."""
+        self.spans.extend(spans)
+
+
+def test_tracing():
+    """Test server and client spans, retries, and context propagation."""
+    collector = _Collector()
+    flapp = apikit.APIFlask("bob", "2.0", "http://example.repo", "BobApp")
+    tracer = apikit.Tracer(flapp, exporter=collector)
+    with StubServer() as stub:
+        stub.route("/up", schedule=[503])
+        seen = []
+
+        @flapp.route("/call")
+        def call():
+            """Call upstream, retrying once."""
+            resp = apikit.retry_request("GET", stub.url_for("/up"),
+                                        initial_interval=0.01)
+            seen.append(resp.request.headers.get("traceparent"))
+            return "done"
+
+        client = flapp.test_client()
+        parent = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+        assert client.get("/call", headers={"traceparent": parent}
+                          ).status_code == 200
+        tracer.flush()
+    server = [s for s in collector.spans if s["kind"] == "server"]
+    attempts = [s for s in collector.spans if s["kind"] == "client"]
+    assert len(server) == 1
+    assert len(attempts) == 2
+    assert server[0]["trace_id"] == "0af7651916cd43dd8448eb211c80319c"
+    assert server[0]["parent_id"] == "b7ad6b7169203331"
+    assert server[0]["name"] == "GET /call"
+    assert server[0]["attributes"]["http.status_code"] == 200
+    for span in attempts:
+        assert span["trace_id"] == server[0]["trace_id"]
+        assert span["parent_id"] == server[0]["span_id"]
+    first, second = sorted(attempts, key=lambda s: s["start"])
+    assert first["attributes"]["http.status_code"] == 503
+    assert first["events"][0]["name"] == "backoff"
+    assert second["attributes"]["attempt"] == 2
+    assert seen[0] == "00-%s-%s-01" % (second["trace_id"], second["span_id"])
+
+
+def test_sampling(tmpdir):
+    """Test head-based sampling and the JSON lines exporter."""
+    path = str(tmpdir.join("spans.jsonl"))
+    flapp = apikit.APIFlask("bob", "2.0", "http://example.repo", "BobApp")
+    tracer = apikit.Tracer(flapp, exporter=apikit.JSONLinesExporter(path),
+                           sample_rate=0.0)
+
+    @flapp.route("/hello")
+    def hello():
+        """Trivial view."""
+        return "hi"
+
+    client = flapp.test_client()
+    client.get("/hello")
+    client.get("/hello", headers={
+        "traceparent":
+        "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"})
+    tracer.flush()
+    with open(path) as spans:
+        lines = spans.readlines()
+    assert len(lines) == 1
+    assert "0af7651916cd43dd8448eb211c80319c" in lines[0]
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""Test upstream warmup and DNS caching.
+"""
+import socket
+import time
+import apikit
+import pytest
+import requests
+from apikit.testing import StubServer
+from apikit.warmup import dns_cache, upstream_session
+
+
+def test_dns_cache():
+    """Test that lookups are cached until they expire."""
+    cache = apikit.DNSCache(ttl=0.1)
+    first = cache.resolve("localhost", 80)
+    assert cache.resolve("localhost", 80) is first
+    time.sleep(0.15)
+    assert cache.resolve("localhost", 80) is not first
+    cache.invalidate("localhost")
+    assert cache.resolve("localhost", 80) is not first
+    assert all(addr[0] == socket.AF_INET for addr in
+               cache.resolve("localhost", 80, socket.AF_INET))
+
+
+def test_warm_up():
+    """Test warming up declared upstreams, good and bad."""
+    flapp = apikit.APIFlask("bob", "2.0", "http://example.repo", "BobApp")
+    with StubServer() as stub:
+        stub.route("/", status=404)
+        dead = "http://127.0.0.1:1/"
+        flapp.config["UPSTREAMS"] = [stub.url + "/", dead]
+        warmup = flapp.warm_up(connections=2, timeout=2, background=False)
+        assert flapp.config["WARMUP"] is warmup
+        assert warmup.ready.is_set()
+        assert warmup.elapsed > 0
+        assert warmup.results[stub.url + "/"]["ok"]
+        assert not warmup.results[dead]["ok"]
+        assert stub.hits["/"] == 2
+        port = stub._server.server_address[1]
+        # pylint: disable=protected-access
+        assert [key for key in dns_cache._entries
+                if key[:2] == ("127.0.0.1", port)]
+        stub.route("/data", body={"a": 1})
+        resp = apikit.retry_request("GET", stub.url_for("/data"))
+        assert resp.json() == {"a": 1}
+    background = flapp.warm_up()
+    assert background.ready.wait(5)
+
+
+def test_connect_timeout():
+    """Test that a connect timeout through the DNS cache is still reported
+    as one.
+    """
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(0)
+    port = server.getsockname()[1]
+    # Fill the listen queue, so that further connection attempts hang.
+    clients = []
+    for _ in range(8):
+        client = socket.socket()
+        client.setblocking(False)
+        try:
+            client.connect(("127.0.0.1", port))
+        except (OSError, socket.error):
+            pass
+        clients.append(client)
+    try:
+        with pytest.raises(requests.exceptions.ConnectTimeout):
+            upstream_session().get("http://127.0.0.1:%d/" % port,
+                                   timeout=(0.2, 1))
+    finally:
+        for client in clients:
+            client.close()
+        server.close()